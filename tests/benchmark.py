@@ -0,0 +1,372 @@
+"""
+Benchmarks the CLI commands and the service stages against a synthetic
+WriteFreely archive, served by an in-process stand-in for the API.
+
+    python -m tests.benchmark --posts 50000 --output benchmark.json
+    python -m tests.benchmark --posts 50000 --compare benchmark.json
+"""
+
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+from sqlite_utils import Database
+
+from writefreely_to_sqlite import service
+from writefreely_to_sqlite.client import WriteFreelyClient
+from writefreely_to_sqlite.utils import chunks
+
+from .fake_writefreely import FakeWriteFreely
+from .synthetic import generate_archive, make_export
+
+BATCH_SIZE = 100
+
+# Runs the CLI in a fresh interpreter, so each command's peak RSS is its own.
+CLI_SCRIPT = "import sys; from writefreely_to_sqlite.cli import cli; cli()"
+
+# The CLI commands to benchmark, as (name, arguments, table counted as the
+# rows written). {db}, {auth} and {export} in the arguments are replaced by
+# the paths of the database, the auth file and a JSON export of the
+# archive. The repeat sync runs against the database left by sync.
+COMMANDS: Tuple[Tuple[str, Tuple[str, ...], str], ...] = (
+    ("user", ("user", "{db}", "--auth={auth}"), "users"),
+    ("collections", ("collections", "{db}", "--auth={auth}"), "collections"),
+    ("posts", ("posts", "{db}", "--auth={auth}"), "posts"),
+    (
+        "posts --by-collection",
+        ("posts", "{db}", "--auth={auth}", "--by-collection"),
+        "posts",
+    ),
+    ("sync", ("sync", "{db}", "--auth={auth}"), "posts"),
+    (
+        "sync (repeat)",
+        ("sync", "{db}", "--auth={auth}", "--incremental"),
+        "posts",
+    ),
+    ("import", ("import", "{db}", "{export}"), "posts"),
+)
+
+
+def get_max_rss(rusage: resource.struct_rusage) -> int:
+    # Linux reports ru_maxrss in KiB, macOS in bytes.
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_command(args: List[str]) -> Tuple[float, int]:
+    """
+    Run a CLI command in a subprocess, returns the wall time and the peak
+    RSS of the subprocess.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", CLI_SCRIPT, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        stderr = process.stderr.read().decode() if process.stderr else ""
+        raise RuntimeError(f"{' '.join(args)} failed:\n{stderr}")
+
+    return seconds, get_max_rss(rusage)
+
+
+def benchmark_commands(
+    domain: str, archive: Dict[str, Any], directory: Path
+) -> List[Dict[str, Any]]:
+    export_path = directory / "export.json"
+    export_path.write_text(json.dumps(make_export(archive)))
+
+    auth_path = directory / "auth.json"
+    auth_path.write_text(
+        json.dumps(
+            {
+                "writefreely_domain": domain,
+                "writefreely_access_token": "benchmark",
+            }
+        )
+    )
+
+    results = []
+    for name, args, table in COMMANDS:
+        if name.startswith("sync"):
+            db_path = directory / "sync.db"
+        else:
+            db_path = directory / f"{name.replace(' ', '')}.db"
+
+        seconds, peak_rss = run_command(
+            [
+                arg.format(db=db_path, auth=auth_path, export=export_path)
+                for arg in args
+            ]
+        )
+        rows = Database(db_path)[table].count
+
+        results.append(
+            {
+                "name": name,
+                "seconds": seconds,
+                "peak_rss_bytes": peak_rss,
+                "rows": rows,
+                "rows_per_second": rows / seconds,
+            }
+        )
+
+    return results
+
+
+def measure_stage(name: str, func: Callable[[], int]) -> Dict[str, Any]:
+    """
+    Run a stage once, returns its wall time, peak memory allocated and rows
+    per second.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "seconds": seconds,
+        "peak_traced_bytes": peak,
+        "rows": rows,
+        "rows_per_second": rows / seconds if seconds else None,
+    }
+
+
+def fresh_db() -> Database:
+    db = Database(memory=True)
+    service.build_database(db)
+    return db
+
+
+def fresh_db_without_triggers() -> Database:
+    db = fresh_db()
+    # Leave the full-text search triggers out, so only the writers are
+    # measured.
+    for trigger in db.triggers:
+        db.execute(f"DROP TRIGGER [{trigger.name}]")
+    return db
+
+
+def write_in_batches(db: Database, rows: List[Tuple[Any, ...]]):
+    # A commit per batch, so the cost of syncing each commit shows.
+    for batch in chunks(rows, BATCH_SIZE):
+        with db.conn:
+            service.write_posts(db, batch, "matt")
+    service.checkpoint(db)
+
+
+def benchmark_stages(domain: str, directory: Path) -> List[Dict[str, Any]]:
+    client = WriteFreelyClient(domain=domain, access_token="benchmark")
+    state: Dict[str, Any] = {}
+
+    def build_database():
+        state["db"] = Database(memory=True)
+        service.build_database(state["db"])
+        return 1
+
+    def fetch_posts():
+        state["posts"] = list(service.iter_posts(client))
+        return len(state["posts"])
+
+    def project_posts():
+        state["rows"], state["view_rows"] = service.project_posts(
+            state["posts"], "matt"
+        )
+        return len(state["rows"])
+
+    def write_posts(db, bulk_load):
+        with db.conn:
+            if bulk_load:
+                with service.fts_bulk_load(db):
+                    for batch in chunks(state["rows"], BATCH_SIZE):
+                        service.write_posts(db, batch, "matt")
+            else:
+                for batch in chunks(state["rows"], BATCH_SIZE):
+                    service.write_posts(db, batch, "matt")
+        return len(state["rows"])
+
+    def upsert_all():
+        db = fresh_db_without_triggers()
+        with db.conn:
+            db["posts"].upsert_all(
+                (dict(zip(service.POST_COLUMNS, row)) for row in state["rows"]),
+                pk="id",
+                batch_size=BATCH_SIZE,
+            )
+        return len(state["rows"])
+
+    def upsert_rows():
+        db = fresh_db_without_triggers()
+        with db.conn:
+            for batch in chunks(state["rows"], BATCH_SIZE):
+                service.upsert_rows(
+                    db, "posts", service.POST_COLUMNS, batch, pk=("id",)
+                )
+        return len(state["rows"])
+
+    def write_posts_with_profile(profile):
+        # On disk, since the profiles differ in how they sync to it.
+        db = service.open_database(directory / f"{profile}.db", profile=profile)
+        service.build_database(db)
+        db.conn.commit()
+        write_in_batches(db, state["rows"])
+        return len(state["rows"])
+
+    def write_post_views():
+        db = state["db"]
+        fetched_at = service.utc_timestamp()
+        with db.conn:
+            for batch in chunks(state["view_rows"], BATCH_SIZE):
+                service.write_post_views(db, batch, fetched_at=fetched_at)
+        return len(state["view_rows"])
+
+    stages: Tuple[Tuple[str, Callable[[], int]], ...] = (
+        ("build_database", build_database),
+        ("iter_posts", fetch_posts),
+        ("project_posts", project_posts),
+        ("upsert_all (sqlite-utils)", upsert_all),
+        ("upsert_rows", upsert_rows),
+        ("write_posts", lambda: write_posts(state["db"], False)),
+        ("write_posts (fts_bulk_load)", lambda: write_posts(fresh_db(), True)),
+        *(
+            (
+                f"write_posts ({profile} profile)",
+                # Bind the profile now, not when the stage runs.
+                lambda profile=profile: write_posts_with_profile(profile),
+            )
+            for profile in service.WRITE_PROFILES
+        ),
+        ("write_post_views", write_post_views),
+        (
+            "update_post_derived",
+            lambda: service.update_post_derived(state["db"]),
+        ),
+    )
+
+    return [measure_stage(name, func) for name, func in stages]
+
+
+def run_benchmark(
+    post_count: int, collection_count: int, seed: int
+) -> Dict[str, Any]:
+    """
+    Returns the benchmark results for a generated archive, ready to be
+    written as JSON.
+    """
+    archive = generate_archive(
+        seed=seed, post_count=post_count, collection_count=collection_count
+    )
+
+    with FakeWriteFreely(archive) as fake, tempfile.TemporaryDirectory() as d:
+        commands = benchmark_commands(fake.domain, archive, Path(d))
+        stages = benchmark_stages(fake.domain, Path(d))
+
+    return {
+        "git_commit": get_git_commit(),
+        "python_version": platform.python_version(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "parameters": {
+            "posts": post_count,
+            "collections": collection_count,
+            "seed": seed,
+        },
+        "commands": commands,
+        "stages": stages,
+    }
+
+
+def compare(
+    old: Dict[str, Any], new: Dict[str, Any]
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Returns (section, name, old seconds, new seconds) for every command and
+    stage in both results.
+    """
+    rows = []
+    for section in ("commands", "stages"):
+        old_results = {r["name"]: r for r in old.get(section, [])}
+        for result in new.get(section, []):
+            if result["name"] in old_results:
+                rows.append(
+                    (
+                        section,
+                        result["name"],
+                        old_results[result["name"]]["seconds"],
+                        result["seconds"],
+                    )
+                )
+    return rows
+
+
+@click.command()
+@click.option("--posts", "post_count", type=int, default=5000)
+@click.option("--collections", "collection_count", type=int, default=10)
+@click.option("--seed", type=int, default=0)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default="-",
+    help="Path to write the results to as JSON, defaults to stdout",
+)
+@click.option(
+    "--compare",
+    "compare_path",
+    type=click.Path(dir_okay=False, exists=True),
+    default=None,
+    help="Earlier results to compare against",
+)
+def main(post_count, collection_count, seed, output, compare_path):
+    results = run_benchmark(post_count, collection_count, seed)
+
+    with click.open_file(output, "w") as file_obj:
+        json.dump(results, file_obj, indent=2)
+        file_obj.write("\n")
+
+    if compare_path:
+        with open(compare_path) as file_obj:
+            old = json.load(file_obj)
+        for section, name, old_seconds, new_seconds in compare(old, results):
+            change = (new_seconds - old_seconds) / old_seconds * 100
+            click.echo(
+                f"{section:<9} {name:<28} {old_seconds:>9.3f}s "
+                f"{new_seconds:>9.3f}s {change:>+7.1f}%",
+                err=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+An in-process stand-in for the WriteFreely API, serving a generated archive
+over HTTP, for benchmarks.
+"""
+
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+# WriteFreely returns ten posts per page of a collection.
+POSTS_PER_PAGE = 10
+
+
+def encode(data: Any) -> bytes:
+    return json.dumps({"code": 200, "data": data}).encode("utf-8")
+
+
+class FakeWriteFreely:
+    """
+    Serves the /me, /me/posts, /me/collections and collection posts
+    endpoints for an archive from synthetic.generate_archive. The response
+    bodies are encoded up front, so the server isn't what's measured.
+    """
+
+    def __init__(self, archive: Dict[str, Any]):
+        self.archive = archive
+        self.bytes_sent = 0
+
+        self.routes: Dict[str, bytes] = {
+            "/api/me": encode(archive["user"]),
+            "/api/me/posts": encode(archive["posts"]),
+            "/api/me/collections": encode(archive["collections"]),
+        }
+
+        self.collection_posts: Dict[str, list] = {
+            collection["alias"]: [] for collection in archive["collections"]
+        }
+        for post in archive["posts"]:
+            if "collection" in post:
+                collection_post = dict(post)
+                del collection_post["collection"]
+                self.collection_posts[post["collection"]["alias"]].append(
+                    collection_post
+                )
+
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def domain(self) -> str:
+        assert self.server is not None
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get_body(self, path: str, query: Dict[str, list]) -> Optional[bytes]:
+        if path in self.routes:
+            return self.routes[path]
+
+        parts = path.strip("/").split("/")
+        if (
+            len(parts) == 4
+            and parts[:2] == ["api", "collections"]
+            and parts[3] == "posts"
+            and parts[2] in self.collection_posts
+        ):
+            posts = self.collection_posts[parts[2]]
+            page = int(query.get("page", ["1"])[0])
+            first = (page - 1) * POSTS_PER_PAGE
+            return encode(
+                {
+                    "alias": parts[2],
+                    "total_posts": len(posts),
+                    "pages": math.ceil(len(posts) / POSTS_PER_PAGE),
+                    "posts": posts[first : first + POSTS_PER_PAGE],
+                }
+            )
+
+        return None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                body = fake.get_body(url.path, parse_qs(url.query))
+
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self) -> "FakeWriteFreely":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -59,3 +59,120 @@ ME_COLLECTIONS_RESPONSE = {
     "code": 200,
     "data": [COLLECTION_DATA],
 }
+
+
+def collection_posts_response(page, posts_per_page=10, total_posts=25):
+    """
+    Returns a page of a collection's posts response.
+    """
+    first = (page - 1) * posts_per_page
+    last = min(first + posts_per_page, total_posts)
+
+    posts = []
+    for index in range(first, last):
+        post = POST_DATA.copy()
+        del post["collection"]
+        post["id"] = f"post{index:012d}"
+        post["slug"] = f"post-{index}"
+        posts.append(post)
+
+    return {
+        "code": 200,
+        "data": {
+            "alias": COLLECTION_DATA["alias"],
+            "title": COLLECTION_DATA["title"],
+            "total_posts": total_posts,
+            "posts": posts,
+        },
+    }
+
+
+ANONYMOUS_POST_DATA = {
+    "id": "3ud5ac5vsuk62ls8",
+    "slug": None,
+    "appearance": "norm",
+    "language": "en",
+    "rtl": False,
+    "created": "2018-01-02T10:00:00Z",
+    "updated": "2018-01-02T10:00:00Z",
+    "title": "Anonymous",
+    "body": "Not in a blog.",
+    "tags": [],
+    "views": 3,
+}
+
+EXPORT_DATA = {
+    "username": "matt",
+    "email": "matt@example.com",
+    "created": "2015-02-03T02:41:19Z",
+    "collections": [
+        {
+            **COLLECTION_DATA,
+            "total_posts": 1,
+            "posts": [
+                {
+                    key: value
+                    for key, value in POST_DATA.items()
+                    if key != "collection"
+                }
+            ],
+        }
+    ],
+    "posts": [ANONYMOUS_POST_DATA],
+}
+
+# The tables of a WriteFreely instance's SQLite database that are imported.
+WRITEFREELY_SCHEMA = """
+CREATE TABLE users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT NOT NULL,
+  password TEXT NOT NULL,
+  email TEXT DEFAULT NULL,
+  created DATETIME NOT NULL,
+  UNIQUE (username)
+);
+CREATE TABLE collections (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  alias TEXT DEFAULT NULL UNIQUE,
+  title TEXT NOT NULL,
+  description TEXT NOT NULL,
+  style_sheet TEXT,
+  script TEXT,
+  format TEXT DEFAULT NULL,
+  privacy INTEGER NOT NULL,
+  owner_id INTEGER NOT NULL,
+  view_count INTEGER NOT NULL
+);
+CREATE TABLE posts (
+  id TEXT NOT NULL,
+  slug TEXT DEFAULT NULL,
+  modify_token TEXT DEFAULT NULL,
+  text_appearance TEXT NOT NULL DEFAULT 'norm',
+  language TEXT DEFAULT NULL,
+  rtl INTEGER DEFAULT NULL,
+  privacy INTEGER NOT NULL,
+  owner_id INTEGER DEFAULT NULL,
+  collection_id INTEGER DEFAULT NULL,
+  pinned_position INTEGER DEFAULT NULL,
+  created DATETIME NOT NULL,
+  updated DATETIME NOT NULL,
+  view_count INTEGER NOT NULL,
+  title TEXT NOT NULL,
+  content TEXT NOT NULL,
+  PRIMARY KEY (id)
+);
+INSERT INTO users VALUES
+  (1, 'matt', 'hash', X'00', '2015-02-03 02:41:19'),
+  (2, 'jane', 'hash', X'00', '2016-05-06 07:08:09');
+INSERT INTO collections VALUES
+  (1, 'matt', 'Matt', 'My great blog!', '', NULL, NULL, 1, 1, 46),
+  (2, 'jane', 'Jane', 'Notes', '', NULL, NULL, 2, 2, 7);
+INSERT INTO posts VALUES
+  ('7xe2dbojynjs1dkk', 'cool-post', NULL, 'norm', 'en', 0, 0, 1, 1, NULL,
+   '2017-11-12 03:49:36', '2017-11-12 03:49:36', 10, '',
+   'Cool post! #cool #post #cool'),
+  ('3ud5ac5vsuk62ls8', NULL, NULL, 'sans', 'en', 0, 0, 1, NULL, NULL,
+   '2018-01-02 10:00:00', '2018-01-02 10:00:00', 3, 'Draft', 'Not a blog.'),
+  ('9abcdefghijklmno', 'notes', NULL, 'norm', 'en', 0, 0, 2, 2, NULL,
+   '2019-03-04 05:06:07', '2019-03-04 05:06:07', 5, 'Notes', 'Jane''s.');
+"""
@@ -0,0 +1,172 @@
+"""
+A seeded generator of realistic WriteFreely users, collections and posts,
+for benchmarks.
+"""
+
+import datetime
+import math
+import random
+from typing import Any, Dict, List
+
+WORDS = (
+    "the of and to in is that for it as was with be by on not he this are "
+    "or his from at which but have an they you were her she there been one "
+    "all we their has would when if so no will more can out up about what "
+    "some time writing post blog write freely garden morning coffee river "
+    "notebook quiet city winter letter stranger library machine garden "
+    "weather memory autumn bicycle kitchen mountain window silence harbour"
+).split()
+
+TAGS = tuple(
+    f"{word}{suffix}"
+    for word in ("travel", "notes", "essay", "poetry", "code", "photo")
+    for suffix in ("", "s", "log")
+)
+
+# Post bodies follow a log-normal distribution of their length in words,
+# most are a few hundred words and a few are very long.
+BODY_WORDS_MEDIAN = 350
+BODY_WORDS_SIGMA = 1.0
+BODY_WORDS_MAX = 20000
+
+# The share of posts that aren't in a collection.
+ANONYMOUS_SHARE = 0.05
+
+START = datetime.datetime(2015, 1, 1)
+
+
+def make_body(rng: random.Random) -> str:
+    """
+    Returns a Markdown post body of a random length.
+    """
+    word_count = min(
+        BODY_WORDS_MAX,
+        max(
+            1,
+            int(
+                rng.lognormvariate(
+                    math.log(BODY_WORDS_MEDIAN), BODY_WORDS_SIGMA
+                )
+            ),
+        ),
+    )
+
+    paragraphs = []
+    while word_count > 0:
+        length = min(word_count, rng.randint(20, 120))
+        words = rng.choices(WORDS, k=length)
+        words[0] = words[0].capitalize()
+        paragraph = " ".join(words) + "."
+        if rng.random() < 0.1:
+            paragraph = f"## {paragraph}"
+        elif rng.random() < 0.1:
+            paragraph += f" [A link](https://example.com/{rng.choice(WORDS)})"
+        paragraphs.append(paragraph)
+        word_count -= length
+
+    return "\n\n".join(paragraphs)
+
+
+def make_timestamp(rng: random.Random) -> str:
+    moment = START + datetime.timedelta(seconds=rng.randint(0, 8 * 365 * 86400))
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_archive(
+    seed: int = 0,
+    post_count: int = 1000,
+    collection_count: int = 5,
+    username: str = "matt",
+) -> Dict[str, Any]:
+    """
+    Returns a WriteFreely user, their collections and their posts, as the
+    API returns them. The same seed always generates the same archive.
+    """
+    rng = random.Random(seed)
+
+    user = {
+        "username": username,
+        "email": f"{username}@example.com",
+        "created": make_timestamp(rng),
+    }
+
+    collections: List[Dict[str, Any]] = []
+    for index in range(collection_count):
+        alias = f"{username}-{index}"
+        collections.append(
+            {
+                "alias": alias,
+                "title": " ".join(rng.choices(WORDS, k=3)).title(),
+                "description": " ".join(rng.choices(WORDS, k=12)),
+                "style_sheet": "",
+                "public": rng.random() < 0.8,
+                "views": rng.randint(0, 100000),
+                "email": f"{alias}@writeas.com",
+                "url": f"https://write.as/{alias}/",
+            }
+        )
+
+    posts: List[Dict[str, Any]] = []
+    for index in range(post_count):
+        created = make_timestamp(rng)
+        title = " ".join(rng.choices(WORDS, k=rng.randint(0, 8))).title()
+        post: Dict[str, Any] = {
+            "id": f"{seed:04x}{index:012x}",
+            "slug": f"post-{index}",
+            "appearance": rng.choice(("norm", "sans", "wrap")),
+            "language": "en",
+            "rtl": False,
+            "created": created,
+            "updated": created,
+            "title": title,
+            "body": make_body(rng),
+            "tags": rng.sample(TAGS, k=rng.randint(0, 5)),
+            "views": int(rng.paretovariate(1.2) * 10),
+        }
+
+        if collections and rng.random() >= ANONYMOUS_SHARE:
+            collection = rng.choice(collections)
+            post["collection"] = {
+                key: collection[key]
+                for key in (
+                    "alias",
+                    "title",
+                    "description",
+                    "style_sheet",
+                    "public",
+                    "views",
+                )
+            }
+
+        posts.append(post)
+
+    return {"user": user, "collections": collections, "posts": posts}
+
+
+def make_export(archive: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns an archive as a WriteFreely JSON export, the user with their
+    collections (each with its posts) and their anonymous posts.
+    """
+    collections = {
+        collection["alias"]: {**collection, "posts": []}
+        for collection in archive["collections"]
+    }
+    anonymous_posts = []
+
+    for post in archive["posts"]:
+        post = dict(post)
+        collection = post.pop("collection", None)
+        if collection is None:
+            anonymous_posts.append(post)
+        else:
+            collections[collection["alias"]]["posts"].append(post)
+
+    for collection in collections.values():
+        collection["total_posts"] = len(collection["posts"])
+
+    return {
+        **archive["user"],
+        "collections": list(collections.values()),
+        "posts": anonymous_posts,
+    }
@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+
+from . import fixtures
+
+httpx = pytest.importorskip("httpx")
+
+from writefreely_to_sqlite.async_client import (  # noqa: E402
+    AsyncWriteFreelyClient,
+)
+
+
+def mock_transport(routes):
+    """
+    Returns an httpx transport that answers each path with the next of its
+    responses.
+    """
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        responses = routes[request.url.path]
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        status_code, data, headers = response
+        return httpx.Response(
+            status_code,
+            content=json.dumps(data).encode("utf-8") if data else b"",
+            headers=headers,
+        )
+
+    return httpx.MockTransport(handler), calls
+
+
+def test_async_write_freely_client__request():
+    transport, calls = mock_transport(
+        {"/api/me": [(200, fixtures.ME_RESPONSE, {})]}
+    )
+
+    async def run():
+        async with AsyncWriteFreelyClient(
+            domain="write.as", access_token="token", transport=transport
+        ) as client:
+            _, response = await client.get_me()
+            return response.json()
+
+    assert asyncio.run(run()) == fixtures.ME_RESPONSE
+    assert calls[0].headers["Authorization"] == "Token token"
+    assert calls[0].headers["User-Agent"].startswith("writefreely-to-sqlite")
+
+
+def test_async_write_freely_client__request_retries(mocker):
+    delays = []
+
+    async def mock_sleep(delay):
+        delays.append(delay)
+
+    mocker.patch("writefreely_to_sqlite.async_client.asyncio.sleep", mock_sleep)
+    transport, calls = mock_transport(
+        {
+            "/api/me": [
+                (429, None, {"Retry-After": "1"}),
+                (200, fixtures.ME_RESPONSE, {}),
+            ]
+        }
+    )
+
+    async def run():
+        async with AsyncWriteFreelyClient(
+            domain="write.as", transport=transport, max_connections=4
+        ) as client:
+            _, response = await client.get_me()
+            return response.status_code, client.limiter.limit
+
+    status_code, limit = asyncio.run(run())
+
+    assert status_code == 200
+    assert len(calls) == 2
+    assert delays == [1.0]
+    assert limit == 2.5
+
+
+def test_async_write_freely_client__iter_me_posts():
+    transport, _ = mock_transport(
+        {"/api/me/posts": [(200, fixtures.ME_POSTS_RESPONSE, {})]}
+    )
+
+    async def run():
+        async with AsyncWriteFreelyClient(
+            domain="write.as", transport=transport
+        ) as client:
+            return [post async for post in client.iter_me_posts(chunk_size=8)]
+
+    assert asyncio.run(run()) == fixtures.ME_POSTS_RESPONSE["data"]
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from sqlite_utils import Database
+
+from . import fixtures
+from .test_async_client import mock_transport
+
+pytest.importorskip("httpx")
+
+from writefreely_to_sqlite import async_service, service  # noqa: E402
+from writefreely_to_sqlite.async_client import (  # noqa: E402
+    AsyncWriteFreelyClient,
+)
+
+
+def test_async_database_writer(tmp_path):
+    db_path = tmp_path / "writefreely.db"
+
+    async def run():
+        async with async_service.AsyncDatabaseWriter(db_path) as writer:
+            futures = [
+                await writer.submit(
+                    lambda db, username: db.execute(
+                        "INSERT INTO users (username) VALUES (?)", [username]
+                    ),
+                    f"user-{index}",
+                )
+                for index in range(10)
+            ]
+            await asyncio.gather(*futures)
+
+    asyncio.run(run())
+
+    assert Database(db_path)["users"].count == 10
+
+
+def test_async_database_writer__rollback(tmp_path):
+    db_path = tmp_path / "writefreely.db"
+
+    async def run():
+        async with async_service.AsyncDatabaseWriter(db_path) as writer:
+            await writer.write(
+                lambda db: db.execute(
+                    "INSERT INTO users (username) VALUES ('matt')"
+                )
+            )
+            raise RuntimeError("Something went wrong.")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+    assert Database(db_path)["users"].count == 0
+
+
+def test_iter_collection_posts():
+    alias = fixtures.COLLECTION_DATA["alias"]
+    pages = [
+        (200, fixtures.collection_posts_response(page), {})
+        for page in (1, 2, 3)
+    ]
+    transport, calls = mock_transport(
+        {f"/api/collections/{alias}/posts": pages}
+    )
+
+    async def run():
+        async with AsyncWriteFreelyClient(
+            domain="write.as", transport=transport
+        ) as client:
+            return [
+                post
+                async for post in async_service.iter_collection_posts(
+                    client, alias, workers=2
+                )
+            ]
+
+    posts = asyncio.run(run())
+
+    assert len(calls) == 3
+    assert [post["id"] for post in posts] == [
+        f"post{index:012d}" for index in range(25)
+    ]
+
+
+def test_sync(tmp_path):
+    db_path = tmp_path / "writefreely.db"
+    service.save_posts(
+        service.open_database(db_path),
+        posts=[{**fixtures.POST_DATA, "id": "deleted-post"}],
+        user_username=fixtures.USER_DATA["username"],
+    )
+    transport, _ = mock_transport(
+        {
+            "/api/me": [(200, fixtures.ME_RESPONSE, {})],
+            "/api/me/posts": [(200, fixtures.ME_POSTS_RESPONSE, {})],
+            "/api/me/collections": [
+                (200, fixtures.ME_COLLECTIONS_RESPONSE, {})
+            ],
+        }
+    )
+
+    async def run():
+        async with AsyncWriteFreelyClient(
+            domain="write.as", transport=transport
+        ) as client:
+            async with async_service.AsyncDatabaseWriter(db_path) as writer:
+                return await async_service.sync(writer, client)
+
+    counts = asyncio.run(run())
+
+    assert counts == {"users": 1, "collections": 1, "posts": 1}
+
+    db = Database(db_path)
+    assert db["users"].count == 1
+    assert db["collections"].count == 1
+    assert db["posts"].count == 2
+    assert db["post_views"].count == 1
+    assert db["posts"].get("deleted-post")["deleted"] == 1
+    assert db["posts"].get(fixtures.POST_DATA["id"])["deleted"] == 0
@@ -0,0 +1,120 @@
+import json
+import time
+import tracemalloc
+from copy import deepcopy
+
+from writefreely_to_sqlite import service
+
+from . import benchmark, fixtures
+from .benchmark import run_benchmark
+from .synthetic import generate_archive
+
+POST_COUNT = 2000
+
+
+def make_posts(count=POST_COUNT):
+    posts = []
+    for index in range(count):
+        post = deepcopy(fixtures.POST_DATA)
+        post["id"] = f"post{index:012d}"
+        post["body"] = "Cool post! " * 200
+        post["tags"] = ["cool", "post"]
+        posts.append(post)
+    return posts
+
+
+def transform_with_deepcopy(posts, user_username):
+    post_rows = deepcopy(posts)
+    for post in post_rows:
+        service.transform_post(post, user_username)
+        post["body_hash"] = service.hash_post_body(post["body"])
+
+    view_rows = deepcopy(posts)
+    for post in view_rows:
+        service.transform_post_view(post)
+
+    return post_rows, view_rows
+
+
+def measure(func, *args, repeat=3):
+    """
+    Returns the best wall time and the peak memory allocated by func.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+
+def test_benchmark_project_posts():
+    posts = make_posts()
+
+    _, deepcopy_peak = measure(transform_with_deepcopy, posts, "matt")
+    _, project_peak = measure(service.project_posts, posts, "matt")
+
+    # Only the allocations are compared, wall times are too noisy to assert
+    # on. The timings are in the benchmark suite.
+    assert project_peak * 4 < deepcopy_peak
+
+
+# What SQLite reports for the pragma values the write profiles set.
+PRAGMA_VALUES = {
+    "synchronous": {"off": 0, "normal": 1, "full": 2},
+    "temp_store": {"default": 0, "memory": 2},
+}
+
+
+def test_benchmark_write_profiles(tmp_path):
+    rows, _ = service.project_posts(make_posts(count=200), "matt")
+
+    # The profiles' throughput is compared in the benchmark suite, wall
+    # times are too noisy to assert on.
+    for profile, pragmas in service.WRITE_PROFILES.items():
+        db = service.open_database(tmp_path / f"{profile}.db", profile=profile)
+        service.build_database(db)
+        db.conn.commit()
+
+        for pragma, value in pragmas.items():
+            (saved,) = db.execute(f"PRAGMA {pragma}").fetchone()
+            assert saved == PRAGMA_VALUES.get(pragma, {}).get(value, value)
+
+        benchmark.write_in_batches(db, rows)
+        assert db["posts"].count == len(rows)
+
+
+def test_generate_archive():
+    archive = generate_archive(seed=1, post_count=50, collection_count=3)
+
+    assert archive == generate_archive(
+        seed=1, post_count=50, collection_count=3
+    )
+    assert len(archive["posts"]) == 50
+    assert len(archive["collections"]) == 3
+    assert len({post["id"] for post in archive["posts"]}) == 50
+
+
+def test_run_benchmark():
+    results = run_benchmark(post_count=30, collection_count=2, seed=0)
+
+    assert json.loads(json.dumps(results)) == results
+    assert [c["name"] for c in results["commands"]] == [
+        name for name, _, _ in benchmark.COMMANDS
+    ]
+    assert all(c["peak_rss_bytes"] > 0 for c in results["commands"])
+
+    rows = {c["name"]: c["rows"] for c in results["commands"]}
+    assert rows["posts"] == 30
+    assert rows["sync"] == 30
+
+    stages = {s["name"]: s for s in results["stages"]}
+    assert stages["project_posts"]["rows"] == 30
+    for profile in service.WRITE_PROFILES:
+        assert stages[f"write_posts ({profile} profile)"]["rows"] == 30
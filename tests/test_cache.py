@@ -0,0 +1,67 @@
+from writefreely_to_sqlite.cache import ResponseCache
+
+
+def store(cache, key, body, etag='"abc"', last_modified=None):
+    for _ in cache.store(key, etag, last_modified, iter([body])):
+        pass
+
+
+def test_response_cache__make_key():
+    key = ResponseCache.make_key("https://write.as/api/me", "token")
+
+    assert key == ResponseCache.make_key("https://write.as/api/me", "token")
+    assert key != ResponseCache.make_key("https://write.as/api/me", "other")
+    assert "token" not in key
+
+
+def test_response_cache__store(tmp_path):
+    cache = ResponseCache(tmp_path)
+
+    assert cache.conditional_headers("key") == {}
+
+    store(cache, "key", b"body", last_modified="Sun, 12 Nov 2017 03:49:36 GMT")
+
+    assert cache.conditional_headers("key") == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Sun, 12 Nov 2017 03:49:36 GMT",
+    }
+
+    with cache.hit("key") as body_file:
+        assert body_file.read() == b"body"
+    assert cache.stats() == {"hits": 1, "misses": 0, "bytes_saved": 4}
+
+
+def test_response_cache__hit_evicted(tmp_path):
+    cache = ResponseCache(tmp_path)
+
+    assert cache.hit("key") is None
+
+    store(cache, "key", b"body")
+    cache.body_path("key").unlink()
+
+    assert cache.hit("key") is None
+    assert cache.stats() == {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+
+def test_response_cache__store_incomplete(tmp_path):
+    cache = ResponseCache(tmp_path)
+
+    chunks = cache.store("key", '"abc"', None, iter([b"one", b"two"]))
+    next(chunks)
+    chunks.close()
+
+    assert cache.conditional_headers("key") == {}
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_response_cache__evict(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10)
+
+    store(cache, "first", b"12345")
+    store(cache, "second", b"12345")
+    cache.hit("first").close()
+    store(cache, "third", b"12345")
+
+    assert cache.conditional_headers("first") != {}
+    assert cache.conditional_headers("second") == {}
+    assert cache.conditional_headers("third") != {}
@@ -1,8 +1,12 @@
 import json
+import pstats
+import sqlite3
+from pathlib import Path
 
 import responses
+from responses import matchers
 
-from writefreely_to_sqlite import cli
+from writefreely_to_sqlite import cli, service
 
 from . import fixtures
 
@@ -95,6 +99,53 @@ def test_posts(cli_runner, mock_db, mocker):
     assert mock_db["post_views"].count == 1
 
 
+@responses.activate
+def test_posts__by_collection(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+
+    alias = fixtures.COLLECTION_DATA["alias"]
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url="https://write.as/api/me",
+            json=fixtures.ME_RESPONSE,
+        ),
+    )
+    responses.add(
+        responses.Response(
+            method="GET",
+            url="https://write.as/api/me/collections",
+            json=fixtures.ME_COLLECTIONS_RESPONSE,
+        ),
+    )
+    for page in (1, 2, 3):
+        responses.add(
+            responses.Response(
+                method="GET",
+                url=f"https://write.as/api/collections/{alias}/posts",
+                match=[matchers.query_param_matcher({"page": str(page)})],
+                json=fixtures.collection_posts_response(page),
+            )
+        )
+
+    result = cli_runner.invoke(
+        cli.posts,
+        args=[
+            "writefreely.db",
+            "--auth=tests/fixture-auth.json",
+            "--by-collection",
+            "--workers=2",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert mock_db["posts"].count == 25
+    assert mock_db["post_views"].count == 25
+
+
 @responses.activate
 def test_collections(cli_runner, mock_db, mocker):
     mocker.patch(
@@ -123,3 +174,275 @@ def test_collections(cli_runner, mock_db, mocker):
 
     assert mock_db["collections"].count == 1
     assert mock_db["collection_views"].count == 1
+
+
+@responses.activate
+def test_sync(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://write.as/api/{path}", json=data
+            )
+        )
+
+    result = cli_runner.invoke(
+        cli.sync,
+        args=["writefreely.db", "--auth=tests/fixture-auth.json"],
+    )
+
+    assert result.exit_code == 0
+    assert mock_db["users"].count == 1
+    assert mock_db["collections"].count == 1
+    assert mock_db["posts"].count == 1
+
+
+@responses.activate
+def test_sync__fast_import(cli_runner, mock_db, mocker):
+    mock_open_database = mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://write.as/api/{path}", json=data
+            )
+        )
+
+    result = cli_runner.invoke(
+        cli.sync,
+        args=[
+            "writefreely.db",
+            "--auth=tests/fixture-auth.json",
+            "--fast-import",
+        ],
+    )
+
+    assert result.exit_code == 0
+    mock_open_database.assert_called_once_with("writefreely.db", profile="fast")
+    assert result.output.startswith("Write profile: fast (")
+
+
+@responses.activate
+def test_sync__profile(cli_runner, mock_db, mocker, tmp_path):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://write.as/api/{path}", json=data
+            )
+        )
+
+    dump_path = tmp_path / "sync.prof"
+    result = cli_runner.invoke(
+        cli.sync,
+        args=[
+            "writefreely.db",
+            "--auth=tests/fixture-auth.json",
+            "--profile",
+            f"--profile-dump={dump_path}",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "write_posts" in result.output
+    assert pstats.Stats(str(dump_path)).total_calls > 0
+
+    (run,) = mock_db["sync_runs"].rows
+    assert run["command"] == "sync"
+    assert run["error"] is None
+    assert run["bytes_downloaded"] > 0
+    assert "fetch" in json.loads(run["stages"])
+
+
+def test_import(cli_runner, mock_db, mocker, tmp_path):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(fixtures.EXPORT_DATA))
+
+    result = cli_runner.invoke(cli.import_, args=["writefreely.db", str(path)])
+
+    assert result.exit_code == 0
+    assert "Saved 1 user, 1 collections and 2 posts." in result.output
+    assert mock_db["posts"].count == 2
+    (run,) = mock_db["sync_runs"].rows
+    assert run["command"] == "import"
+    assert run["bytes_downloaded"] == 0
+
+
+def test_import__needs_username(cli_runner, mock_db, mocker, tmp_path):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    path = tmp_path / "export.csv"
+    path.write_text("id,slug,blog,url,created,title,body\nabc,,,,,,Hi\n")
+
+    result = cli_runner.invoke(cli.import_, args=["writefreely.db", str(path)])
+
+    assert result.exit_code == 2
+    assert "give the username" in result.output
+
+    result = cli_runner.invoke(
+        cli.import_, args=["writefreely.db", str(path), "--username=matt"]
+    )
+
+    assert result.exit_code == 0
+    assert mock_db["posts"].get("abc")["user_username"] == "matt"
+
+
+def test_from_db(cli_runner, mock_db, mocker, tmp_path):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    source_path = tmp_path / "writefreely.db"
+    source = sqlite3.connect(source_path)
+    source.executescript(fixtures.WRITEFREELY_SCHEMA)
+    source.close()
+
+    result = cli_runner.invoke(
+        cli.from_db,
+        args=["writefreely.db", str(source_path), "--username=jane"],
+    )
+
+    assert result.exit_code == 0
+    assert "Saved 1 users, 1 collections and 1 posts." in result.output
+    assert [row["username"] for row in mock_db["users"].rows] == ["jane"]
+    (run,) = mock_db["sync_runs"].rows
+    assert run["command"] == "from-db"
+
+
+@responses.activate
+def test_accounts(cli_runner, mock_db, mocker, tmp_path):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://write.as/api/{path}", json=data
+            )
+        )
+
+    accounts_path = tmp_path / "accounts"
+    accounts_path.mkdir()
+    (accounts_path / "matt.json").write_text(
+        Path("tests/fixture-auth.json").read_text()
+    )
+
+    result = cli_runner.invoke(
+        cli.accounts,
+        args=["writefreely.db", str(accounts_path), "--profile"],
+    )
+
+    assert result.exit_code == 0
+    assert "matt@write.as: 1 collections and 1 posts" in result.output
+    assert "write_posts" in result.output
+    assert mock_db["posts"].count == 1
+
+    (run,) = mock_db["sync_runs"].rows
+    assert run["command"] == "accounts"
+    assert run["error"] is None
+    assert run["bytes_downloaded"] > 0
+    stages = json.loads(run["stages"])
+    assert stages["fetch_account"]["calls"] == 1
+    assert stages["write_posts"]["rows_written"] == 1
+
+
+def test_compress_bodies(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username="matt"
+    )
+
+    result = cli_runner.invoke(cli.compress_bodies, args=["writefreely.db"])
+
+    assert result.exit_code == 0
+    assert "Compressed 1 post bodies with zlib" in result.output
+    assert mock_db["posts"].get(fixtures.POST_DATA["id"])["body"] is None
+
+
+def test_derive(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username="matt"
+    )
+
+    result = cli_runner.invoke(cli.derive, args=["writefreely.db", "-w", "1"])
+
+    assert result.exit_code == 0
+    assert "Computed the derived columns of 1 posts." in result.output
+    assert mock_db["post_derived"].count == 1
+
+
+def test_revision(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    post = fixtures.POST_DATA.copy()
+    service.save_posts(mock_db, posts=[post], user_username="matt")
+    service.save_posts(
+        mock_db, posts=[{**post, "body": "Edited."}], user_username="matt"
+    )
+
+    result = cli_runner.invoke(
+        cli.revision, args=["writefreely.db", post["id"]]
+    )
+    assert result.exit_code == 0
+    assert "delta" in result.output
+
+    result = cli_runner.invoke(
+        cli.revision, args=["writefreely.db", post["id"], "1"]
+    )
+    assert result.exit_code == 0
+    assert result.output == post["body"] + "\n"
+
+    result = cli_runner.invoke(
+        cli.revision, args=["writefreely.db", post["id"], "3"]
+    )
+    assert result.exit_code == 1
+
+
+def test_rollup(cli_runner, mock_db, mocker):
+    mocker.patch(
+        "writefreely_to_sqlite.cli.service.open_database", return_value=mock_db
+    )
+    service.save_post_views(mock_db, [{"id": "post0", "views": 10}])
+    service.save_post_views(mock_db, [{"id": "post0", "views": 15}])
+
+    with mock_db.conn:
+        mock_db.execute("DELETE FROM post_views_daily")
+
+    result = cli_runner.invoke(cli.rollup, args=["writefreely.db", "--rebuild"])
+
+    assert result.exit_code == 0
+    assert [row["views"] for row in mock_db["post_views_daily"].rows] == [5]
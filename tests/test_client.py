@@ -1,6 +1,13 @@
 import responses
 
-from writefreely_to_sqlite.client import WriteFreelyClient
+from writefreely_to_sqlite.cache import ResponseCache
+from writefreely_to_sqlite.client import (
+    AdaptiveLimiter,
+    WriteFreelyClient,
+    get_base_url,
+    is_not_modified,
+    parse_retry_after,
+)
 
 from . import fixtures
 
@@ -76,3 +83,207 @@ def test_write_freely_client__auth_logout():
     client.auth_logout()
 
     assert client.access_token is None
+
+
+@responses.activate
+def test_write_freely_client__iter_me_posts():
+    domain = "writefreely.example.com"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/me/posts",
+            json=fixtures.ME_POSTS_RESPONSE,
+        ),
+    )
+
+    client = WriteFreelyClient(domain=domain)
+    posts = list(client.iter_me_posts(chunk_size=16))
+
+    assert posts == fixtures.ME_POSTS_RESPONSE["data"]
+
+
+@responses.activate
+def test_write_freely_client__request_cached(tmp_path):
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/me"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            json=fixtures.ME_RESPONSE,
+            headers={"ETag": '"v1"'},
+        ),
+    )
+    responses.add(responses.Response(method="GET", url=url, status=304))
+
+    cache = ResponseCache(tmp_path)
+    client = WriteFreelyClient(domain=domain, cache=cache)
+
+    _, response = client.request(method="GET", url=url)
+    assert response.status_code == 200
+
+    _, response = client.request(method="GET", url=url)
+    assert is_not_modified(response)
+    assert response.json() == fixtures.ME_RESPONSE
+
+    assert responses.calls[-1].request.headers["If-None-Match"] == '"v1"'
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@responses.activate
+def test_write_freely_client__request_cached_evicted(tmp_path):
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/me"
+
+    cache = ResponseCache(tmp_path)
+    key = cache.make_key(url, None)
+
+    def not_modified(request):
+        # Another thread evicts the cached body while the request is sent.
+        cache.body_path(key).unlink()
+        return 304, {}, ""
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            json=fixtures.ME_RESPONSE,
+            headers={"ETag": '"v1"'},
+        ),
+    )
+    responses.add_callback(method="GET", url=url, callback=not_modified)
+    responses.add(
+        responses.Response(method="GET", url=url, json=fixtures.ME_RESPONSE)
+    )
+
+    client = WriteFreelyClient(domain=domain, cache=cache)
+    client.request(method="GET", url=url)
+
+    _, response = client.request(method="GET", url=url)
+    assert response.status_code == 200
+    assert response.json() == fixtures.ME_RESPONSE
+
+    assert "If-None-Match" not in responses.calls[-1].request.headers
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 2
+
+
+@responses.activate
+def test_write_freely_client__iter_me_posts_cached(tmp_path):
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/me/posts"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            json=fixtures.ME_POSTS_RESPONSE,
+            headers={"Last-Modified": "Sun, 12 Nov 2017 03:49:36 GMT"},
+        ),
+    )
+    responses.add(responses.Response(method="GET", url=url, status=304))
+
+    client = WriteFreelyClient(domain=domain, cache=ResponseCache(tmp_path))
+
+    assert list(client.iter_me_posts()) == fixtures.ME_POSTS_RESPONSE["data"]
+    assert list(client.iter_me_posts()) == fixtures.ME_POSTS_RESPONSE["data"]
+
+    assert (
+        responses.calls[-1].request.headers["If-Modified-Since"]
+        == "Sun, 12 Nov 2017 03:49:36 GMT"
+    )
+
+
+@responses.activate
+def test_write_freely_client__request_retries(mocker):
+    mock_sleep = mocker.patch("writefreely_to_sqlite.client.time.sleep")
+
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/me"
+
+    responses.add(
+        responses.Response(
+            method="GET", url=url, status=429, headers={"Retry-After": "3"}
+        ),
+    )
+    responses.add(responses.Response(method="GET", url=url, status=503))
+    responses.add(
+        responses.Response(method="GET", url=url, json=fixtures.ME_RESPONSE),
+    )
+
+    client = WriteFreelyClient(domain=domain, pool_maxsize=4)
+    _, response = client.request(method="GET", url=url)
+
+    assert response.status_code == 200
+    assert len(responses.calls) == 3
+    assert mock_sleep.call_count == 2
+    assert mock_sleep.call_args_list[0].args == (3.0,)
+
+    # Throttled twice, so the limit was halved from 4 to 1, then grew back
+    # by one after the successful request.
+    assert client.limiter.limit == 2
+
+
+@responses.activate
+def test_write_freely_client__request_retries_exhausted(mocker):
+    mocker.patch("writefreely_to_sqlite.client.time.sleep")
+
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/me"
+
+    responses.add(responses.Response(method="GET", url=url, status=503))
+
+    client = WriteFreelyClient(domain=domain, max_retries=2)
+    _, response = client.request(method="GET", url=url)
+
+    assert response.status_code == 503
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_write_freely_client__request_no_retry_post(mocker):
+    mocker.patch("writefreely_to_sqlite.client.time.sleep")
+
+    domain = "writefreely.example.com"
+    url = f"https://{domain}/api/auth/login"
+
+    responses.add(responses.Response(method="POST", url=url, status=502))
+
+    client = WriteFreelyClient(domain=domain)
+    _, response = client.request(method="POST", url=url)
+
+    assert response.status_code == 502
+    assert len(responses.calls) == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+
+def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(max_limit=8)
+
+    with limiter.slot() as slot:
+        slot.throttled = True
+    assert limiter.limit == 4
+
+    with limiter.slot():
+        pass
+    assert limiter.limit == 4.25
+
+    for _ in range(100):
+        with limiter.slot():
+            pass
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+
+
+def test_get_base_url():
+    assert get_base_url("write.as") == "https://write.as/api"
+    assert get_base_url("http://localhost:8080/") == "http://localhost:8080/api"
@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from writefreely_to_sqlite import compression
+
+
+def test_compress_body():
+    body = "Cool post! " * 100
+
+    blob = compression.compress_body(body)
+
+    assert len(blob) < len(body)
+    assert compression.decompress_body(blob) == body
+    assert compression.compress_body(None) is None
+    assert compression.decompress_body(None) is None
+
+
+def test_compress_body__zstd():
+    pytest.importorskip("zstandard")
+    body = "Cool post! " * 100
+
+    blob = compression.compress_body(body, codec="zstd")
+
+    assert blob.startswith(compression.ZSTD_MAGIC)
+    assert compression.decompress_body(blob) == body
+
+
+def test_compress_body__unknown_codec():
+    with pytest.raises(ValueError):
+        compression.compress_body("Cool post!", codec="lzma")
+
+
+def test_register_functions():
+    conn = sqlite3.connect(":memory:")
+    compression.register_functions(conn)
+
+    (body,) = conn.execute(
+        "SELECT decompress_body(compress_body('Cool post!', 'zlib'))"
+    ).fetchone()
+
+    assert body == "Cool post!"
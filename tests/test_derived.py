@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from writefreely_to_sqlite import derived
+
+BODY = """# A *title*
+
+Some **bold** snake_case text with [a link](https://example.com/a "Title")
+and a bare link to https://example.org/b. Also <https://example.net/c>.
+
+```
+print("code")
+```
+
+- An item
+"""
+
+
+def test_plain_text():
+    assert derived.plain_text(BODY) == (
+        "A title Some bold snake_case text with a link and a bare link to "
+        'https://example.org/b. Also https://example.net/c. print("code") '
+        "An item"
+    )
+
+
+def test_make_excerpt():
+    assert derived.make_excerpt("Short.") == "Short."
+    assert derived.make_excerpt("one two, three four", length=12) == "one two…"
+
+
+def test_find_links():
+    assert derived.find_links(BODY) == [
+        "https://example.com/a",
+        "https://example.org/b",
+        "https://example.net/c",
+    ]
+    assert derived.find_links("[x](/relative) and [y](#anchor)") == []
+
+
+def test_derive_post():
+    row = dict(
+        zip(derived.DERIVED_COLUMNS, derived.derive_post("post0", "abc", BODY))
+    )
+
+    assert row["post_id"] == "post0"
+    assert row["body_hash"] == "abc"
+    assert row["version"] == derived.get_version()
+    assert row["word_count"] == 20
+    assert row["reading_time"] == 1
+    assert row["excerpt"].startswith("A title Some bold")
+    assert len(json.loads(row["links"])) == 3
+
+
+def test_derive_post__empty():
+    row = derived.derive_post("post0", None, None)
+
+    assert row[3:5] == (0, 0)
+    assert row[-1] == "[]"
+
+
+def test_render_html():
+    pytest.importorskip("markdown")
+
+    assert "<strong>bold</strong>" in derived.render_html(BODY)
@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+import zipfile
+
+import pytest
+
+from writefreely_to_sqlite import export
+
+from . import fixtures
+
+
+def write_export(path, data=fixtures.EXPORT_DATA):
+    path.write_text(json.dumps(data))
+    return path
+
+
+def test_detect_format(tmp_path):
+    assert export.detect_format(tmp_path / "export.CSV") == "csv"
+
+    json_path = write_export(tmp_path / "export")
+    assert export.detect_format(json_path) == "json"
+
+    zip_path = tmp_path / "export.bin"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        archive.writestr("matt/cool-post_7xe2dbojynjs1dkk.txt", "Cool post!")
+    assert export.detect_format(zip_path) == "zip"
+
+
+def test_iter_export__json(tmp_path, mocker):
+    mocker.patch.object(export, "READ_CHUNK_SIZE", 7)
+    path = write_export(tmp_path / "export.json")
+
+    items = list(export.iter_export(path))
+
+    assert [kind for kind, _ in items] == ["user", "collection", "post", "post"]
+    assert items[0][1] == {
+        "username": "matt",
+        "email": "matt@example.com",
+        "created": "2015-02-03T02:41:19Z",
+    }
+    assert items[1][1]["alias"] == "matt"
+    assert "posts" not in items[1][1]
+    assert items[2][1]["id"] == fixtures.POST_DATA["id"]
+    assert items[2][1]["collection"] == {"alias": "matt"}
+    assert items[3][1] == fixtures.ANONYMOUS_POST_DATA
+
+
+def test_iter_export__csv(tmp_path):
+    path = tmp_path / "export.csv"
+    with path.open("w", newline="") as file_obj:
+        writer = csv.writer(file_obj)
+        writer.writerow(
+            ["id", "slug", "blog", "url", "created", "title", "body"]
+        )
+        writer.writerow(
+            [
+                "7xe2dbojynjs1dkk",
+                "cool-post",
+                "matt",
+                "https://write.as/matt/cool-post",
+                "2017-11-12T03:49:36Z",
+                "Cool",
+                "Cool post!\nOn two lines, with a comma.",
+            ]
+        )
+        writer.writerow(
+            ["3ud5ac5vsuk62ls8", "", "", "", "2018-01-02T10:00:00Z", "", "x"]
+        )
+
+    items = list(export.iter_export(path))
+
+    assert items == [
+        (
+            "partial_post",
+            {
+                "id": "7xe2dbojynjs1dkk",
+                "slug": "cool-post",
+                "created": "2017-11-12T03:49:36Z",
+                "updated": "2017-11-12T03:49:36Z",
+                "title": "Cool",
+                "body": "Cool post!\nOn two lines, with a comma.",
+                "collection": {"alias": "matt"},
+            },
+        ),
+        (
+            "partial_post",
+            {
+                "id": "3ud5ac5vsuk62ls8",
+                "slug": None,
+                "created": "2018-01-02T10:00:00Z",
+                "updated": "2018-01-02T10:00:00Z",
+                "title": None,
+                "body": "x",
+            },
+        ),
+    ]
+
+
+def test_iter_export__zip(tmp_path):
+    path = tmp_path / "export.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(
+            zipfile.ZipInfo(
+                "matt/cool-post_7xe2dbojynjs1dkk.txt", (2017, 11, 12, 3, 49, 36)
+            ),
+            "# Cool\n\nCool post!",
+        )
+        archive.writestr(
+            zipfile.ZipInfo("3ud5ac5vsuk62ls8.txt", (2018, 1, 2, 10, 0, 0)),
+            "Not in a blog.",
+        )
+        archive.writestr("export.json", json.dumps(fixtures.EXPORT_DATA))
+
+    items = list(export.iter_export(path))
+
+    assert items[0] == (
+        "partial_post",
+        {
+            "id": "7xe2dbojynjs1dkk",
+            "slug": "cool-post",
+            "created": "2017-11-12T03:49:36Z",
+            "updated": "2017-11-12T03:49:36Z",
+            "title": "Cool",
+            "body": "Cool post!",
+            "collection": {"alias": "matt"},
+        },
+    )
+    assert items[1][0] == "partial_post"
+    assert items[1][1]["id"] == "3ud5ac5vsuk62ls8"
+    assert items[1][1]["title"] is None
+    assert "collection" not in items[1][1]
+    assert [kind for kind, _ in items[2:]] == [
+        "user",
+        "collection",
+        "post",
+        "post",
+    ]
+
+
+def test_iter_export__unknown_format(tmp_path):
+    path = write_export(tmp_path / "export.json")
+
+    with pytest.raises(ValueError):
+        list(export.iter_export(path, export_format="xml"))
+
+
+def test_iter_csv_export__long_body():
+    body = "x" * 500_000
+    raw = f"id,slug,blog,url,created,title,body\nabc,,,,,,{body}\n"
+
+    (item,) = export.iter_csv_export(io.BytesIO(raw.encode("utf-8")))
+
+    assert item[1]["body"] == body
@@ -0,0 +1,43 @@
+from writefreely_to_sqlite import revisions
+
+BODY = "\n\n".join(
+    f"Paragraph {index} has a few words in it." * 20 for index in range(50)
+)
+
+
+def test_make_delta():
+    edited = BODY.replace("Paragraph 25 has", "Paragraph 25 now has", 1)
+
+    delta = revisions.make_delta(BODY, edited)
+
+    assert revisions.apply_delta(BODY, delta) == edited
+    assert revisions.apply_delta(
+        edited, revisions.make_delta(edited, BODY)
+    ) == (BODY)
+    # The delta is the size of the edit, not the body.
+    assert len(delta) < 50
+
+
+def test_make_delta__empty():
+    delta = revisions.make_delta(None, "Cool post!")
+
+    assert revisions.apply_delta(None, delta) == "Cool post!"
+    assert (
+        revisions.apply_delta(
+            "Cool post!", revisions.make_delta("Cool post!", None)
+        )
+        == ""
+    )
+
+
+def test_make_snapshot():
+    snapshot = revisions.make_snapshot(BODY)
+
+    assert revisions.read_snapshot(snapshot) == BODY
+    assert len(snapshot) < len(BODY)
+
+
+def test_is_snapshot():
+    assert [
+        revision for revision in range(1, 31) if revisions.is_snapshot(revision)
+    ] == [10, 20, 30]
@@ -1,11 +1,48 @@
+import json
+import sqlite3
+
+import pytest
 import responses
+from responses import matchers
+from sqlite_utils import Database
 
 from writefreely_to_sqlite import service
+from writefreely_to_sqlite.cache import ResponseCache
 from writefreely_to_sqlite.client import WriteFreelyClient
+from writefreely_to_sqlite.compression import decompress_body
+from writefreely_to_sqlite.metrics import SyncMetrics
 
 from . import fixtures
 
 
+def test_open_database(tmp_path):
+    db = service.open_database(tmp_path / "writefreely.db", profile="fast")
+
+    assert service.describe_write_profile(db) == (
+        "journal_mode=memory, synchronous=off"
+    )
+    assert db.execute("PRAGMA page_size").fetchone()[0] == 8192
+
+    db = service.open_database(tmp_path / "writefreely.db", profile="safe")
+
+    assert service.describe_write_profile(db) == (
+        "journal_mode=wal, synchronous=full"
+    )
+
+
+def test_checkpoint(tmp_path):
+    db_path = tmp_path / "writefreely.db"
+    db = service.open_database(db_path)
+    service.save_user(db, fixtures.USER_DATA.copy())
+
+    wal_path = tmp_path / "writefreely.db-wal"
+    assert wal_path.stat().st_size > 0
+
+    service.checkpoint(db)
+
+    assert wal_path.stat().st_size == 0
+
+
 def test_build_database(mock_db):
     service.build_database(mock_db)
 
@@ -17,6 +54,35 @@ def test_build_database(mock_db):
     assert mock_db["posts"].exists()
     assert mock_db["post_views"].exists()
 
+    assert mock_db["post_fingerprints"].exists()
+
+    assert mock_db["tags"].exists()
+    assert mock_db["post_tags"].exists()
+
+    assert service.get_schema_version(mock_db) == service.SCHEMA_VERSION
+
+
+def test_build_database__only_once(mock_db, mocker):
+    service.build_database(mock_db)
+
+    mock_get_schema_version = mocker.patch(
+        "writefreely_to_sqlite.service.get_schema_version"
+    )
+    service.build_database(mock_db)
+
+    mock_get_schema_version.assert_not_called()
+
+
+def test_build_database__unversioned(mock_db):
+    # A database built before the schema was versioned.
+    service.migrate_initial_schema(mock_db)
+    assert service.get_schema_version(mock_db) == 0
+
+    service.build_database(mock_db)
+
+    assert mock_db["post_fingerprints"].exists()
+    assert service.get_schema_version(mock_db) == service.SCHEMA_VERSION
+
 
 @responses.activate
 def test_get_user():
@@ -68,6 +134,50 @@ def test_get_posts():
     assert posts == [fixtures.POST_DATA]
 
 
+@responses.activate
+def test_iter_posts():
+    domain = "write-freely.testing"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/me/posts",
+            json=fixtures.ME_POSTS_RESPONSE,
+        )
+    )
+
+    client = WriteFreelyClient(domain=domain)
+
+    posts = service.iter_posts(client)
+    assert list(posts) == [fixtures.POST_DATA]
+
+
+@responses.activate
+def test_iter_collection_posts():
+    domain = "write-freely.testing"
+    alias = fixtures.COLLECTION_DATA["alias"]
+
+    for page in (1, 2, 3):
+        responses.add(
+            responses.Response(
+                method="GET",
+                url=f"https://{domain}/api/collections/{alias}/posts",
+                match=[matchers.query_param_matcher({"page": str(page)})],
+                json=fixtures.collection_posts_response(page),
+            )
+        )
+
+    client = WriteFreelyClient(domain=domain)
+
+    posts = list(service.iter_collection_posts(client, alias, workers=2))
+
+    assert len(responses.calls) == 3
+    assert [p["id"] for p in posts] == [
+        f"post{index:012d}" for index in range(25)
+    ]
+    assert all(p["collection"]["alias"] == alias for p in posts)
+
+
 def test_transform_post():
     post = fixtures.POST_DATA.copy()
     collection_alias = post["collection"]["alias"]
@@ -91,12 +201,582 @@ def test_transform_post():
     }
 
 
+def test_project_post():
+    post = fixtures.POST_DATA.copy()
+    user_username = "myles"
+
+    row, view_row = service.project_post(post, user_username)
+
+    assert post == fixtures.POST_DATA
+    assert dict(zip(service.POST_COLUMNS, row)) == {
+        "id": fixtures.POST_DATA["id"],
+        "slug": fixtures.POST_DATA["slug"],
+        "appearance": fixtures.POST_DATA["appearance"],
+        "language": fixtures.POST_DATA["language"],
+        "rtl": fixtures.POST_DATA["rtl"],
+        "created": fixtures.POST_DATA["created"],
+        "updated": fixtures.POST_DATA["updated"],
+        "title": fixtures.POST_DATA["title"],
+        "body": fixtures.POST_DATA["body"],
+        "tags": json.dumps(fixtures.POST_DATA["tags"]),
+        "collection_alias": fixtures.COLLECTION_DATA["alias"],
+        "user_username": user_username,
+        "body_hash": service.hash_post_body(fixtures.POST_DATA["body"]),
+    }
+    assert dict(zip(service.POST_VIEW_COLUMNS, view_row)) == {
+        "post_id": fixtures.POST_DATA["id"],
+        "views": fixtures.POST_DATA["views"],
+    }
+
+
+def test_project_post__anonymous():
+    post = fixtures.POST_DATA.copy()
+    del post["collection"]
+
+    row, _ = service.project_post(post, "myles")
+
+    assert row[service.POST_COLLECTION_ALIAS_INDEX] is None
+
+
 def test_save_posts(mock_db):
     post = fixtures.POST_DATA.copy()
     service.save_posts(mock_db, posts=[post], user_username="i-am-a-username")
     assert mock_db["posts"].count == 1
 
 
+def test_save_posts__incremental(mock_db):
+    user_username = "i-am-a-username"
+
+    written = service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username=user_username
+    )
+    assert written == 1
+
+    written = service.save_posts(
+        mock_db,
+        posts=[fixtures.POST_DATA.copy()],
+        user_username=user_username,
+        incremental=True,
+    )
+    assert written == 0
+
+    changed_post = fixtures.POST_DATA.copy()
+    changed_post["body"] = "Cooler post!"
+    changed_post["updated"] = "2017-11-13T03:49:36Z"
+
+    written = service.save_posts(
+        mock_db,
+        posts=[changed_post],
+        user_username=user_username,
+        incremental=True,
+    )
+    assert written == 1
+    assert mock_db["posts"].get(changed_post["id"])["body"] == "Cooler post!"
+
+    # A run that isn't incremental doesn't fingerprint the posts, so it
+    # removes the fingerprint of the post it changes, and the next
+    # incremental run compares it again.
+    written = service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username=user_username
+    )
+    assert written == 1
+    assert mock_db["post_fingerprints"].count == 0
+
+    written = service.save_posts(
+        mock_db,
+        posts=[changed_post],
+        user_username=user_username,
+        incremental=True,
+    )
+    assert written == 1
+    assert mock_db["posts"].get(changed_post["id"])["body"] == "Cooler post!"
+
+
+def test_save_posts__body_hash(mock_db):
+    user_username = "i-am-a-username"
+    post = fixtures.POST_DATA.copy()
+    service.save_posts(mock_db, posts=[post], user_username=user_username)
+
+    statements = []
+    mock_db.conn.set_trace_callback(statements.append)
+    total_changes = mock_db.conn.total_changes
+
+    written = service.save_posts(
+        mock_db, posts=[post.copy()], user_username=user_username
+    )
+    assert written == 0
+    assert not any(
+        s.startswith(("INSERT INTO [posts]", "UPDATE")) for s in statements
+    )
+    # Nothing else is written either.
+    assert mock_db.conn.total_changes == total_changes
+
+    statements.clear()
+    metadata_post = post.copy()
+    metadata_post["updated"] = "2017-11-13T03:49:36Z"
+    metadata_post["tags"] = ["cool"]
+
+    written = service.save_posts(
+        mock_db, posts=[metadata_post], user_username=user_username
+    )
+    assert written == 1
+    assert not any("posts_fts" in statement for statement in statements)
+
+    saved_post = mock_db["posts"].get(post["id"])
+    assert saved_post["updated"] == metadata_post["updated"]
+    assert json.loads(saved_post["tags"]) == ["cool"]
+
+    statements.clear()
+    body_post = metadata_post.copy()
+    body_post["body"] = "Cooler post!"
+
+    written = service.save_posts(
+        mock_db, posts=[body_post], user_username=user_username
+    )
+    assert written == 1
+    assert any("posts_fts" in statement for statement in statements)
+
+    saved_post = mock_db["posts"].get(post["id"])
+    assert saved_post["body_hash"] == service.hash_post_body("Cooler post!")
+    assert len(list(mock_db["posts"].search("cooler"))) == 1
+
+
+def test_migrate_post_body_hash(mock_db):
+    # A database from before the body_hash migration.
+    service.migrate_initial_schema(mock_db)
+    service.migrate_post_fingerprints(mock_db)
+    mock_db.execute("PRAGMA user_version = 2")
+    mock_db["posts"].insert(
+        {"id": fixtures.POST_DATA["id"], "body": fixtures.POST_DATA["body"]}
+    )
+
+    service.build_database(mock_db)
+
+    saved_post = mock_db["posts"].get(fixtures.POST_DATA["id"])
+    assert saved_post["body_hash"] == service.hash_post_body(
+        fixtures.POST_DATA["body"]
+    )
+    assert "AFTER UPDATE OF [title], [body] ON [posts]" in (
+        mock_db.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'posts_au'"
+        ).fetchone()[0]
+    )
+
+
+def test_enable_body_compression(mock_db):
+    user_username = "i-am-a-username"
+    service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username=user_username
+    )
+
+    assert service.enable_body_compression(mock_db) == 1
+
+    saved_post = mock_db["posts"].get(fixtures.POST_DATA["id"])
+    assert saved_post["body"] is None
+    assert saved_post["body_compressed"] is not None
+
+    assert [row["body"] for row in mock_db[service.POSTS_TEXT_VIEW].rows] == [
+        fixtures.POST_DATA["body"]
+    ]
+    assert len(list(mock_db["posts"].search("cool"))) == 1
+
+    # Posts written later are compressed, and indexed as plain text.
+    post = fixtures.POST_DATA.copy()
+    post["body"] = "Cooler post!"
+    service.save_posts(mock_db, posts=[post], user_username=user_username)
+
+    saved_post = mock_db["posts"].get(fixtures.POST_DATA["id"])
+    assert saved_post["body"] is None
+    assert list(
+        mock_db.query(
+            f"SELECT body FROM {service.POSTS_TEXT_VIEW} WHERE id = ?",
+            [post["id"]],
+        )
+    ) == [{"body": "Cooler post!"}]
+    assert len(list(mock_db["posts"].search("cooler"))) == 1
+    assert len(list(mock_db["posts"].search("cool"))) == 0
+
+
+def test_enable_body_compression__posts_text_columns(mock_db):
+    service.enable_body_compression(mock_db)
+
+    columns = list(mock_db["posts"].columns_dict)
+    columns.remove("body_compressed")
+    assert list(mock_db[service.POSTS_TEXT_VIEW].columns_dict) == columns
+
+    # A later migration adding a column to the posts table recreates the
+    # view with it.
+    mock_db["posts"].add_column("extra", str)
+    mock_db.execute(f"PRAGMA user_version = {service.SCHEMA_VERSION - 1}")
+    service.BUILT_DATABASES.discard(mock_db)
+    service.build_database(mock_db)
+
+    assert "extra" in mock_db[service.POSTS_TEXT_VIEW].columns_dict
+
+
+def test_enable_body_compression__bulk_load(mock_db):
+    service.enable_body_compression(mock_db)
+
+    with mock_db.conn, service.fts_bulk_load(mock_db, min_rows=2) as load:
+        service.write_posts(mock_db, make_post_rows(3), "matt")
+        assert "posts" in load.suspended
+
+    assert len(list(mock_db["posts"].search("cool"))) == 3
+
+
+def test_save_posts__tags(mock_db):
+    post = fixtures.POST_DATA.copy()
+    post["tags"] = ["cool", "post"]
+
+    service.save_posts(mock_db, posts=[post], user_username="i-am-a-username")
+
+    saved_post = mock_db["posts"].get(post["id"])
+    assert json.loads(saved_post["tags"]) == ["cool", "post"]
+    assert get_post_tags(mock_db) == {
+        (post["id"], "cool"),
+        (post["id"], "post"),
+    }
+
+    other_post = {**post, "id": "other", "tags": ["cool"]}
+    post["tags"] = ["cool", "new"]
+    service.save_posts(
+        mock_db, posts=[post, other_post], user_username="i-am-a-username"
+    )
+
+    assert get_post_tags(mock_db) == {
+        (post["id"], "cool"),
+        (post["id"], "new"),
+        ("other", "cool"),
+    }
+    # Tags without any posts are removed.
+    assert {tag["name"] for tag in mock_db["tags"].rows} == {"cool", "new"}
+
+
+def get_post_tags(db):
+    return set(
+        db.execute(
+            "SELECT post_tags.post_id, tags.name FROM post_tags "
+            "JOIN tags ON tags.id = post_tags.tag_id"
+        ).fetchall()
+    )
+
+
+def test_migrate_tags(mock_db):
+    # A database from before the tags tables.
+    for migration in service.MIGRATIONS[:7]:
+        migration(mock_db)
+    mock_db.execute("PRAGMA user_version = 7")
+    mock_db["posts"].insert(
+        {"id": "1", "tags": json.dumps(["cool", "post"])}, alter=True
+    )
+
+    service.build_database(mock_db)
+
+    assert get_post_tags(mock_db) == {("1", "cool"), ("1", "post")}
+    assert {tuple(index.columns) for index in mock_db["post_tags"].indexes} >= {
+        ("tag_id", "post_id")
+    }
+
+
+def get_fts_triggers(db, table_name):
+    return {
+        trigger.name
+        for trigger in db.triggers
+        if trigger.table == table_name and f"{table_name}_fts" in trigger.sql
+    }
+
+
+def make_post_rows(count, user_username="matt"):
+    posts = []
+    for index in range(count):
+        post = fixtures.POST_DATA.copy()
+        post["id"] = f"post{index:012d}"
+        posts.append(post)
+    rows, _ = service.project_posts(posts, user_username)
+    return rows
+
+
+def test_get_post_revision(mock_db):
+    post = fixtures.POST_DATA.copy()
+    bodies = [f"{post['body']}\n\nEdit {index}." for index in range(13)]
+
+    for body in bodies:
+        service.save_posts(
+            mock_db, posts=[{**post, "body": body}], user_username="matt"
+        )
+
+    revisions = mock_db["post_revisions"]
+    assert revisions.count == 12
+    assert [row["revision"] for row in revisions.rows_where("snapshot")] == [10]
+    for revision, body in enumerate(bodies, start=1):
+        assert service.get_post_revision(mock_db, post["id"], revision) == body
+    assert service.get_post_revision(mock_db, post["id"], 14) is None
+    assert service.get_post_revision(mock_db, "missing", 1) is None
+
+    # Metadata changes don't make a revision.
+    service.save_posts(
+        mock_db,
+        posts=[{**post, "body": bodies[-1], "appearance": "sans"}],
+        user_username="matt",
+    )
+    assert revisions.count == 12
+
+
+def test_get_post_revision__duplicate_posts(mock_db):
+    post = {**fixtures.POST_DATA, "body": "a"}
+    service.save_posts(mock_db, posts=[post], user_username="matt")
+
+    written = service.save_posts(
+        mock_db,
+        posts=[{**post, "body": "b"}, {**post, "body": "c"}],
+        user_username="matt",
+    )
+
+    assert written == 1
+    assert mock_db["posts"].get(post["id"])["body"] == "c"
+    assert service.get_post_revision(mock_db, post["id"], 1) == "a"
+    assert service.get_post_revision(mock_db, post["id"], 2) == "c"
+
+    with mock_db.conn:
+        service.write_post_revisions(
+            mock_db,
+            [
+                (post["id"], "c", "hash-c", None, "d"),
+                (post["id"], "d", "hash-d", None, "e"),
+            ],
+        )
+    assert [row["revision"] for row in mock_db["post_revisions"].rows] == [
+        1,
+        2,
+        3,
+    ]
+
+
+def test_get_post_revision__compressed(mock_db):
+    post = fixtures.POST_DATA.copy()
+    service.save_posts(mock_db, posts=[post], user_username="matt")
+    service.enable_body_compression(mock_db)
+
+    service.save_posts(
+        mock_db, posts=[{**post, "body": "Edited."}], user_username="matt"
+    )
+
+    assert service.get_post_revision(mock_db, post["id"], 1) == post["body"]
+    assert service.get_post_revision(mock_db, post["id"], 2) == "Edited."
+
+
+def test_update_post_derived(mock_db):
+    service.save_posts(
+        mock_db, posts=[fixtures.POST_DATA.copy()], user_username="matt"
+    )
+
+    assert service.update_post_derived(mock_db) == 1
+    derived = mock_db["post_derived"].get(fixtures.POST_DATA["id"])
+    assert derived["body_hash"] == service.hash_post_body(
+        fixtures.POST_DATA["body"]
+    )
+    assert derived["word_count"] == len(fixtures.POST_DATA["body"].split())
+
+    # Unchanged bodies aren't computed again.
+    assert service.update_post_derived(mock_db) == 0
+
+    post = {**fixtures.POST_DATA, "body": "A new body."}
+    service.save_posts(mock_db, posts=[post], user_username="matt")
+    service.enable_body_compression(mock_db)
+
+    assert service.update_post_derived(mock_db) == 1
+    assert mock_db["post_derived"].get(post["id"])["excerpt"] == "A new body."
+
+
+def test_update_post_derived__workers(mock_db, mocker):
+    mocker.patch.object(service, "DERIVE_PARALLEL_MIN_POSTS", 0)
+    mocker.patch.object(service, "DERIVE_BATCH_SIZE", 2)
+    rows = make_post_rows(5)
+    with mock_db.conn:
+        service.write_posts(mock_db, rows, "matt")
+
+    assert service.update_post_derived(mock_db, workers=2) == 5
+    assert mock_db["post_derived"].count == 5
+
+
+def test_fts_bulk_load(mock_db):
+    service.build_database(mock_db)
+    triggers = get_fts_triggers(mock_db, "posts")
+    assert triggers
+
+    with mock_db.conn, service.fts_bulk_load(mock_db, min_rows=2) as load:
+        service.write_posts(mock_db, make_post_rows(3), "matt")
+
+        assert "posts" in load.suspended
+        assert get_fts_triggers(mock_db, "posts") == set()
+
+    assert get_fts_triggers(mock_db, "posts") == triggers
+    assert len(list(mock_db["posts"].search("cool"))) == 3
+
+    # The restored triggers keep the index up to date.
+    with mock_db.conn:
+        mock_db.execute("DELETE FROM posts WHERE id = 'post000000000000'")
+    assert len(list(mock_db["posts"].search("cool"))) == 2
+
+
+def test_fts_bulk_load__small(mock_db, mocker):
+    service.build_database(mock_db)
+    mock_rebuild_fts = mocker.patch("sqlite_utils.db.Table.rebuild_fts")
+
+    with mock_db.conn, service.fts_bulk_load(mock_db) as load:
+        service.write_posts(mock_db, make_post_rows(3), "matt")
+        assert load.suspended == {}
+
+    mock_rebuild_fts.assert_not_called()
+    assert len(list(mock_db["posts"].search("cool"))) == 3
+
+
+def test_fts_bulk_load__rollback(mock_db):
+    service.build_database(mock_db)
+    triggers = get_fts_triggers(mock_db, "posts")
+
+    with pytest.raises(RuntimeError):
+        with mock_db.conn, service.fts_bulk_load(mock_db, min_rows=2):
+            service.write_posts(mock_db, make_post_rows(3), "matt")
+            raise RuntimeError("Something went wrong.")
+
+    assert get_fts_triggers(mock_db, "posts") == triggers
+    assert mock_db["posts"].count == 0
+    assert service.FTS_BULK_LOADS.get(mock_db) is None
+
+
+def test_write_post_views(mock_db):
+    with mock_db.conn:
+        written = service.write_post_views(
+            mock_db, [("a", 1), ("b", 2)], fetched_at="2023-01-01 00:00:00"
+        )
+    assert written == 2
+
+    with mock_db.conn:
+        written = service.write_post_views(
+            mock_db, [("a", 1), ("b", 3)], fetched_at="2023-01-01 00:15:00"
+        )
+    assert written == 1
+
+    assert list(
+        mock_db["post_views"].rows_where(select="post_id, views, created_at")
+    ) == [
+        {"post_id": "a", "views": 1, "created_at": "2023-01-01 00:00:00"},
+        {"post_id": "b", "views": 2, "created_at": "2023-01-01 00:00:00"},
+        {"post_id": "b", "views": 3, "created_at": "2023-01-01 00:15:00"},
+    ]
+    assert mock_db["post_views_latest"].get("b") == {
+        "post_id": "b",
+        "views": 3,
+        "created_at": "2023-01-01 00:15:00",
+    }
+
+    # Views older than the latest ones, like an old export's, are skipped.
+    with mock_db.conn:
+        written = service.write_post_views(
+            mock_db, [("a", 1), ("b", 2)], fetched_at="2022-12-31 00:00:00"
+        )
+    assert written == 0
+    assert mock_db["post_views_latest"].get("b")["views"] == 3
+    assert mock_db["post_views_daily"].get(("b", "2023-01-01"))["views"] == 1
+
+
+def get_rows(db, table_name):
+    return [dict(row) for row in db[table_name].rows_where(order_by="rowid")]
+
+
+def sorted_rows(db, table_name):
+    return sorted(get_rows(db, table_name), key=lambda row: sorted(row.items()))
+
+
+def test_update_rollups(mock_db):
+    posts = []
+    for index, views in enumerate((10, 20, 30)):
+        post = fixtures.POST_DATA.copy()
+        post["id"] = f"post{index}"
+        post["views"] = views
+        posts.append(post)
+    rows, view_rows = service.project_posts(posts, "matt")
+
+    with mock_db.conn:
+        service.write_posts(mock_db, rows, "matt")
+        service.write_post_views(
+            mock_db, view_rows, fetched_at="2023-01-02 09:00:00"
+        )
+        service.write_post_views(
+            mock_db,
+            [("post0", 15), ("post1", 20), ("post2", 31)],
+            fetched_at="2023-01-02 10:00:00",
+        )
+        service.write_post_views(
+            mock_db, [("post0", 45)], fetched_at="2023-01-09 10:00:00"
+        )
+        service.write_collection_views(
+            mock_db, [("matt", 100)], fetched_at="2023-01-09 10:00:00"
+        )
+
+    assert get_rows(mock_db, "post_views_daily") == [
+        {"post_id": "post0", "date": "2023-01-02", "views": 5},
+        {"post_id": "post2", "date": "2023-01-02", "views": 1},
+        {"post_id": "post0", "date": "2023-01-09", "views": 30},
+    ]
+    assert get_rows(mock_db, "post_views_weekly") == [
+        {"post_id": "post0", "date": "2023-01-02", "views": 5},
+        {"post_id": "post2", "date": "2023-01-02", "views": 1},
+        {"post_id": "post0", "date": "2023-01-09", "views": 30},
+    ]
+    assert get_rows(mock_db, "collection_totals") == [
+        {"collection_alias": "matt", "views": 100, "post_views": 96},
+    ]
+    assert [
+        (row["rank"], row["post_id"])
+        for row in mock_db["collection_top_posts"].rows_where(order_by="rank")
+    ] == [(1, "post0"), (2, "post2"), (3, "post1")]
+
+    # Rebuilding from the history gives the same rollups.
+    rollup_tables = [
+        "post_views_daily",
+        "post_views_weekly",
+        "collection_totals",
+        "collection_top_posts",
+    ]
+    before = {name: sorted_rows(mock_db, name) for name in rollup_tables}
+
+    with mock_db.conn:
+        service.rebuild_rollups(mock_db)
+
+    assert {name: sorted_rows(mock_db, name) for name in rollup_tables} == (
+        before
+    )
+
+
+def test_migrate_latest_views(mock_db):
+    # A database from before the latest views tables.
+    for migration in service.MIGRATIONS[:4]:
+        migration(mock_db)
+    mock_db.execute("PRAGMA user_version = 4")
+    mock_db["collection_views"].insert_all(
+        [
+            {"collection_alias": "matt", "views": 1},
+            {"collection_alias": "matt", "views": 2},
+        ]
+    )
+    stale_created_at = mock_db["collection_views"].get(1)["created_at"]
+
+    service.build_database(mock_db)
+
+    assert mock_db["collection_views"].default_values == {}
+    assert mock_db["collection_views_latest"].get("matt") == {
+        "collection_alias": "matt",
+        "views": 2,
+        "created_at": stale_created_at,
+    }
+
+    with mock_db.conn:
+        service.write_collection_views(mock_db, [("matt", 3)])
+    assert mock_db["collection_views"].get(3)["created_at"] > stale_created_at
+
+
 def test_transform_post_view():
     post = fixtures.POST_DATA.copy()
 
@@ -126,6 +806,41 @@ def test_transform_collection():
     }
 
 
+def test_project_collection():
+    collection = fixtures.COLLECTION_DATA.copy()
+    user_username = "myles"
+
+    row, view_row = service.project_collection(collection, user_username)
+
+    assert collection == fixtures.COLLECTION_DATA
+    assert dict(zip(service.COLLECTION_COLUMNS, row)) == {
+        "alias": collection["alias"],
+        "title": collection["title"],
+        "description": collection["description"],
+        "style_sheet": collection["style_sheet"],
+        "public": collection["public"],
+        "email": collection["email"],
+        "url": collection["url"],
+        "user_username": user_username,
+    }
+    assert dict(zip(service.COLLECTION_VIEW_COLUMNS, view_row)) == {
+        "collection_alias": collection["alias"],
+        "views": collection["views"],
+    }
+
+
+def test_save_collections(mock_db):
+    collection = fixtures.COLLECTION_DATA.copy()
+
+    service.save_collections(
+        mock_db, collections=[collection], user_username="myles"
+    )
+    service.save_collection_views(mock_db, collection_views=[collection])
+
+    assert mock_db["collections"].count == 1
+    assert mock_db["collection_views"].count == 1
+
+
 def test_transform_collection_view():
     collection = fixtures.COLLECTION_DATA.copy()
 
@@ -135,3 +850,482 @@ def test_transform_collection_view():
         "collection_alias": fixtures.COLLECTION_DATA["alias"],
         "views": fixtures.COLLECTION_DATA["views"],
     }
+
+
+@responses.activate
+def test_sync(mock_db):
+    domain = "write-freely.testing"
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://{domain}/api/{path}", json=data
+            )
+        )
+
+    client = WriteFreelyClient(domain=domain)
+
+    counts = service.sync(mock_db, client)
+
+    assert len(responses.calls) == 3
+    assert counts == {"users": 1, "collections": 1, "posts": 1}
+    assert mock_db["users"].count == 1
+    assert mock_db["collections"].count == 1
+    assert mock_db["collection_views"].count == 1
+    assert mock_db["posts"].count == 1
+    assert mock_db["post_views"].count == 1
+
+
+@responses.activate
+def test_sync__metrics(mock_db):
+    domain = "write-freely.testing"
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://{domain}/api/{path}", json=data
+            )
+        )
+
+    client = WriteFreelyClient(domain=domain)
+    metrics = SyncMetrics()
+    metrics.watch(client)
+
+    service.sync(mock_db, client, metrics=metrics)
+    service.sync(mock_db, client, incremental=True, metrics=metrics)
+
+    assert {
+        "build_database",
+        "fetch",
+        "project",
+        "read_posts",
+        "write_users",
+        "write_collections",
+        "write_posts",
+        "write_views",
+    } <= set(metrics.stages)
+    assert metrics.stages["write_posts"]["rows_written"] == 1
+    assert metrics.stages["write_posts"]["rows_skipped"] == 1
+    assert metrics.stages["write_views"]["rows_skipped"] == 2
+    # Each sync downloaded the three responses.
+    assert metrics.bytes_downloaded == 2 * sum(
+        len(json.dumps(data))
+        for data in (
+            fixtures.ME_RESPONSE,
+            fixtures.ME_POSTS_RESPONSE,
+            fixtures.ME_COLLECTIONS_RESPONSE,
+        )
+    )
+
+    run_id = service.save_sync_run(
+        mock_db, "sync", metrics, "2023-01-01 00:00:00", error=None
+    )
+    run = mock_db["sync_runs"].get(run_id)
+    assert run["command"] == "sync"
+    assert run["rows_written"] == metrics.rows_written
+    assert run["rows_skipped"] == 3
+    assert json.loads(run["stages"]) == metrics.stages
+
+
+@responses.activate
+def test_sync__deleted(mock_db):
+    domain = "write-freely.testing"
+    client = WriteFreelyClient(domain=domain)
+    old_post = {**fixtures.POST_DATA, "id": "deleted-post"}
+    other_post = {**fixtures.POST_DATA, "id": "other-users-post"}
+    service.save_posts(mock_db, posts=[old_post], user_username="matt")
+    service.save_posts(mock_db, posts=[other_post], user_username="jane")
+    with mock_db.conn:
+        service.write_post_views(mock_db, [("deleted-post", 100)])
+
+    def add_responses(posts, collections):
+        for path, data in (
+            ("me", fixtures.ME_RESPONSE),
+            ("me/posts", {"code": 200, "data": posts}),
+            ("me/collections", {"code": 200, "data": collections}),
+        ):
+            responses.add(
+                responses.Response(
+                    method="GET", url=f"https://{domain}/api/{path}", json=data
+                )
+            )
+
+    add_responses([fixtures.POST_DATA], [fixtures.COLLECTION_DATA])
+    service.sync(mock_db, client)
+
+    deleted = mock_db["posts"].get("deleted-post")
+    assert deleted["deleted"] == 1
+    assert deleted["deleted_at"] is not None
+    assert mock_db["posts"].get(fixtures.POST_DATA["id"])["deleted"] == 0
+    # Only the synced user's rows are compared.
+    assert mock_db["posts"].get("other-users-post")["deleted"] == 0
+    # The deleted post's views aren't in its collection's rollups.
+    assert [
+        row["post_id"] for row in get_rows(mock_db, "collection_top_posts")
+    ] == [fixtures.POST_DATA["id"]]
+    assert mock_db["collection_totals"].get("matt")["post_views"] == (
+        fixtures.POST_DATA["views"]
+    )
+
+    responses.reset()
+    add_responses([fixtures.POST_DATA, old_post], [])
+    metrics = SyncMetrics()
+    service.sync(mock_db, client, metrics=metrics)
+
+    restored = mock_db["posts"].get("deleted-post")
+    assert (restored["deleted"], restored["deleted_at"]) == (0, None)
+    collection = mock_db["collections"].get(fixtures.COLLECTION_DATA["alias"])
+    assert collection["deleted"] == 1
+    assert metrics.stages["mark_deleted"]["rows_written"] == 1
+    assert {
+        row["post_id"] for row in get_rows(mock_db, "collection_top_posts")
+    } == {fixtures.POST_DATA["id"], "deleted-post"}
+
+
+@responses.activate
+def test_sync__not_modified(mock_db, tmp_path):
+    domain = "write-freely.testing"
+
+    for path, data in (
+        ("me", fixtures.ME_RESPONSE),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        url = f"https://{domain}/api/{path}"
+        responses.add(
+            responses.Response(
+                method="GET", url=url, json=data, headers={"ETag": '"v1"'}
+            )
+        )
+        responses.add(responses.Response(method="GET", url=url, status=304))
+
+    client = WriteFreelyClient(domain=domain, cache=ResponseCache(tmp_path))
+
+    service.sync(mock_db, client)
+    counts = service.sync(mock_db, client)
+
+    assert counts == {"users": 1, "collections": 0, "posts": 0}
+    assert mock_db["post_views"].count == 1
+    assert mock_db["collection_views"].count == 1
+
+
+def write_auth_file(path, domain, access_token="token"):
+    path.write_text(
+        json.dumps(
+            {
+                "writefreely_domain": domain,
+                "writefreely_access_token": access_token,
+            }
+        )
+    )
+    return path
+
+
+def add_account_responses(domain, username):
+    user_response = {"code": 200, "data": {"username": username}}
+
+    for path, data in (
+        ("me", user_response),
+        ("me/posts", fixtures.ME_POSTS_RESPONSE),
+        ("me/collections", fixtures.ME_COLLECTIONS_RESPONSE),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://{domain}/api/{path}", json=data
+            )
+        )
+
+
+def test_import_export(mock_db, tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(fixtures.EXPORT_DATA))
+
+    counts = service.import_export(mock_db, path, batch_size=1)
+
+    assert counts == {"users": 1, "collections": 1, "posts": 2}
+    assert mock_db["users"].get("matt")["email"] == "matt@example.com"
+    assert mock_db["collections"].get("matt")["user_username"] == "matt"
+    assert mock_db["posts"].get("7xe2dbojynjs1dkk")["collection_alias"] == (
+        "matt"
+    )
+    assert mock_db["posts"].get("3ud5ac5vsuk62ls8")["collection_alias"] is None
+    assert mock_db["post_views"].count == 2
+    assert mock_db["collection_views"].count == 1
+
+    # Importing it again doesn't rewrite the posts.
+    counts = service.import_export(mock_db, path)
+
+    assert counts["posts"] == 0
+    assert mock_db["posts"].count == 2
+
+
+def test_import_export__csv(mock_db, tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text(
+        "id,slug,blog,url,created,title,body\n"
+        "7xe2dbojynjs1dkk,cool-post,matt,,2017-11-12T03:49:36Z,,Cool post!\n"
+    )
+
+    with pytest.raises(ValueError):
+        service.import_export(mock_db, path)
+
+    counts = service.import_export(mock_db, path, user_username="matt")
+
+    assert counts == {"users": 0, "collections": 0, "posts": 1}
+    post = mock_db["posts"].get("7xe2dbojynjs1dkk")
+    assert post["user_username"] == "matt"
+    assert post["body"] == "Cool post!"
+    assert mock_db["post_views"].count == 0
+
+
+def test_import_export__csv_after_json(mock_db, tmp_path):
+    data = json.loads(json.dumps(fixtures.EXPORT_DATA))
+    data["collections"][0]["posts"][0].update(
+        {"appearance": "sans", "language": "fr", "tags": ["x"]}
+    )
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(data))
+    service.import_export(mock_db, path)
+    before = mock_db["posts"].get("7xe2dbojynjs1dkk")
+
+    path = tmp_path / "export.csv"
+    path.write_text(
+        "id,slug,blog,url,created,title,body\n"
+        "7xe2dbojynjs1dkk,cool-post,matt,,2017-11-12T03:49:36Z,,Edited\n"
+        "newpost000000000,new-post,matt,,2018-01-01T00:00:00Z,,New\n"
+    )
+    counts = service.import_export(mock_db, path, user_username="matt")
+
+    # The CSV export doesn't have the posts' metadata, so only the title
+    # and body are updated and the new post is written.
+    assert counts["posts"] == 2
+    post = mock_db["posts"].get("7xe2dbojynjs1dkk")
+    assert post["body"] == "Edited"
+    assert {
+        key: value
+        for key, value in post.items()
+        if key not in service.POST_PARTIAL_CONTENT_COLUMNS
+    } == {
+        key: value
+        for key, value in before.items()
+        if key not in service.POST_PARTIAL_CONTENT_COLUMNS
+    }
+    assert get_post_tags(mock_db) == {("7xe2dbojynjs1dkk", "x")}
+    assert mock_db["posts"].get("newpost000000000")["body"] == "New"
+
+    # Importing it again doesn't change anything.
+    counts = service.import_export(mock_db, path, user_username="matt")
+    assert counts["posts"] == 0
+
+
+def make_writefreely_database(path):
+    source = sqlite3.connect(path)
+    source.executescript(fixtures.WRITEFREELY_SCHEMA)
+    source.close()
+    return path
+
+
+def test_extract_hashtags():
+    assert service.extract_hashtags("# Title\n\n#one, #two&#39; #one") == (
+        '["one", "two"]'
+    )
+    assert service.extract_hashtags(None) == "[]"
+
+
+def test_import_database(mock_db, tmp_path):
+    source_path = make_writefreely_database(tmp_path / "writefreely.db")
+
+    counts = service.import_database(
+        mock_db, source_path, base_url="https://blog.example.com/"
+    )
+
+    assert counts == {"users": 2, "collections": 2, "posts": 3}
+    assert mock_db["users"].get("matt")["created"] == "2015-02-03T02:41:19Z"
+
+    collection = mock_db["collections"].get("matt")
+    assert collection["public"] == 1
+    assert collection["url"] == "https://blog.example.com/matt/"
+    assert collection["user_username"] == "matt"
+    assert mock_db["collections"].get("jane")["public"] == 0
+
+    post = mock_db["posts"].get("7xe2dbojynjs1dkk")
+    assert post["created"] == "2017-11-12T03:49:36Z"
+    assert post["collection_alias"] == "matt"
+    assert json.loads(post["tags"]) == ["cool", "post"]
+    assert post["body_hash"] == service.hash_post_body(post["body"])
+    assert mock_db["posts"].get("3ud5ac5vsuk62ls8")["collection_alias"] is None
+    assert ("7xe2dbojynjs1dkk", "cool") in get_post_tags(mock_db)
+
+    assert mock_db["post_views"].count == 3
+    assert mock_db["collection_views_latest"].get("matt")["views"] == 46
+    assert mock_db["collection_totals"].get("matt")["post_views"] == 10
+    assert list(
+        mock_db.query(
+            "SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'cool'"
+        )
+    )
+
+    # The same rows as saving the posts through the API.
+    api_db = Database(memory=True)
+    api_post = {
+        **fixtures.POST_DATA,
+        "body": "Cool post! #cool #post #cool",
+        "tags": ["cool", "post"],
+    }
+    rows, _ = service.project_posts([api_post], "matt")
+    with api_db.conn:
+        service.write_posts(api_db, rows, "matt")
+    assert api_db["posts"].get("7xe2dbojynjs1dkk") == post
+
+    # Importing again only writes what has changed.
+    source = sqlite3.connect(source_path)
+    with source:
+        source.execute(
+            "UPDATE posts SET view_count = 12, text_appearance = 'wrap', "
+            "content = 'Cool post! #cool' WHERE id = '7xe2dbojynjs1dkk'"
+        )
+    source.close()
+
+    counts = service.import_database(mock_db, source_path, usernames=["matt"])
+
+    assert counts == {"users": 0, "collections": 0, "posts": 1}
+    assert mock_db["posts"].get("7xe2dbojynjs1dkk")["appearance"] == "wrap"
+    assert ("7xe2dbojynjs1dkk", "post") not in get_post_tags(mock_db)
+    assert service.get_post_revision(mock_db, "7xe2dbojynjs1dkk", 1) == (
+        "Cool post! #cool #post #cool"
+    )
+    assert mock_db["post_views"].count == 4
+    assert mock_db["post_views_daily"].count == 1
+    assert mock_db["collection_totals"].get("matt")["post_views"] == 12
+    assert "writefreely" not in {
+        name for _, name, _ in mock_db.execute("PRAGMA database_list")
+    }
+
+
+def test_import_database__compressed(mock_db, tmp_path):
+    source_path = make_writefreely_database(tmp_path / "writefreely.db")
+    service.enable_body_compression(mock_db)
+
+    service.import_database(mock_db, source_path)
+
+    post = mock_db["posts"].get("7xe2dbojynjs1dkk")
+    assert post["body"] is None
+    assert decompress_body(post["body_compressed"]) == (
+        "Cool post! #cool #post #cool"
+    )
+
+
+def test_find_auth_files(tmp_path):
+    first = write_auth_file(tmp_path / "first.json", "write.as")
+    second = write_auth_file(tmp_path / "second.json", "example.com")
+
+    assert service.find_auth_files(tmp_path) == [first, second]
+
+    manifest_path = tmp_path / "manifest.txt"
+    manifest_path.write_text(json.dumps({"accounts": ["second.json"]}))
+
+    assert service.find_auth_files(manifest_path) == [second]
+
+
+@responses.activate
+def test_sync_accounts(mock_db, tmp_path):
+    add_account_responses("write.as", "matt")
+    add_account_responses("example.com", "myles")
+    responses.add(
+        responses.Response(
+            method="GET", url="https://broken.example.com/api/me", status=401
+        )
+    )
+
+    reports = service.sync_accounts(
+        mock_db,
+        [
+            write_auth_file(tmp_path / "matt.json", "write.as"),
+            write_auth_file(tmp_path / "myles.json", "example.com"),
+            write_auth_file(tmp_path / "broken.json", "broken.example.com"),
+        ],
+        workers=2,
+        per_host=1,
+    )
+
+    assert [report["username"] for report in reports] == [
+        "matt",
+        "myles",
+        None,
+    ]
+    assert reports[0]["posts"] == 1
+    assert reports[0]["collections"] == 1
+    assert reports[0]["error"] is None
+    assert reports[2]["error"].startswith("HTTPError")
+
+    assert mock_db["users"].count == 2
+    # Both accounts have the same post, with the same views.
+    assert mock_db["post_views"].count == 1
+
+
+@responses.activate
+def test_sync_accounts__deleted(mock_db, tmp_path):
+    for username in ("matt", "myles"):
+        service.save_posts(
+            mock_db,
+            posts=[{**fixtures.POST_DATA, "id": f"{username}-deleted-post"}],
+            user_username=username,
+        )
+    add_account_responses("write.as", "matt")
+    add_account_responses("example.com", "myles")
+
+    service.sync_accounts(
+        mock_db,
+        [
+            write_auth_file(tmp_path / "matt.json", "write.as"),
+            write_auth_file(tmp_path / "myles.json", "example.com"),
+        ],
+        workers=2,
+    )
+
+    for username in ("matt", "myles"):
+        deleted = mock_db["posts"].get(f"{username}-deleted-post")
+        assert deleted["deleted"] == 1
+        assert deleted["deleted_at"] is not None
+    assert mock_db["posts"].get(fixtures.POST_DATA["id"])["deleted"] == 0
+
+
+@responses.activate
+def test_sync_accounts__same_username(mock_db, tmp_path):
+    add_account_responses("write.as", "matt")
+    # Another matt, on another instance, without any posts.
+    for path, data in (
+        ("me", {"code": 200, "data": {"username": "matt"}}),
+        ("me/posts", {"code": 200, "data": []}),
+        ("me/collections", {"code": 200, "data": []}),
+    ):
+        responses.add(
+            responses.Response(
+                method="GET", url=f"https://example.com/api/{path}", json=data
+            )
+        )
+
+    reports = service.sync_accounts(
+        mock_db,
+        [
+            write_auth_file(tmp_path / "matt.json", "write.as"),
+            write_auth_file(tmp_path / "other-matt.json", "example.com"),
+        ],
+        workers=2,
+    )
+
+    assert reports[0]["error"] is None
+    assert reports[1]["username"] == "matt"
+    assert reports[1]["error"].startswith("ValueError")
+    assert "https://example.com/api/me/posts" not in {
+        call.request.url for call in responses.calls
+    }
+    assert mock_db["posts"].get(fixtures.POST_DATA["id"])["deleted"] == 0
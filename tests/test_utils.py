@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from writefreely_to_sqlite import utils
+
+from . import fixtures
+
+
+def test_chunks():
+    assert list(utils.chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(utils.chunks([], 2)) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1024])
+def test_iter_json_array(chunk_size):
+    response = {
+        "code": 200,
+        "meta": {"data": ["not", "this", "one"]},
+        "data": [fixtures.POST_DATA, {"title": "Ünïcödé ✍️", "views": 1234}],
+    }
+    raw = json.dumps(response, ensure_ascii=False).encode("utf-8")
+    byte_chunks = [
+        raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)
+    ]
+
+    items = list(utils.iter_json_array(byte_chunks, key="data"))
+
+    assert items == response["data"]
+
+
+def test_iter_json_array__empty():
+    assert (
+        list(utils.iter_json_array([b'{"code": 200, "data": []}'], "data"))
+        == []
+    )
+    assert list(utils.iter_json_array([b'{"code": 200}'], "data")) == []
+
+
+def test_iter_json_array__truncated():
+    with pytest.raises(ValueError):
+        list(utils.iter_json_array([b'{"data": [{"id": 1}, {"id"'], "data"))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_json_reader(chunk_size):
+    document = {
+        "username": "matt",
+        "collections": [
+            {"alias": "matt", "posts": [fixtures.POST_DATA, {"views": 12}]},
+            {"alias": "empty", "posts": []},
+        ],
+        "count": 10,
+        "empty": {},
+    }
+    raw = json.dumps(document, ensure_ascii=False).encode("utf-8")
+    reader = utils.JSONReader(
+        raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)
+    )
+
+    walked = {}
+    for key in reader.iter_object():
+        if key != "collections":
+            walked[key] = reader.decode()
+            continue
+
+        walked[key] = []
+        for _ in reader.iter_array():
+            collection = {}
+            for collection_key in reader.iter_object():
+                if collection_key == "posts":
+                    collection["posts"] = [
+                        reader.decode() for _ in reader.iter_array()
+                    ]
+                else:
+                    collection[collection_key] = reader.decode()
+            walked[key].append(collection)
+
+    assert walked == document
+
+
+def test_json_reader__truncated():
+    reader = utils.JSONReader([b'{"data": [{"id": 1}, {"id"'])
+
+    with pytest.raises(ValueError):
+        for _ in reader.iter_object():
+            for _ in reader.iter_array():
+                reader.decode()
@@ -0,0 +1,286 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from .client import (
+    DEFAULT_TIMEOUT,
+    IDEMPOTENT_METHODS,
+    RETRY_STATUS_CODES,
+    STREAM_CHUNK_SIZE,
+    THROTTLE_STATUS_CODES,
+    get_base_url,
+    parse_retry_after,
+)
+from .utils import JSONArrayParser
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore
+
+
+class AsyncAdaptiveLimiter:
+    """
+    The asyncio equivalent of client.AdaptiveLimiter, limits how many
+    requests are in flight at once with additive increase and
+    multiplicative decrease (AIMD).
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.condition: Optional[asyncio.Condition] = None
+
+    def get_condition(self) -> asyncio.Condition:
+        # Created lazily so it's bound to the running event loop.
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    async def acquire(self):
+        condition = self.get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, throttled: bool = False):
+        condition = self.get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            else:
+                self.limit = min(
+                    float(self.max_limit), self.limit + 1 / self.limit
+                )
+            condition.notify_all()
+
+
+class AsyncWriteFreelyClient:
+    """
+    An asyncio client for WriteFreely, with the same methods as
+    client.WriteFreelyClient. Requires the httpx package, which is installed
+    with the async extra.
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        access_token: Optional[str] = None,
+        max_connections: int = 100,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60.0,
+        **kwargs,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "The async client requires httpx, install it with: "
+                "pip install 'writefreely-to-sqlite[async]'"
+            )
+
+        self.domain = domain
+        self.access_token = access_token
+
+        self.base_url = get_base_url(domain)
+
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.limiter = AsyncAdaptiveLimiter(max_limit=max_connections)
+
+        package_name = "writefreely-to-sqlite"
+        package_url = "https://github.com/myles/writefreely-to-sqlite"
+
+        connect_timeout, read_timeout = DEFAULT_TIMEOUT
+        self.session = httpx.AsyncClient(
+            headers={"User-Agent": f"{package_name} (+{package_url})"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            **kwargs,
+        )
+
+    async def __aenter__(self) -> "AsyncWriteFreelyClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        """
+        Sleep before retrying a request, honouring the server's Retry-After
+        header or else using exponential backoff with full jitter.
+        """
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max)
+        else:
+            delay = random.uniform(
+                0, min(self.backoff_max, self.backoff_base * 2**attempt)
+            )
+        await asyncio.sleep(delay)
+
+    def build_request(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> "httpx.Request":
+        headers = {} if headers is None else headers
+        headers["Content-Type"] = "application/json"
+
+        if self.access_token is not None:
+            headers["Authorization"] = f"Token {self.access_token}"
+
+        return self.session.build_request(
+            method=method, url=url, headers=headers, json=json, **kwargs
+        )
+
+    async def send(
+        self, request: "httpx.Request", stream: bool = False
+    ) -> "httpx.Response":
+        """
+        Sends a request through the adaptive limiter, retrying when the
+        server throttles us or is temporarily unavailable.
+        """
+        idempotent = request.method in IDEMPOTENT_METHODS
+        attempt = 0
+
+        while True:
+            response: Optional[httpx.Response] = None
+            retry_after = None
+            throttled = False
+
+            await self.limiter.acquire()
+            try:
+                response = await self.session.send(request, stream=stream)
+            except httpx.TransportError:
+                if attempt >= self.max_retries or idempotent is False:
+                    raise
+            else:
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+            finally:
+                await self.limiter.release(throttled=throttled)
+
+            if response is not None:
+                retryable = response.status_code in THROTTLE_STATUS_CODES or (
+                    idempotent and response.status_code in RETRY_STATUS_CODES
+                )
+                if attempt >= self.max_retries or retryable is False:
+                    return response
+
+                await response.aclose()
+                retry_after = parse_retry_after(
+                    response.headers.get("Retry-After")
+                )
+
+            await self.backoff(attempt, retry_after)
+            attempt += 1
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> Tuple["httpx.Request", "httpx.Response"]:
+        """
+        Makes a basic request to WriteFreely.
+        """
+        request = self.build_request(method, url, json, headers, **kwargs)
+        response = await self.send(request)
+        return request, response
+
+    @asynccontextmanager
+    async def stream(
+        self, method: str, url: str, **kwargs
+    ) -> AsyncIterator["httpx.Response"]:
+        """
+        Makes a request to WriteFreely without reading the body up front.
+        """
+        request = self.build_request(method, url, **kwargs)
+        response = await self.send(request, stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def auth_login(
+        self, alias: str, password: str
+    ) -> Tuple["httpx.Request", "httpx.Response"]:
+        request, response = await self.request(
+            method="POST",
+            url=f"{self.base_url}/auth/login",
+            json={"alias": alias, "pass": password},
+        )
+
+        response.raise_for_status()
+
+        response_data = response.json()
+        self.access_token = response_data["data"]["access_token"]
+
+        return request, response
+
+    async def auth_logout(self) -> Tuple["httpx.Request", "httpx.Response"]:
+        request, response = await self.request(
+            method="DELETE", url=f"{self.base_url}/auth/me"
+        )
+        response.raise_for_status()
+
+        self.access_token = None
+
+        return request, response
+
+    async def get_me(self) -> Tuple["httpx.Request", "httpx.Response"]:
+        return await self.request(method="GET", url=f"{self.base_url}/me")
+
+    async def get_me_posts(self) -> Tuple["httpx.Request", "httpx.Response"]:
+        return await self.request(method="GET", url=f"{self.base_url}/me/posts")
+
+    async def iter_me_posts(
+        self, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields the authenticated user's posts one at a time, parsing the
+        response body incrementally as it is downloaded.
+        """
+        async with self.stream("GET", f"{self.base_url}/me/posts") as response:
+            response.raise_for_status()
+
+            parser = JSONArrayParser("data")
+            async for chunk in response.aiter_bytes(chunk_size):
+                for post in parser.feed(chunk):
+                    yield post
+                if parser.done:
+                    return
+
+            for post in parser.close():
+                yield post
+
+    async def get_me_collections(
+        self,
+    ) -> Tuple["httpx.Request", "httpx.Response"]:
+        return await self.request(
+            method="GET", url=f"{self.base_url}/me/collections"
+        )
+
+    async def get_collection_posts(
+        self, alias: str, page: int = 1
+    ) -> Tuple["httpx.Request", "httpx.Response"]:
+        return await self.request(
+            method="GET",
+            url=f"{self.base_url}/collections/{alias}/posts",
+            params={"page": page},
+        )
@@ -0,0 +1,296 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlite_utils import Database
+
+from . import service
+from .async_client import AsyncWriteFreelyClient
+
+
+class AsyncDatabaseWriter:
+    """
+    Funnels writes from any number of coroutines into a single SQLite
+    connection.
+
+    The connection is owned by a dedicated thread, so writes never block the
+    event loop, and the writes are applied one at a time from a bounded
+    queue by a single writer task. Writes are not committed until commit is
+    called, so a whole run can be written in one transaction.
+    """
+
+    def __init__(self, db_path: Path, max_pending: int = 16):
+        self.db_path = db_path
+        self.max_pending = max_pending
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.db: Optional[Database] = None
+        self.fts_load: Optional[service.FTSBulkLoad] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "AsyncDatabaseWriter":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+        await self.close()
+
+    async def run_in_thread(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def start(self):
+        self.db = await self.run_in_thread(service.open_database, self.db_path)
+        await self.run_in_thread(service.build_database, self.db)
+
+        self.start_fts_load()
+
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """
+        The writer task, applies the queued writes in order.
+        """
+        assert self.queue is not None
+
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+
+            func, args, future = job
+            try:
+                result = await self.run_in_thread(func, self.db, *args)
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def submit(self, func: Callable, *args) -> asyncio.Future:
+        """
+        Queue a write, waiting if the queue is full. Returns a future for the
+        write's result. func is called with the database and args.
+        """
+        assert self.queue is not None
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, future))
+        return future
+
+    async def write(self, func: Callable, *args) -> Any:
+        """
+        Queue a write and wait for it to be applied.
+        """
+        return await (await self.submit(func, *args))
+
+    def start_fts_load(self):
+        """
+        Each transaction is a bulk load, so a large run only rebuilds the
+        full-text search indexes once, when it's committed.
+        """
+        assert self.db is not None
+
+        self.fts_load = service.FTSBulkLoad(self.db)
+        self.fts_load.start()
+
+    async def commit(self):
+        def commit(db: Database):
+            assert self.fts_load is not None
+            self.fts_load.finish()
+            db.conn.commit()
+            self.start_fts_load()
+
+        await self.write(commit)
+
+    async def rollback(self):
+        def rollback(db: Database):
+            assert self.fts_load is not None
+            self.fts_load.finish(rebuild=False)
+            db.conn.rollback()
+            self.start_fts_load()
+
+        await self.write(rollback)
+
+    async def close(self):
+        if self.queue is not None and self.task is not None:
+            await self.queue.put(None)
+            await self.task
+
+        if self.fts_load is not None:
+            await self.run_in_thread(self.fts_load.finish, False)
+
+        if self.db is not None:
+            await self.run_in_thread(self.db.close)
+
+        self.executor.shutdown(wait=True)
+
+
+async def get_user(client: AsyncWriteFreelyClient) -> Dict[str, Any]:
+    """
+    Get the authenticated user.
+    """
+    _, response = await client.get_me()
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+async def get_collections(
+    client: AsyncWriteFreelyClient,
+) -> List[Dict[str, Any]]:
+    """
+    Get the collections for the authenticated user.
+    """
+    _, response = await client.get_me_collections()
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+async def get_collection_posts_page(
+    client: AsyncWriteFreelyClient, alias: str, page: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get a single page of a collection's posts, returns the posts and the
+    total number of posts in the collection.
+    """
+    _, response = await client.get_collection_posts(alias, page=page)
+    response.raise_for_status()
+    data = response.json()["data"]
+
+    posts = data.get("posts") or []
+    for post in posts:
+        post.setdefault("collection", {"alias": alias})
+
+    return posts, data.get("total_posts", len(posts))
+
+
+async def iter_collection_posts(
+    client: AsyncWriteFreelyClient, alias: str, workers: int = 16
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Iterate over all the posts in a collection, downloading up to workers
+    pages at a time. The posts are yielded in page order.
+    """
+    posts, total_posts = await get_collection_posts_page(client, alias, 1)
+    for post in posts:
+        yield post
+
+    if not posts:
+        return
+
+    page_count = math.ceil(total_posts / len(posts))
+
+    for first_page in range(2, page_count + 1, workers):
+        last_page = min(first_page + workers, page_count + 1)
+        pages = await asyncio.gather(
+            *(
+                get_collection_posts_page(client, alias, page)
+                for page in range(first_page, last_page)
+            )
+        )
+        for page_posts, _ in pages:
+            for post in page_posts:
+                yield post
+
+
+async def sync(
+    writer: AsyncDatabaseWriter,
+    client: AsyncWriteFreelyClient,
+    incremental: bool = False,
+    batch_size: int = 100,
+) -> Dict[str, int]:
+    """
+    The asyncio equivalent of service.sync, saves the authenticated user,
+    their collections and their posts. The requests are made concurrently
+    and the writes are funnelled through the writer, which is left to
+    commit them. Returns the number of rows written to each table.
+
+    Like service.sync, the user's posts and collections that are no longer
+    on the server are marked as deleted. The asyncio client doesn't cache
+    responses, so the whole lists are always downloaded.
+    """
+    counts = {"users": 0, "collections": 0, "posts": 0}
+    fetched_at = service.utc_timestamp()
+
+    user_task = asyncio.create_task(get_user(client))
+    collections_task = asyncio.create_task(get_collections(client))
+
+    async def create_fetched_posts():
+        user_username = (await user_task)["username"]
+        await writer.write(service.create_fetched_keys, "posts", user_username)
+
+    fetched_posts_task = asyncio.create_task(create_fetched_posts())
+
+    async def write_posts(posts: List[Dict[str, Any]]):
+        user_username = (await user_task)["username"]
+        rows, view_rows = service.project_posts(posts, user_username)
+        counts["posts"] += await writer.write(
+            service.write_posts, rows, user_username, incremental
+        )
+        await writer.write(service.write_post_views, view_rows, fetched_at)
+        await fetched_posts_task
+        await writer.write(
+            service.add_fetched_keys,
+            "posts",
+            user_username,
+            [row[service.POST_ID_INDEX] for row in rows],
+        )
+
+    try:
+        # The posts request is made while the user and collections are still
+        # being fetched.
+        batch: List[Dict[str, Any]] = []
+        async for post in client.iter_me_posts():
+            batch.append(post)
+            if len(batch) >= batch_size:
+                await write_posts(batch)
+                batch = []
+        if batch:
+            await write_posts(batch)
+
+        user = await user_task
+        await writer.write(service.write_user, service.project_user(user))
+        counts["users"] = 1
+
+        rows, view_rows = service.project_collections(
+            await collections_task, user["username"]
+        )
+        await writer.write(service.write_collections, rows)
+        await writer.write(
+            service.write_collection_views, view_rows, fetched_at
+        )
+        counts["collections"] = len(rows)
+
+        await writer.write(
+            service.create_fetched_keys, "collections", user["username"]
+        )
+        await writer.write(
+            service.add_fetched_keys,
+            "collections",
+            user["username"],
+            [row[0] for row in rows],
+        )
+        await writer.write(
+            service.mark_deleted, "collections", user["username"], fetched_at
+        )
+
+        # Only once all the posts have been read, so a sync whose download
+        # fails doesn't have its posts marked as deleted.
+        await fetched_posts_task
+        await writer.write(
+            service.mark_deleted, "posts", user["username"], fetched_at
+        )
+    except BaseException:
+        user_task.cancel()
+        collections_task.cancel()
+        fetched_posts_task.cancel()
+        raise
+
+    return counts
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Optional
+
+# The default maximum size of the cached response bodies.
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    An on-disk cache of WriteFreely response bodies, keyed by URL and access
+    token, used to make conditional requests.
+
+    The bodies are stored as files in the cache directory, alongside a
+    SQLite index of their validators (the ETag and Last-Modified headers),
+    sizes and when they were last used. When the bodies take up more than
+    max_bytes the least recently used are evicted.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            self.directory / "index.db", check_same_thread=False
+        )
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, "
+                "etag TEXT, "
+                "last_modified TEXT, "
+                "size INTEGER NOT NULL, "
+                "accessed REAL NOT NULL"
+                ")"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed "
+                "ON entries (accessed)"
+            )
+
+    @staticmethod
+    def make_key(url: str, access_token: Optional[str]) -> str:
+        """
+        Returns the cache key for a URL requested with an access token, the
+        token itself is never stored.
+        """
+        raw_key = f"{access_token or ''}\n{url}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def body_path(self, key: str) -> Path:
+        return self.directory / f"{key}.body"
+
+    def conditional_headers(self, key: str) -> Dict[str, str]:
+        """
+        Returns the If-None-Match and If-Modified-Since headers for a cached
+        response, if there is one.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM entries WHERE key = ?",
+                [key],
+            ).fetchone()
+
+        if row is None or self.body_path(key).exists() is False:
+            return {}
+
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def hit(self, key: str) -> Optional[BinaryIO]:
+        """
+        Record that a cached response was still valid, and returns its body
+        opened for reading. Returns None, without counting a hit, if the
+        entry has been evicted since its validators were read.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT size FROM entries WHERE key = ?", [key]
+            ).fetchone()
+            if row is None:
+                return None
+
+            # The body is opened with the lock held, so it can't be evicted
+            # in between, and stays readable if it's evicted afterwards.
+            try:
+                body_file = self.body_path(key).open("rb")
+            except FileNotFoundError:
+                return None
+
+            self.conn.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                [time.time(), key],
+            )
+            self.hits += 1
+            self.bytes_saved += row[0]
+
+        return body_file
+
+    def miss(self):
+        """
+        Record that a response had to be downloaded in full.
+        """
+        with self.lock:
+            self.misses += 1
+
+    def store(
+        self,
+        key: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        chunks: Iterator[bytes],
+    ) -> Iterator[bytes]:
+        """
+        Pass through the chunks of a response body while writing them to the
+        cache. The entry is only saved once all the chunks have been read.
+        """
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=self.directory, suffix=".tmp"
+        )
+        size = 0
+        completed = False
+
+        try:
+            with os.fdopen(file_descriptor, "wb") as file_obj:
+                for chunk in chunks:
+                    file_obj.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                os.replace(temp_path, self.body_path(key))
+                self.save_entry(key, etag, last_modified, size)
+            else:
+                os.unlink(temp_path)
+
+    def save_entry(
+        self,
+        key: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        size: int,
+    ):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, etag, last_modified, size, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [key, etag, last_modified, size, time.time()],
+            )
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the bodies fit within
+        max_bytes. Must be called with the lock held.
+        """
+        (total,) = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", [key])
+            self.body_path(key).unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit, miss and bytes saved counters.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+def wrap_iter_content(
+    cache: ResponseCache,
+    key: str,
+    etag: Optional[str],
+    last_modified: Optional[str],
+    iter_content: Callable[..., Iterator[bytes]],
+) -> Callable[..., Iterator[bytes]]:
+    """
+    Wrap a response's iter_content method so the body is written to the
+    cache as it's read.
+    """
+
+    def cached_iter_content(*args, **kwargs) -> Iterator[bytes]:
+        return cache.store(
+            key, etag, last_modified, iter_content(*args, **kwargs)
+        )
+
+    return cached_iter_content
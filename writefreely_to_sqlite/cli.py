@@ -1,11 +1,208 @@
+import itertools
 import json
-from copy import deepcopy
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
 
 import click
 
 from . import service
+from .cache import ResponseCache
 from .client import WriteFreelyClient
+from .metrics import SyncMetrics, cprofile
+from .utils import chunks
+
+
+def cache_options(func):
+    """
+    Adds the response cache options to a command.
+    """
+    func = click.option(
+        "--cache-size",
+        type=click.IntRange(min=1),
+        default=100,
+        show_default=True,
+        help="Maximum size of the response cache in MiB",
+    )(func)
+    func = click.option(
+        "--cache-dir",
+        type=click.Path(file_okay=False, dir_okay=True, allow_dash=False),
+        default=None,
+        help=(
+            "Directory to cache responses in, unchanged responses are "
+            "skipped on the next run"
+        ),
+    )(func)
+    return func
+
+
+def profile_options(func):
+    """
+    Adds the --fast-import and --safe write profile options to a command.
+    """
+    func = click.option(
+        "--safe",
+        "profile",
+        flag_value="safe",
+        help="Sync every commit to disk, nothing committed is ever lost",
+    )(func)
+    func = click.option(
+        "--fast-import",
+        "profile",
+        flag_value="fast",
+        help=(
+            "Don't sync to disk or keep a journal on disk, fastest for a "
+            "first import but a crash can corrupt the database"
+        ),
+    )(func)
+    func = click.option(
+        "--default-profile",
+        "profile",
+        flag_value="default",
+        default=True,
+        hidden=True,
+    )(func)
+    return func
+
+
+def metrics_options(func):
+    """
+    Adds the --profile and --profile-dump options to a command.
+    """
+    func = click.option(
+        "--profile-dump",
+        type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+        default=None,
+        help="Run under cProfile and save the stats to this file for pstats",
+    )(func)
+    func = click.option(
+        "--profile",
+        "print_profile",
+        is_flag=True,
+        default=False,
+        help="Print how long each stage of the run took",
+    )(func)
+    return func
+
+
+def derive_options(func):
+    """
+    Adds the --derive/--no-derive and --derive-workers options to a command.
+    """
+    func = click.option(
+        "--derive-workers",
+        type=click.IntRange(min=1),
+        default=None,
+        help=(
+            "Number of processes computing the posts' derived columns, "
+            "defaults to the number of CPUs"
+        ),
+    )(func)
+    func = click.option(
+        "--derive/--no-derive",
+        default=True,
+        show_default=True,
+        help="Compute the derived columns of posts whose bodies changed",
+    )(func)
+    return func
+
+
+def echo_metrics(metrics: SyncMetrics):
+    """
+    Print the time spent in each stage and the run's totals.
+    """
+    click.echo(
+        f"{'Stage':<20} {'Seconds':>9} {'Calls':>7} {'Written':>9} "
+        f"{'Skipped':>9}"
+    )
+    for name, stage in sorted(
+        metrics.stages.items(),
+        key=lambda item: item[1]["seconds"],
+        reverse=True,
+    ):
+        click.echo(
+            f"{name:<20} {stage['seconds']:>9.3f} {stage['calls']:>7} "
+            f"{stage['rows_written']:>9} {stage['rows_skipped']:>9}"
+        )
+    click.echo(
+        f"Took {metrics.finish():.3f}s, downloaded "
+        f"{metrics.bytes_downloaded} bytes, wrote {metrics.rows_written} "
+        f"rows and skipped {metrics.rows_skipped}."
+    )
+
+
+@contextmanager
+def record_run(
+    db, command: str, print_profile: bool, profile_dump
+) -> Iterator[SyncMetrics]:
+    """
+    Time the run's stages, and record them in the sync_runs table whether
+    the run succeeds or not.
+    """
+    metrics = SyncMetrics()
+    started_at = service.utc_timestamp()
+    error = None
+
+    try:
+        with cprofile(profile_dump):
+            with metrics.stage("build_database"):
+                service.build_database(db)
+            yield metrics
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        metrics.finish()
+        service.save_sync_run(db, command, metrics, started_at, error=error)
+        if print_profile:
+            echo_metrics(metrics)
+
+
+def open_database(db_path, profile):
+    """
+    Open the database with a write profile and print which it is.
+    """
+    db = service.open_database(db_path, profile=profile)
+    click.echo(
+        f"Write profile: {profile} ({service.describe_write_profile(db)})."
+    )
+    return db
+
+
+def get_client(auth, cache_dir, cache_size, **kwargs) -> WriteFreelyClient:
+    """
+    Returns a client for the auth file, with a response cache if a cache
+    directory was given.
+    """
+    return service.get_client(
+        auth,
+        cache_dir=Path(cache_dir) if cache_dir else None,
+        cache_max_bytes=cache_size * 1024 * 1024,
+        **kwargs,
+    )
+
+
+def echo_cache_stats(client: WriteFreelyClient):
+    """
+    Print the response cache's counters, if the client has a cache.
+    """
+    if client.cache is None:
+        return
+
+    stats = client.cache.stats()
+    click.echo(
+        f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+        f"{stats['bytes_saved']} bytes saved."
+    )
+
+
+def get_database_size(db) -> int:
+    """
+    Returns the size of the database's pages in bytes.
+    """
+    (page_count,) = db.execute("PRAGMA page_count").fetchone()
+    (page_size,) = db.execute("PRAGMA page_size").fetchone()
+    return page_count * page_size
 
 
 @click.group()
@@ -67,15 +264,25 @@ def auth(auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def user(db_path, auth):
+@profile_options
+@metrics_options
+def user(db_path, auth, profile, print_profile, profile_dump):
     """
     Save the authenticated user.
     """
-    db = service.open_database(db_path)
+    db = open_database(db_path, profile)
     client = service.get_client(auth)
 
-    data = service.get_user(client)
-    service.save_user(db, data)
+    with record_run(db, "user", print_profile, profile_dump) as metrics:
+        metrics.watch(client)
+
+        with metrics.stage("fetch"):
+            data = service.get_user(client)
+        with metrics.stage("write_users"):
+            service.save_user(db, data)
+        metrics.add("write_users", rows_written=1)
+
+    service.checkpoint(db)
 
 
 @cli.command()
@@ -93,21 +300,110 @@ def user(db_path, auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def posts(db_path, auth):
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of posts to write to the database at a time",
+)
+@click.option(
+    "--by-collection",
+    is_flag=True,
+    default=False,
+    help=(
+        "Page through each collection's posts instead of fetching all posts "
+        "in one request, anonymous posts are not included"
+    ),
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of pages to download at a time with --by-collection",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only write posts that are new or changed since the last run",
+)
+@cache_options
+@profile_options
+@derive_options
+@metrics_options
+def posts(
+    db_path,
+    auth,
+    batch_size,
+    by_collection,
+    workers,
+    incremental,
+    derive,
+    derive_workers,
+    cache_dir,
+    cache_size,
+    profile,
+    print_profile,
+    profile_dump,
+):
     """
     Save the authenticated user WriteFreely posts.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    db = open_database(db_path, profile)
+    client = get_client(auth, cache_dir, cache_size, pool_maxsize=workers)
 
-    user = service.get_user(client)
-    user_username = user["username"]
+    with record_run(db, "posts", print_profile, profile_dump) as metrics:
+        metrics.watch(client)
 
-    posts = service.get_posts(client)
-    service.save_posts(
-        db=db, posts=deepcopy(posts), user_username=user_username
-    )
-    service.save_post_views(db=db, post_views=deepcopy(posts))
+        fetched_at = service.utc_timestamp()
+        with metrics.stage("fetch"):
+            user = service.get_user(client)
+        user_username = user["username"]
+
+        if by_collection:
+            with metrics.stage("fetch"):
+                aliases = [c["alias"] for c in service.get_collections(client)]
+            posts_iter = itertools.chain.from_iterable(
+                service.iter_collection_posts(client, alias, workers=workers)
+                for alias in aliases
+            )
+        else:
+            posts_iter = service.iter_posts(client, skip_unchanged=True)
+
+        # One transaction for the whole run, so a large import can defer its
+        # full-text search indexing until the end.
+        with db.conn, service.fts_bulk_load(db, metrics=metrics):
+            for batch in chunks(
+                metrics.timed_iter("read_posts", posts_iter), batch_size
+            ):
+                with metrics.stage("project"):
+                    rows, view_rows = service.project_posts(
+                        batch, user_username
+                    )
+                with metrics.stage("write_posts"):
+                    written = service.write_posts(
+                        db=db,
+                        rows=rows,
+                        user_username=user_username,
+                        incremental=incremental,
+                    )
+                metrics.add(
+                    "write_posts",
+                    rows_written=written,
+                    rows_skipped=len(rows) - written,
+                )
+                service.write_views_stage(
+                    metrics, service.write_post_views, db, view_rows, fetched_at
+                )
+
+        if derive:
+            service.update_post_derived(db, derive_workers, metrics=metrics)
+
+    service.checkpoint(db)
+    echo_cache_stats(client)
 
 
 @cli.command()
@@ -125,20 +421,504 @@ def posts(db_path, auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def collections(db_path, auth):
+@cache_options
+@profile_options
+@metrics_options
+def collections(
+    db_path, auth, cache_dir, cache_size, profile, print_profile, profile_dump
+):
     """
     Save the authenticated user WriteFreely collections.
     """
+    db = open_database(db_path, profile)
+    client = get_client(auth, cache_dir, cache_size)
+
+    with record_run(db, "collections", print_profile, profile_dump) as metrics:
+        metrics.watch(client)
+
+        fetched_at = service.utc_timestamp()
+        with metrics.stage("fetch"):
+            user = service.get_user(client)
+            collections = service.get_collections(client, skip_unchanged=True)
+        user_username = user["username"]
+
+        with metrics.stage("project"):
+            rows, view_rows = service.project_collections(
+                collections, user_username
+            )
+        with db.conn, service.fts_bulk_load(db, metrics=metrics):
+            with metrics.stage("write_collections"):
+                service.write_collections(db=db, rows=rows)
+            metrics.add("write_collections", rows_written=len(rows))
+            service.write_views_stage(
+                metrics,
+                service.write_collection_views,
+                db,
+                view_rows,
+                fetched_at,
+            )
+
+    service.checkpoint(db)
+    echo_cache_stats(client)
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of posts to write to the database at a time",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only write posts that are new or changed since the last run",
+)
+@cache_options
+@profile_options
+@derive_options
+@metrics_options
+def sync(
+    db_path,
+    auth,
+    batch_size,
+    incremental,
+    derive,
+    derive_workers,
+    cache_dir,
+    cache_size,
+    profile,
+    print_profile,
+    profile_dump,
+):
+    """
+    Save the authenticated user, their collections and their posts.
+    """
+    db = open_database(db_path, profile)
+    client = get_client(auth, cache_dir, cache_size)
+
+    with record_run(db, "sync", print_profile, profile_dump) as metrics:
+        metrics.watch(client)
+        counts = service.sync(
+            db=db,
+            client=client,
+            incremental=incremental,
+            batch_size=batch_size,
+            metrics=metrics,
+        )
+        if derive:
+            service.update_post_derived(db, derive_workers, metrics=metrics)
+    service.checkpoint(db)
+
+    click.echo(
+        f"Saved {counts['users']} user, {counts['collections']} collections "
+        f"and {counts['posts']} posts."
+    )
+    echo_cache_stats(client)
+
+
+@cli.command(name="import")
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.argument(
+    "export_path",
+    type=click.Path(file_okay=True, dir_okay=False, exists=True),
+    required=True,
+)
+@click.option(
+    "-u",
+    "--username",
+    default=None,
+    help="Username the posts belong to, needed for CSV and ZIP exports",
+)
+@click.option(
+    "--format",
+    "export_format",
+    type=click.Choice(["json", "csv", "zip"]),
+    default=None,
+    help="Format of the export, detected from the file by default",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of posts to write to the database at a time",
+)
+@profile_options
+@derive_options
+@metrics_options
+def import_(
+    db_path,
+    export_path,
+    username,
+    export_format,
+    batch_size,
+    derive,
+    derive_workers,
+    profile,
+    print_profile,
+    profile_dump,
+):
+    """
+    Save the posts in a WriteFreely export file, without using the API.
+
+    EXPORT_PATH is a JSON, CSV or ZIP export, downloaded from WriteFreely's
+    Export page.
+    """
+    db = open_database(db_path, profile)
+
+    with record_run(db, "import", print_profile, profile_dump) as metrics:
+        try:
+            counts = service.import_export(
+                db=db,
+                path=Path(export_path),
+                user_username=username,
+                export_format=export_format,
+                batch_size=batch_size,
+                metrics=metrics,
+            )
+        except ValueError as error:
+            raise click.UsageError(str(error))
+        if derive:
+            service.update_post_derived(db, derive_workers, metrics=metrics)
+    service.checkpoint(db)
+
+    click.echo(
+        f"Saved {counts['users']} user, {counts['collections']} collections "
+        f"and {counts['posts']} posts."
+    )
+
+
+@cli.command(name="from-db")
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.argument(
+    "source_path",
+    type=click.Path(file_okay=True, dir_okay=False, exists=True),
+    required=True,
+)
+@click.option(
+    "-u",
+    "--username",
+    "usernames",
+    multiple=True,
+    help="Only save this user's collections and posts, can be repeated",
+)
+@click.option(
+    "--url",
+    "base_url",
+    default=None,
+    help="The instance's URL, used to save the collections' URLs",
+)
+@profile_options
+@derive_options
+@metrics_options
+def from_db(
+    db_path,
+    source_path,
+    usernames,
+    base_url,
+    derive,
+    derive_workers,
+    profile,
+    print_profile,
+    profile_dump,
+):
+    """
+    Save everything in a WriteFreely instance's SQLite database.
+
+    SOURCE_PATH is the database of a self-hosted WriteFreely instance, it's
+    only read from.
+    """
+    db = open_database(db_path, profile)
+
+    with record_run(db, "from-db", print_profile, profile_dump) as metrics:
+        counts = service.import_database(
+            db=db,
+            source_path=Path(source_path),
+            usernames=list(usernames),
+            base_url=base_url,
+            metrics=metrics,
+        )
+        if derive:
+            service.update_post_derived(db, derive_workers, metrics=metrics)
+    service.checkpoint(db)
+
+    click.echo(
+        f"Saved {counts['users']} users, {counts['collections']} collections "
+        f"and {counts['posts']} posts."
+    )
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.argument(
+    "accounts_path",
+    type=click.Path(file_okay=True, dir_okay=True, exists=True),
+    required=True,
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of accounts to fetch at a time",
+)
+@click.option(
+    "--per-host",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Number of accounts to fetch at a time from the same instance",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of posts to write to the database at a time",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only write posts that are new or changed since the last run",
+)
+@cache_options
+@profile_options
+@metrics_options
+def accounts(
+    db_path,
+    accounts_path,
+    workers,
+    per_host,
+    batch_size,
+    incremental,
+    cache_dir,
+    cache_size,
+    profile,
+    print_profile,
+    profile_dump,
+):
+    """
+    Save several WriteFreely accounts to one database.
+
+    ACCOUNTS_PATH is a directory of auth.json files, or a JSON manifest
+    listing the paths of the auth files.
+    """
+    db = open_database(db_path, profile)
+
+    # One cache shared by every account's client, it's thread-safe.
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(
+            Path(cache_dir), max_bytes=cache_size * 1024 * 1024
+        )
+
+    with record_run(db, "accounts", print_profile, profile_dump) as metrics:
+        reports = service.sync_accounts(
+            db=db,
+            auth_file_paths=service.find_auth_files(Path(accounts_path)),
+            workers=workers,
+            per_host=per_host,
+            incremental=incremental,
+            batch_size=batch_size,
+            metrics=metrics,
+            cache=cache,
+        )
+    service.checkpoint(db)
+
+    for report in sorted(reports, key=lambda r: r["seconds"], reverse=True):
+        account = f"{report['username'] or report['auth']}@{report['domain']}"
+        if report["error"]:
+            click.echo(
+                f"{account}: failed after {report['seconds']:.2f}s "
+                f"({report['error']})",
+                err=True,
+            )
+        else:
+            click.echo(
+                f"{account}: {report['collections']} collections and "
+                f"{report['posts']} posts in {report['seconds']:.2f}s"
+            )
+
+    if cache is not None:
+        stats = cache.stats()
+        click.echo(
+            f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['bytes_saved']} bytes saved."
+        )
+
+    if any(report["error"] for report in reports):
+        raise click.exceptions.Exit(1)
+
+
+@cli.command(name="compress-bodies")
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "--codec",
+    type=click.Choice(["zlib", "zstd"]),
+    default="zlib",
+    show_default=True,
+    help="Codec to compress the bodies with, zstd needs the zstd extra",
+)
+@click.option(
+    "--vacuum/--no-vacuum",
+    default=True,
+    show_default=True,
+    help="Vacuum the database afterwards to reclaim the space saved",
+)
+def compress_bodies(db_path, codec, vacuum):
+    """
+    Store the posts' bodies compressed.
+
+    Existing bodies are compressed, and posts saved later are compressed as
+    they're written. The posts_text view has the plain text bodies.
+    """
     db = service.open_database(db_path)
-    client = service.get_client(auth)
+    size_before = get_database_size(db)
+
+    try:
+        count = service.enable_body_compression(db, codec=codec)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--codec")
+
+    if vacuum:
+        db.vacuum()
+
+    click.echo(
+        f"Compressed {count} post bodies with {codec}, the database went "
+        f"from {size_before} to {get_database_size(db)} bytes."
+    )
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of processes to use, defaults to the number of CPUs",
+)
+def derive(db_path, workers):
+    """
+    Compute the posts' derived columns.
+
+    The word count, reading time, HTML, excerpt and links of each post are
+    saved in the post_derived table. Only posts whose bodies have changed
+    since they were last computed are processed.
+    """
+    db = service.open_database(db_path)
+    count = service.update_post_derived(db, workers=workers)
+    click.echo(f"Computed the derived columns of {count} posts.")
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.argument("post_id", required=True)
+@click.argument("revision", type=click.IntRange(min=1), required=False)
+def revision(db_path, post_id, revision):
+    """
+    Print a post's body as it was at a revision.
+
+    Without REVISION the post's revisions are listed. The number after the
+    latest revision is the post's current body.
+    """
+    db = service.open_database(db_path)
+    service.build_database(db)
+
+    if revision is None:
+        for number, updated, snapshot, size in db.execute(
+            "SELECT revision, updated, snapshot, length(data) "
+            "FROM post_revisions WHERE post_id = ? ORDER BY revision",
+            [post_id],
+        ):
+            kind = "snapshot" if snapshot else "delta"
+            click.echo(f"{number:>5}  {updated}  {kind:<8} {size:>8} bytes")
+        return
+
+    body = service.get_post_revision(db, post_id, revision)
+    if body is None:
+        raise click.ClickException(
+            f"Post {post_id} doesn't have a revision {revision}."
+        )
+    click.echo(body)
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help=(
+        "Rebuild the daily and weekly views from the whole views history, "
+        "not just the totals and top posts"
+    ),
+)
+def rollup(db_path, rebuild):
+    """
+    Refresh the views rollup tables.
+
+    The rollups are kept up to date as views are saved, this is for
+    backfills and for correcting them after posts move between collections.
+    """
+    db = service.open_database(db_path)
+    service.build_database(db)
 
-    user = service.get_user(client)
-    user_username = user["username"]
+    with db.conn:
+        if rebuild:
+            service.rebuild_rollups(db)
+        else:
+            service.rebuild_collection_rollups(db)
 
-    collections = service.get_collections(client)
-    service.save_collections(
-        db=db,
-        collections=deepcopy(collections),
-        user_username=user_username,
+    click.echo(
+        "Rebuilt the views rollups."
+        if rebuild
+        else "Refreshed the collection totals and top posts."
     )
-    service.save_collection_views(db=db, collection_views=deepcopy(collections))
@@ -1,8 +1,139 @@
-from typing import Any, Dict, Optional, Tuple
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-from requests import PreparedRequest, Request, Response, Session
+from requests import PreparedRequest, Request, Response, Session, exceptions
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
 
+from .cache import ResponseCache, wrap_iter_content
+from .utils import iter_json_array
+
+# The size of the chunks read from streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# The default connect and read timeouts in seconds.
+DEFAULT_TIMEOUT = (10, 60)
+
+# The status codes that mean the server is throttling us or is temporarily
+# unavailable, so the request can be retried.
+THROTTLE_STATUS_CODES = (429, 503)
+RETRY_STATUS_CODES = THROTTLE_STATUS_CODES + (502, 504)
+
+# Only these methods are retried after a connection error or a gateway
+# error, the others might have already been processed.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "DELETE")
+
+
+def get_base_url(domain: str) -> str:
+    """
+    Returns the API URL of a WriteFreely instance. The domain can include a
+    scheme, for instances that aren't served over HTTPS, otherwise HTTPS is
+    used.
+    """
+    if "://" not in domain:
+        domain = f"https://{domain}"
+    return f"{domain.rstrip('/')}/api"
+
+
+def iter_response_data(
+    response: Response, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[Any]:
+    """
+    Yields the items of a streamed response's data array one at a time,
+    parsing the body incrementally as it is downloaded.
+    """
+    with response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=chunk_size)
+        yield from iter_json_array(chunks, key="data")
+
+        # Read the rest of the body, so it's complete for the cache.
+        for _ in chunks:
+            pass
+
+
+def is_not_modified(response: Response) -> bool:
+    """
+    Returns True if the response is unchanged since it was cached.
+    """
+    return response.status_code == 304
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Returns the number of seconds to wait from a Retry-After header, which
+    is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AdaptiveLimiter:
+    """
+    Limits how many requests are in flight at once, adapting the limit with
+    additive increase and multiplicative decrease (AIMD). The limit is
+    halved each time the server throttles a request, and grows back by
+    about one for every limit's worth of successful requests.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            else:
+                self.limit = min(
+                    float(self.max_limit), self.limit + 1 / self.limit
+                )
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator["LimiterSlot"]:
+        """
+        Hold a slot for a request, the slot should be marked as throttled if
+        the server pushed back.
+        """
+        self.acquire()
+        slot = LimiterSlot()
+        try:
+            yield slot
+        finally:
+            self.release(throttled=slot.throttled)
+
+
+class LimiterSlot:
+    def __init__(self):
+        self.throttled = False
+
 
 class WriteFreelyAuth(AuthBase):
     def __init__(self, access_token: str):
@@ -18,14 +149,39 @@ class WriteFreelyClient:
         self,
         domain: str,
         access_token: Optional[str] = None,
+        pool_maxsize: int = 10,
+        cache: Optional[ResponseCache] = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60.0,
     ):
         self.domain = domain
         self.access_token = access_token
+        self.cache = cache
+
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
 
-        self.base_url = f"https://{domain}/api"
+        # Shared by everything using this client, so concurrent fetchers
+        # back off together when the server throttles them.
+        self.limiter = AdaptiveLimiter(max_limit=pool_maxsize)
+
+        # The bytes of the response bodies downloaded, bodies read from the
+        # response cache aren't counted.
+        self.bytes_received = 0
+        self.bytes_lock = threading.Lock()
+
+        self.base_url = get_base_url(domain)
 
         self.session = Session()
 
+        # Size the connection pool, so concurrent fetchers sharing this
+        # session reuse their connections instead of opening new ones.
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
         if self.access_token is not None:
             self.session.auth = WriteFreelyAuth(self.access_token)
         else:
@@ -41,7 +197,8 @@ class WriteFreelyClient:
         url: str,
         json: Any = None,
         headers: Optional[Dict[str, str]] = None,
-        timeout: Optional[Tuple[int, int]] = None,
+        timeout: Optional[Tuple[int, int]] = DEFAULT_TIMEOUT,
+        stream: bool = False,
         **kwargs,
     ) -> Tuple[PreparedRequest, Response]:
         """
@@ -55,10 +212,156 @@ class WriteFreelyClient:
         )
 
         prepped = self.session.prepare_request(request)
-        response = self.session.send(prepped, timeout=timeout)
+
+        if self.cache is not None and method == "GET":
+            response = self.send_cached(prepped, timeout=timeout, stream=stream)
+        else:
+            response = self.send(prepped, timeout=timeout, stream=stream)
 
         return prepped, response
 
+    def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        """
+        Sleep before retrying a request, honouring the server's Retry-After
+        header or else using exponential backoff with full jitter.
+        """
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max)
+        else:
+            delay = random.uniform(
+                0, min(self.backoff_max, self.backoff_base * 2**attempt)
+            )
+        time.sleep(delay)
+
+    def send(
+        self,
+        prepped: PreparedRequest,
+        timeout: Optional[Tuple[int, int]] = DEFAULT_TIMEOUT,
+        stream: bool = False,
+    ) -> Response:
+        """
+        Sends a prepared request through the adaptive limiter, retrying when
+        the server throttles us or is temporarily unavailable.
+        """
+        idempotent = prepped.method in IDEMPOTENT_METHODS
+        attempt = 0
+
+        while True:
+            response: Optional[Response] = None
+            retry_after = None
+
+            with self.limiter.slot() as slot:
+                try:
+                    response = self.session.send(
+                        prepped, timeout=timeout, stream=stream
+                    )
+                except (exceptions.ConnectionError, exceptions.Timeout):
+                    if attempt >= self.max_retries or idempotent is False:
+                        raise
+                else:
+                    slot.throttled = (
+                        response.status_code in THROTTLE_STATUS_CODES
+                    )
+
+            if response is not None:
+                retryable = response.status_code in THROTTLE_STATUS_CODES or (
+                    idempotent and response.status_code in RETRY_STATUS_CODES
+                )
+                if attempt >= self.max_retries or retryable is False:
+                    return self.count_bytes(response, stream=stream)
+
+                response.close()
+                retry_after = parse_retry_after(
+                    response.headers.get("Retry-After")
+                )
+
+            self.backoff(attempt, retry_after)
+            attempt += 1
+
+    def add_bytes_received(self, count: int):
+        with self.bytes_lock:
+            self.bytes_received += count
+
+    def count_bytes(self, response: Response, stream: bool) -> Response:
+        """
+        Add the response's body to the bytes received, as it's read if the
+        response is streamed.
+        """
+        if stream is False:
+            self.add_bytes_received(len(response.content))
+            return response
+
+        if is_not_modified(response):
+            # The body will be read from the cache.
+            return response
+
+        iter_content = response.iter_content
+
+        def counted_iter_content(*args, **kwargs) -> Iterator[bytes]:
+            for chunk in iter_content(*args, **kwargs):
+                self.add_bytes_received(len(chunk))
+                yield chunk
+
+        response.iter_content = counted_iter_content  # type: ignore
+        return response
+
+    def send_cached(
+        self,
+        prepped: PreparedRequest,
+        timeout: Optional[Tuple[int, int]] = DEFAULT_TIMEOUT,
+        stream: bool = False,
+    ) -> Response:
+        """
+        Sends a conditional request using the validators of the cached
+        response. A 304 Not Modified response is given the cached body, so
+        it can still be read, and a full response is written to the cache.
+        If the cached body has been evicted in the meantime (the cache can
+        be shared between threads), the request is sent again without the
+        validators.
+        """
+        assert self.cache is not None
+        assert prepped.url is not None
+
+        key = self.cache.make_key(prepped.url, self.access_token)
+        conditional_headers = self.cache.conditional_headers(key)
+        prepped.headers.update(conditional_headers)
+
+        response = self.send(prepped, timeout=timeout, stream=stream)
+
+        if is_not_modified(response):
+            response.close()
+            body_file = self.cache.hit(key)
+            if body_file is not None:
+                if stream:
+                    response.raw = body_file
+                else:
+                    with body_file:
+                        response._content = body_file.read()
+                return response
+
+            for header in conditional_headers:
+                del prepped.headers[header]
+            response = self.send(prepped, timeout=timeout, stream=stream)
+
+        self.cache.miss()
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.ok is False or (etag is None and last_modified is None):
+            return response
+
+        if stream:
+            response.iter_content = wrap_iter_content(  # type: ignore
+                self.cache, key, etag, last_modified, response.iter_content
+            )
+        else:
+            for _ in self.cache.store(
+                key, etag, last_modified, iter([response.content])
+            ):
+                pass
+
+        return response
+
     def auth_login(
         self, alias: str, password: str
     ) -> Tuple[PreparedRequest, Response]:
@@ -89,8 +392,31 @@ class WriteFreelyClient:
     def get_me(self) -> Tuple[PreparedRequest, Response]:
         return self.request(method="GET", url=f"{self.base_url}/me")
 
-    def get_me_posts(self) -> Tuple[PreparedRequest, Response]:
-        return self.request(method="GET", url=f"{self.base_url}/me/posts")
+    def get_me_posts(
+        self, stream: bool = False
+    ) -> Tuple[PreparedRequest, Response]:
+        return self.request(
+            method="GET", url=f"{self.base_url}/me/posts", stream=stream
+        )
+
+    def iter_me_posts(
+        self, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the authenticated user's posts one at a time, parsing the
+        response body incrementally as it is downloaded.
+        """
+        _, response = self.get_me_posts(stream=True)
+        yield from iter_response_data(response, chunk_size=chunk_size)
 
     def get_me_collections(self) -> Tuple[PreparedRequest, Response]:
         return self.request(method="GET", url=f"{self.base_url}/me/collections")
+
+    def get_collection_posts(
+        self, alias: str, page: int = 1
+    ) -> Tuple[PreparedRequest, Response]:
+        return self.request(
+            method="GET",
+            url=f"{self.base_url}/collections/{alias}/posts",
+            params={"page": page},
+        )
@@ -0,0 +1,78 @@
+import sqlite3
+import zlib
+from typing import Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+# Every zstd frame starts with these bytes, which is how compressed bodies
+# are told apart from zlib ones (zlib streams start with 0x78).
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+
+def get_codecs() -> Tuple[str, ...]:
+    """
+    Returns the names of the codecs that can be used to compress bodies.
+    """
+    if zstandard is None:
+        return ("zlib",)
+    return ("zlib", "zstd")
+
+
+def compress_body(body: Optional[str], codec: str = "zlib") -> Optional[bytes]:
+    """
+    Compress a post's body with the zlib or zstd codec.
+    """
+    if body is None:
+        return None
+
+    data = body.encode("utf-8")
+
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(
+                "The zstd codec needs the zstandard package, install the "
+                "zstd extra."
+            )
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress_body(blob: Optional[bytes]) -> Optional[str]:
+    """
+    Decompress a post's body, whichever codec it was compressed with.
+    """
+    if blob is None:
+        return None
+
+    if blob[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError(
+                "The body was compressed with zstd, which needs the "
+                "zstandard package, install the zstd extra."
+            )
+        data = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        data = zlib.decompress(blob)
+
+    return data.decode("utf-8")
+
+
+def register_functions(conn: sqlite3.Connection):
+    """
+    Register the compress_body and decompress_body SQL functions on a
+    connection.
+    """
+    conn.create_function("compress_body", 2, compress_body, deterministic=True)
+    conn.create_function(
+        "decompress_body", 1, decompress_body, deterministic=True
+    )
@@ -0,0 +1,12 @@
+from datasette import hookimpl
+
+from .compression import register_functions
+
+
+@hookimpl
+def prepare_connection(conn):
+    """
+    Register the decompress_body SQL function on Datasette's connections, so
+    the posts_text view works on databases with compressed post bodies.
+    """
+    register_functions(conn)
@@ -0,0 +1,152 @@
+import json
+import math
+import re
+from typing import Any, List, Optional, Tuple
+
+try:
+    import markdown
+except ImportError:  # pragma: no cover
+    markdown = None  # type: ignore
+
+# Bumped whenever the derived columns are computed differently, so the
+# saved ones are recomputed.
+DERIVED_VERSION = 1
+
+# The reading speed the reading time is estimated from.
+WORDS_PER_MINUTE = 200
+
+# The longest an excerpt can be, in characters.
+EXCERPT_LENGTH = 280
+
+DERIVED_COLUMNS: Tuple[str, ...] = (
+    "post_id",
+    "body_hash",
+    "version",
+    "word_count",
+    "reading_time",
+    "html",
+    "excerpt",
+    "links",
+)
+
+# An absolute http(s) URL, in a Markdown link, an autolink, an HTML href or
+# on its own. It starts with a literal rather than a lookbehind, which
+# would be tried at every position and is several times slower.
+URL_RE = re.compile(r"https?://[^\s<>()\[\]\"']+")
+# Trailing punctuation that ends a sentence rather than a bare URL.
+URL_TRAILING = ".,;:!?*_"
+
+# The Markdown syntax removed to get a post's plain text, in order.
+PLAIN_TEXT_SUBS: Tuple[Tuple["re.Pattern[str]", str], ...] = (
+    (re.compile(r"^(```|~~~).*$", re.MULTILINE), ""),
+    (re.compile(r"<(https?://[^>\s]+)>"), r"\1"),
+    (re.compile(r"<[^>\n]+>"), ""),
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"^\s{0,3}(#{1,6}|>+|[-*+]|\d+[.)])\s+", re.MULTILINE), ""),
+    (re.compile(r"^\s{0,3}([-*_]\s*){3,}$", re.MULTILINE), ""),
+)
+# Emphasis, strikethrough and code markers, removed with str.translate,
+# which is much faster than a regular expression.
+MARKERS = str.maketrans("", "", "*`")
+# Underscores, which are only emphasis at the edges of words.
+UNDERSCORES_RE = re.compile(r"_+")
+
+
+def get_version() -> str:
+    """
+    Returns the version of the derived columns, which includes whether the
+    HTML is rendered.
+    """
+    if markdown is None:
+        return str(DERIVED_VERSION)
+    return f"{DERIVED_VERSION}+markdown"
+
+
+def render_html(body: str) -> Optional[str]:
+    """
+    Render a post's Markdown body as HTML, if the markdown package is
+    installed.
+    """
+    if markdown is None:
+        return None
+    return markdown.markdown(body, extensions=["fenced_code", "tables"])
+
+
+def plain_text(body: str) -> str:
+    """
+    Returns a post's body without its Markdown syntax, as a single line.
+    """
+    for pattern, replacement in PLAIN_TEXT_SUBS:
+        body = pattern.sub(replacement, body)
+    body = body.translate(MARKERS).replace("~~", "")
+    body = UNDERSCORES_RE.sub(
+        lambda match: strip_underscores(match, body), body
+    )
+    return " ".join(body.split())
+
+
+def strip_underscores(match: "re.Match[str]", text: str) -> str:
+    start, end = match.span()
+    inside_word = (
+        start > 0
+        and end < len(text)
+        and text[start - 1].isalnum()
+        and text[end].isalnum()
+    )
+    return match.group(0) if inside_word else ""
+
+
+def make_excerpt(text: str, length: int = EXCERPT_LENGTH) -> str:
+    """
+    Returns the start of a post's plain text, cut at a word boundary.
+    """
+    if len(text) <= length:
+        return text
+    cut = text[: length - 1].rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:.") + "…"
+
+
+def find_links(body: str) -> List[str]:
+    """
+    Returns the absolute http(s) URLs a post's body links to, in the order
+    they first appear.
+    """
+    return list(
+        dict.fromkeys(
+            match.group(0).rstrip(URL_TRAILING)
+            for match in URL_RE.finditer(body)
+        )
+    )
+
+
+def derive_post(
+    post_id: str, body_hash: Optional[str], body: Optional[str]
+) -> Tuple[Any, ...]:
+    """
+    Returns a post_derived row for a post's body, in the order of
+    DERIVED_COLUMNS.
+    """
+    body = body or ""
+    text = plain_text(body)
+    word_count = len(text.split())
+    return (
+        post_id,
+        body_hash,
+        get_version(),
+        word_count,
+        math.ceil(word_count / WORDS_PER_MINUTE),
+        render_html(body),
+        make_excerpt(text),
+        json.dumps(find_links(body)),
+    )
+
+
+def derive_posts(
+    posts: List[Tuple[str, Optional[str], Optional[str]]],
+) -> List[Tuple[Any, ...]]:
+    """
+    Returns the post_derived rows for (post_id, body_hash, body) tuples. A
+    batch at a time is sent to the worker processes.
+    """
+    return [derive_post(*post) for post in posts]
@@ -0,0 +1,211 @@
+import csv
+import datetime
+import io
+import sys
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Dict, Iterator, Optional, Tuple
+
+from .utils import JSONReader
+
+# The size of the chunks read from export files.
+READ_CHUNK_SIZE = 1024 * 1024
+
+EXPORT_FORMATS = ("json", "csv", "zip")
+
+# The extensions of the post files in a ZIP export.
+POST_FILE_SUFFIXES = (".txt", ".md")
+
+ZIP_MAGIC = b"PK\x03\x04"
+
+# An export is read as a stream of (kind, item) pairs, where kind is
+# "user", "collection", "post" or "partial_post". A partial post only has
+# the fields CSV and ZIP exports have: its id, slug, created, title, body
+# and collection.
+ExportItem = Tuple[str, Dict[str, Any]]
+
+
+def detect_format(path: Path) -> str:
+    """
+    Returns the format of an export file, from its extension or else its
+    first bytes.
+    """
+    suffix = Path(path).suffix.lower().lstrip(".")
+    if suffix in EXPORT_FORMATS:
+        return suffix
+
+    with Path(path).open("rb") as file_obj:
+        start = file_obj.read(len(ZIP_MAGIC)).lstrip()
+
+    if start.startswith(ZIP_MAGIC):
+        return "zip"
+    if start.startswith(b"{"):
+        return "json"
+    return "csv"
+
+
+def iter_file_chunks(file_obj: IO[bytes]) -> Iterator[bytes]:
+    while True:
+        chunk = file_obj.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_json_export(file_obj: IO[bytes]) -> Iterator[ExportItem]:
+    """
+    Yields the user, collections and posts of a JSON export, which is the
+    user's fields with their collections (each with its posts) and their
+    anonymous posts. The file is parsed incrementally, so only one post is
+    held in memory at a time.
+    """
+    reader = JSONReader(iter_file_chunks(file_obj))
+    user: Dict[str, Any] = {}
+    user_sent = False
+
+    for key in reader.iter_object():
+        if key not in ("collections", "posts"):
+            user[key] = reader.decode()
+            continue
+
+        if user_sent is False:
+            yield "user", user
+            user_sent = True
+
+        for _ in reader.iter_array():
+            if key == "posts":
+                yield "post", reader.decode()
+            else:
+                yield from iter_json_export_collection(reader)
+
+    if user_sent is False:
+        yield "user", user
+
+
+def iter_json_export_collection(reader: JSONReader) -> Iterator[ExportItem]:
+    """
+    Yields a collection of a JSON export and then each of its posts.
+    """
+    collection: Dict[str, Any] = {}
+    collection_sent = False
+
+    for key in reader.iter_object():
+        if key != "posts":
+            collection[key] = reader.decode()
+            continue
+
+        if collection_sent is False:
+            yield "collection", collection
+            collection_sent = True
+
+        for _ in reader.iter_array():
+            post = reader.decode()
+            post.setdefault("collection", {"alias": collection.get("alias")})
+            yield "post", post
+
+    if collection_sent is False:
+        yield "collection", collection
+
+
+def iter_csv_export(file_obj: IO[bytes]) -> Iterator[ExportItem]:
+    """
+    Yields the posts of a CSV export, which has the id, slug, blog (the
+    collection's alias), url, created, title and body of each post.
+    """
+    # Post bodies can be longer than the csv module's default field limit.
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+    text_file = io.TextIOWrapper(file_obj, encoding="utf-8", newline="")
+    for record in csv.DictReader(text_file):
+        post: Dict[str, Any] = {
+            "id": record["id"],
+            "slug": record.get("slug") or None,
+            "created": record.get("created"),
+            "updated": record.get("created"),
+            "title": record.get("title") or None,
+            "body": record.get("body"),
+        }
+        if record.get("blog"):
+            post["collection"] = {"alias": record["blog"]}
+        yield "partial_post", post
+
+
+def parse_post_file(
+    name: str, text: str, modified: Tuple[int, int, int, int, int, int]
+) -> Dict[str, Any]:
+    """
+    Returns the post in a file of a ZIP export. The file is named
+    [collection/][slug_]id.txt, and starts with a "# " line if the post has
+    a title.
+    """
+    path = PurePosixPath(name)
+    slug, _, post_id = path.stem.rpartition("_")
+    created = datetime.datetime(*modified).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    title = None
+    body = text
+    if text.startswith("# "):
+        first_line, _, body = text.partition("\n")
+        title = first_line[2:].strip()
+        body = body.lstrip("\n")
+
+    post: Dict[str, Any] = {
+        "id": post_id,
+        "slug": slug or None,
+        "created": created,
+        "updated": created,
+        "title": title,
+        "body": body,
+    }
+    if len(path.parts) > 1:
+        post["collection"] = {"alias": path.parts[0]}
+    return post
+
+
+def iter_zip_export(path: Path) -> Iterator[ExportItem]:
+    """
+    Yields the posts of a ZIP export, a text file per post. A JSON or CSV
+    export inside the archive is read as well, without extracting it.
+    """
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+
+            suffix = PurePosixPath(info.filename).suffix.lower()
+            with archive.open(info) as file_obj:
+                if suffix == ".json":
+                    yield from iter_json_export(file_obj)
+                elif suffix == ".csv":
+                    yield from iter_csv_export(file_obj)
+                elif suffix in POST_FILE_SUFFIXES:
+                    yield "partial_post", parse_post_file(
+                        info.filename,
+                        file_obj.read().decode("utf-8"),
+                        info.date_time,
+                    )
+
+
+def iter_export(
+    path: Path, export_format: Optional[str] = None
+) -> Iterator[ExportItem]:
+    """
+    Yields the user, collections and posts in a WriteFreely export file, as
+    ("user", user), ("collection", collection) and ("post", post) pairs.
+    Only JSON exports have the user and collections. Posts come after the
+    user and the collection they belong to. CSV and ZIP exports' posts are
+    ("partial_post", post) pairs, as they don't have the posts' metadata.
+    """
+    export_format = export_format or detect_format(path)
+
+    if export_format == "zip":
+        yield from iter_zip_export(path)
+        return
+
+    with Path(path).open("rb") as file_obj:
+        if export_format == "json":
+            yield from iter_json_export(file_obj)
+        elif export_format == "csv":
+            yield from iter_csv_export(file_obj)
+        else:
+            raise ValueError(f"Unknown export format: {export_format}")
@@ -0,0 +1,128 @@
+import cProfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from .client import WriteFreelyClient
+
+T = TypeVar("T")
+
+# The counters kept for each stage.
+STAGE_COUNTERS = ("seconds", "calls", "rows_written", "rows_skipped")
+
+
+class SyncMetrics:
+    """
+    Keeps track of where a sync spends its time: the wall time of each
+    stage, the rows each stage wrote and skipped, and the bytes the clients
+    downloaded. It's thread-safe, so fetchers running in other threads can
+    add to it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.clients: List[WriteFreelyClient] = []
+        self.bytes_baseline = 0
+
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+
+    def add(
+        self,
+        name: str,
+        seconds: float = 0.0,
+        calls: int = 0,
+        rows_written: int = 0,
+        rows_skipped: int = 0,
+    ):
+        """
+        Add to a stage's counters.
+        """
+        with self.lock:
+            stage = self.stages.setdefault(
+                name, dict.fromkeys(STAGE_COUNTERS, 0)
+            )
+            stage["seconds"] += seconds
+            stage["calls"] += calls
+            stage["rows_written"] += rows_written
+            stage["rows_skipped"] += rows_skipped
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time the block as a call to the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, seconds=time.perf_counter() - start, calls=1)
+
+    def timed_iter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Yields the items of iterable, timing how long each one takes to
+        produce as the stage, for streams that are read as they're
+        downloaded.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, seconds=time.perf_counter() - start)
+                return
+            self.add(name, seconds=time.perf_counter() - start, calls=1)
+            yield item
+
+    def watch(self, client: WriteFreelyClient):
+        """
+        Count the bytes the client downloads from now on.
+        """
+        with self.lock:
+            self.clients.append(client)
+            self.bytes_baseline += client.bytes_received
+
+    @property
+    def bytes_downloaded(self) -> int:
+        with self.lock:
+            received = sum(client.bytes_received for client in self.clients)
+            return received - self.bytes_baseline
+
+    @property
+    def rows_written(self) -> int:
+        return sum(stage["rows_written"] for stage in self.stages.values())
+
+    @property
+    def rows_skipped(self) -> int:
+        return sum(stage["rows_skipped"] for stage in self.stages.values())
+
+    def finish(self) -> float:
+        """
+        Stop the clock, returns the wall time of the whole sync.
+        """
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+        return self.seconds
+
+
+@contextmanager
+def cprofile(path: Optional[Path]) -> Iterator[Optional[cProfile.Profile]]:
+    """
+    Run the block under cProfile and dump the stats to path, which can be
+    read with pstats or snakeviz. Does nothing if path is None.
+    """
+    if path is None:
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(path))
@@ -0,0 +1,100 @@
+import difflib
+import json
+import re
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+# Every this many revisions of a post the body is stored in full, so any
+# revision can be rebuilt by applying at most this many deltas.
+SNAPSHOT_INTERVAL = 10
+
+ZLIB_LEVEL = 6
+
+# Words with the whitespace before them, which changed lines are compared
+# by so a small edit to a long paragraph makes a small delta.
+WORD_RE = re.compile(r"\s*\S+|\s+")
+
+# An edit of the source, replacing source[start:end] with text.
+Edit = Tuple[int, int, str]
+
+
+def iter_edits(
+    source: List[str], target: List[str], offset: int = 0
+) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Yields the (start, end) character ranges of the source tokens and the
+    (start, end) indexes of the target tokens that replace them.
+    """
+    positions = [offset]
+    for token in source:
+        positions.append(positions[-1] + len(token))
+
+    matcher = difflib.SequenceMatcher(None, source, target)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            yield positions[i1], positions[i2], j1, j2
+
+
+def diff(source: str, target: str) -> List[Edit]:
+    """
+    Returns the edits that turn source into target. Lines are compared
+    first, then the words of the lines that changed.
+    """
+    source_lines = source.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+
+    edits: List[Edit] = []
+    for start, end, j1, j2 in iter_edits(source_lines, target_lines):
+        source_words = WORD_RE.findall(source[start:end])
+        target_words = WORD_RE.findall("".join(target_lines[j1:j2]))
+        for word_start, word_end, k1, k2 in iter_edits(
+            source_words, target_words, offset=start
+        ):
+            edits.append((word_start, word_end, "".join(target_words[k1:k2])))
+    return edits
+
+
+def patch(source: str, edits: List[Edit]) -> str:
+    """
+    Apply the edits from diff to source.
+    """
+    parts = []
+    position = 0
+    for start, end, text in edits:
+        parts.append(source[position:start])
+        parts.append(text)
+        position = end
+    parts.append(source[position:])
+    return "".join(parts)
+
+
+def make_delta(source: Optional[str], target: Optional[str]) -> bytes:
+    """
+    Returns a compressed delta that turns the source body into the target.
+    """
+    edits = diff(source or "", target or "")
+    data = json.dumps(edits, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(data.encode("utf-8"), ZLIB_LEVEL)
+
+
+def apply_delta(source: Optional[str], delta: bytes) -> str:
+    """
+    Apply a delta from make_delta to the source body.
+    """
+    edits = json.loads(zlib.decompress(delta).decode("utf-8"))
+    return patch(source or "", edits)
+
+
+def make_snapshot(body: Optional[str]) -> bytes:
+    return zlib.compress((body or "").encode("utf-8"), ZLIB_LEVEL)
+
+
+def read_snapshot(snapshot: bytes) -> str:
+    return zlib.decompress(snapshot).decode("utf-8")
+
+
+def is_snapshot(revision: int) -> bool:
+    """
+    Returns whether a revision is stored as a snapshot rather than a delta.
+    """
+    return revision % SNAPSHOT_INTERVAL == 0
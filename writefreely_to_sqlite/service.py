@@ -1,19 +1,126 @@
 import datetime
+import hashlib
 import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 from sqlite_utils import Database
 from sqlite_utils.db import Table
 
-from .client import WriteFreelyClient
+from .cache import DEFAULT_MAX_BYTES, ResponseCache
+from .client import WriteFreelyClient, is_not_modified, iter_response_data
+from .compression import compress_body, get_codecs, register_functions
+from .derived import DERIVED_COLUMNS, derive_posts, get_version
+from .export import iter_export
+from .metrics import SyncMetrics
+from .revisions import (
+    SNAPSHOT_INTERVAL,
+    apply_delta,
+    is_snapshot,
+    make_delta,
+    make_snapshot,
+    read_snapshot,
+)
+from .utils import chunks
+
+# The write profiles, the pragmas the database is opened with, in the order
+# they're set (page_size only applies to new databases, and has to be set
+# before switching to WAL).
+WRITE_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Every commit is synced to disk, nothing committed is ever lost.
+    "safe": {
+        "page_size": 4096,
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -16 * 1024,
+        "temp_store": "default",
+        "mmap_size": 0,
+    },
+    # The database can't be corrupted, but the last commits can be lost if
+    # the machine (not just the process) crashes.
+    "default": {
+        "page_size": 8192,
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64 * 1024,
+        "temp_store": "memory",
+        "mmap_size": 256 * 1024 * 1024,
+    },
+    # For the first import of an archive. Nothing is synced to disk and the
+    # rollback journal is only kept in memory, so a crash part way through
+    # can corrupt the database, which then has to be imported again.
+    "fast": {
+        "page_size": 8192,
+        "journal_mode": "memory",
+        "synchronous": "off",
+        "cache_size": -256 * 1024,
+        "temp_store": "memory",
+        "mmap_size": 1024 * 1024 * 1024,
+    },
+}
+
+
+def open_database(db_file_path: Path, profile: str = "default") -> Database:
+    """
+    Open the WriteFreely SQLite database with one of the WRITE_PROFILES.
+    """
+    db = Database(db_file_path)
+    apply_write_profile(db, profile)
+    return db
+
+
+def apply_write_profile(db: Database, profile: str):
+    """
+    Set the pragmas of one of the WRITE_PROFILES on the database.
+    """
+    for pragma, value in WRITE_PROFILES[profile].items():
+        db.execute(f"PRAGMA {pragma} = {value}")
+
+
+def describe_write_profile(db: Database) -> str:
+    """
+    Returns the database's journal mode and synchronous level, as set by
+    its write profile.
+    """
+    (journal_mode,) = db.execute("PRAGMA journal_mode").fetchone()
+    (synchronous,) = db.execute("PRAGMA synchronous").fetchone()
+    synchronous_names = {0: "off", 1: "normal", 2: "full", 3: "extra"}
+    return (
+        f"journal_mode={journal_mode}, "
+        f"synchronous={synchronous_names.get(synchronous, synchronous)}"
+    )
 
 
-def open_database(db_file_path: Path) -> Database:
+def checkpoint(db: Database):
     """
-    Open the WriteFreely SQLite database.
+    Copy everything in the write-ahead log into the database file and
+    truncate the log, so the file can be copied on its own. Called once at
+    the end of a sync.
     """
-    return Database(db_file_path)
+    (journal_mode,) = db.execute("PRAGMA journal_mode").fetchone()
+    if journal_mode == "wal":
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
 
 def get_table(table_name: str, *, db: Database) -> Table:
@@ -23,9 +130,9 @@ def get_table(table_name: str, *, db: Database) -> Table:
     return Table(db=db, name=table_name)
 
 
-def build_database(db: Database):
+def migrate_initial_schema(db: Database):
     """
-    Build the WriteFreely SQLite database structure.
+    Create the users, collections, posts and views tables.
     """
     users_table = get_table("users", db=db)
 
@@ -148,10 +255,686 @@ def build_database(db: Database):
         post_views_table.create_index(["post_id"])
 
 
-def get_client(auth_file_path: str) -> WriteFreelyClient:
+def migrate_post_fingerprints(db: Database):
+    """
+    Create the table of post fingerprints used by incremental syncs.
+    """
+    post_fingerprints_table = get_table("post_fingerprints", db=db)
+
+    if post_fingerprints_table.exists() is False:
+        post_fingerprints_table.create(
+            columns={
+                "post_id": str,
+                "fingerprint": str,
+            },
+            pk="post_id",
+            foreign_keys=(("post_id", "posts", "id"),),
+        )
+
+
+def hash_post_body(body: Optional[str]) -> str:
+    """
+    Returns a hash of a post's body, used to tell if the body has changed
+    without comparing the bodies themselves.
+    """
+    return hashlib.sha256((body or "").encode("utf-8")).hexdigest()
+
+
+def migrate_post_body_hash(db: Database):
+    """
+    Add the posts body_hash column, and only update a post's full-text
+    search index when its title or body change.
+    """
+    row = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+        ["posts_au"],
+    ).fetchone()
+    if row is not None and "AFTER UPDATE ON [posts]" in row[0]:
+        db.execute("DROP TRIGGER [posts_au]")
+        db.execute(
+            row[0].replace(
+                "AFTER UPDATE ON [posts]",
+                "AFTER UPDATE OF [title], [body] ON [posts]",
+            )
+        )
+
+    posts_table = get_table("posts", db=db)
+
+    if "body_hash" not in posts_table.columns_dict:
+        posts_table.add_column("body_hash", str)
+        db.register_function(hash_post_body, deterministic=True, replace=True)
+        db.execute("UPDATE posts SET body_hash = hash_post_body(body)")
+
+
+def migrate_settings(db: Database):
+    """
+    Create the settings table, for options saved with the database.
+    """
+    settings_table = get_table("settings", db=db)
+
+    if settings_table.exists() is False:
+        settings_table.create(
+            columns={
+                "key": str,
+                "value": str,
+            },
+            pk="key",
+        )
+
+
+# The views tables, with the column their views are keyed by and the table
+# that column refers to.
+VIEWS_TABLES: Tuple[Tuple[str, str, str, str], ...] = (
+    ("post_views", "post_id", "posts", "id"),
+    ("collection_views", "collection_alias", "collections", "alias"),
+)
+
+
+def migrate_latest_views(db: Database):
+    """
+    Create the post_views_latest and collection_views_latest tables, with
+    the latest snapshot of each post's and collection's views, and drop the
+    created_at defaults from the views tables, which were stuck at the time
+    the tables were created.
+    """
+    for table_name, key_column, other_table, other_column in VIEWS_TABLES:
+        views_table = get_table(table_name, db=db)
+
+        if views_table.default_values.get("created_at") is not None:
+            views_table.transform(defaults={"created_at": None})
+
+        latest_table = get_table(f"{table_name}_latest", db=db)
+
+        if latest_table.exists() is False:
+            latest_table.create(
+                columns={
+                    key_column: str,
+                    "views": int,
+                    "created_at": str,
+                },
+                pk=key_column,
+                foreign_keys=((key_column, other_table, other_column),),
+            )
+            db.execute(
+                f"INSERT INTO [{latest_table.name}] "
+                f"([{key_column}], [views], [created_at]) "
+                f"SELECT [{key_column}], [views], [created_at] "
+                f"FROM [{table_name}] WHERE [id] IN ("
+                f"SELECT max([id]) FROM [{table_name}] "
+                f"GROUP BY [{key_column}])"
+            )
+
+
+# The periods the views are rolled up by, with the SQL expression for the
+# date a period starts on. Weeks start on Monday.
+ROLLUP_PERIODS: Dict[str, str] = {
+    "daily": "date({})",
+    "weekly": "date({}, 'weekday 0', '-6 days')",
+}
+
+# The number of posts ranked in each collection's top posts.
+TOP_POSTS_COUNT = 10
+
+
+def migrate_rollups(db: Database):
+    """
+    Create the views rollup tables, the views gained by each post and
+    collection per day and per week, each collection's lifetime totals and
+    its top posts. They're filled by migrate_rebuild_rollups.
+    """
+    for table_name, key_column, other_table, other_column in VIEWS_TABLES:
+        for period in ROLLUP_PERIODS:
+            rollup_table = get_table(f"{table_name}_{period}", db=db)
+
+            if rollup_table.exists() is False:
+                rollup_table.create(
+                    columns={
+                        key_column: str,
+                        "date": str,
+                        "views": int,
+                    },
+                    pk=(key_column, "date"),
+                    foreign_keys=((key_column, other_table, other_column),),
+                )
+                rollup_table.create_index(["date"])
+
+    collection_totals_table = get_table("collection_totals", db=db)
+
+    if collection_totals_table.exists() is False:
+        collection_totals_table.create(
+            columns={
+                "collection_alias": str,
+                "views": int,
+                "post_views": int,
+            },
+            pk="collection_alias",
+            foreign_keys=(("collection_alias", "collections", "alias"),),
+        )
+
+    collection_top_posts_table = get_table("collection_top_posts", db=db)
+
+    if collection_top_posts_table.exists() is False:
+        collection_top_posts_table.create(
+            columns={
+                "collection_alias": str,
+                "rank": int,
+                "post_id": str,
+                "views": int,
+            },
+            pk=("collection_alias", "rank"),
+            foreign_keys=(
+                ("collection_alias", "collections", "alias"),
+                ("post_id", "posts", "id"),
+            ),
+        )
+
+
+def migrate_sync_runs(db: Database):
+    """
+    Create the sync_runs table, with a record of each run's timings.
+    """
+    sync_runs_table = get_table("sync_runs", db=db)
+
+    if sync_runs_table.exists() is False:
+        sync_runs_table.create(
+            columns={
+                "id": int,
+                "command": str,
+                "started_at": str,
+                "finished_at": str,
+                "seconds": float,
+                "bytes_downloaded": int,
+                "rows_written": int,
+                "rows_skipped": int,
+                "stages": str,
+                "error": str,
+            },
+            pk="id",
+        )
+        sync_runs_table.create_index(["started_at"])
+
+
+def migrate_tags(db: Database):
+    """
+    Create the tags and post_tags tables, the posts' tags normalized so
+    posts can be looked up by tag with an index, and fill them from the
+    posts saved so far.
+    """
+    tags_table = get_table("tags", db=db)
+
+    if tags_table.exists() is False:
+        tags_table.create(
+            columns={
+                "id": int,
+                "name": str,
+            },
+            pk="id",
+            not_null={"name"},
+        )
+        tags_table.create_index(["name"], unique=True)
+
+    post_tags_table = get_table("post_tags", db=db)
+
+    if post_tags_table.exists() is False:
+        post_tags_table.create(
+            columns={
+                "post_id": str,
+                "tag_id": int,
+            },
+            pk=("post_id", "tag_id"),
+            foreign_keys=(
+                ("post_id", "posts", "id"),
+                ("tag_id", "tags", "id"),
+            ),
+        )
+        post_tags_table.create_index(["tag_id", "post_id"])
+
+    write_post_tags(db, "SELECT id FROM posts", [])
+
+
+def migrate_post_derived(db: Database):
+    """
+    Create the post_derived table, with the columns derived from each
+    post's body.
+    """
+    post_derived_table = get_table("post_derived", db=db)
+
+    if post_derived_table.exists() is False:
+        post_derived_table.create(
+            columns={
+                "post_id": str,
+                "body_hash": str,
+                "version": str,
+                "word_count": int,
+                "reading_time": int,
+                "html": str,
+                "excerpt": str,
+                "links": str,
+            },
+            pk="post_id",
+            foreign_keys=(("post_id", "posts", "id"),),
+        )
+
+
+# The tables whose rows are marked as deleted when they're no longer on the
+# server, with their key column.
+DELETABLE_TABLES: Dict[str, str] = {
+    "posts": "id",
+    "collections": "alias",
+}
+
+
+def migrate_deletions(db: Database):
+    """
+    Add the deleted and deleted_at columns to the posts and collections
+    tables, to mark the rows that have been deleted on the server.
+    """
+    for table_name in DELETABLE_TABLES:
+        table = get_table(table_name, db=db)
+
+        if "deleted" not in table.columns_dict:
+            table.add_column("deleted", int, not_null_default=0)
+        if "deleted_at" not in table.columns_dict:
+            table.add_column("deleted_at", str)
+
+        indexes = {tuple(i.columns) for i in table.indexes}
+        if ("user_username", "deleted") not in indexes:
+            table.create_index(["user_username", "deleted"])
+
+
+def migrate_post_revisions(db: Database):
+    """
+    Create the post_revisions table, with the earlier versions of each
+    post's body.
+    """
+    post_revisions_table = get_table("post_revisions", db=db)
+
+    if post_revisions_table.exists() is False:
+        post_revisions_table.create(
+            columns={
+                "post_id": str,
+                "revision": int,
+                "body_hash": str,
+                "updated": str,
+                "created_at": str,
+                "snapshot": int,
+                "data": bytes,
+            },
+            pk=("post_id", "revision"),
+            foreign_keys=(("post_id", "posts", "id"),),
+        )
+
+
+def migrate_rebuild_rollups(db: Database):
+    """
+    Fill the rollup tables from the views saved so far. The collections'
+    rollups leave out deleted posts, so this comes after the deleted
+    column is added, and rebuilds rollups that were filled with them.
+    """
+    rebuild_rollups(db)
+
+
+# The schema migrations, in the order they are applied. The database's
+# PRAGMA user_version records how many of them have been applied. The
+# migrations check for existing tables and indexes, so databases created
+# before the schema was versioned are brought up to date safely.
+MIGRATIONS: List[Callable[[Database], None]] = [
+    migrate_initial_schema,
+    migrate_post_fingerprints,
+    migrate_post_body_hash,
+    migrate_settings,
+    migrate_latest_views,
+    migrate_rollups,
+    migrate_sync_runs,
+    migrate_tags,
+    migrate_post_derived,
+    migrate_deletions,
+    migrate_post_revisions,
+    migrate_rebuild_rollups,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# The databases that have been built by this process.
+BUILT_DATABASES: "weakref.WeakSet[Database]" = weakref.WeakSet()
+
+
+def get_schema_version(db: Database) -> int:
+    """
+    Returns the schema version of the database.
+    """
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def build_database(db: Database):
+    """
+    Build the WriteFreely SQLite database structure, applying any migrations
+    the database is missing. This only does any work the first time it's
+    called for a database.
+    """
+    if db in BUILT_DATABASES:
+        return
+
+    version = get_schema_version(db)
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(db)
+        db.execute(f"PRAGMA user_version = {number}")
+
+    if version < SCHEMA_VERSION and POSTS_TEXT_VIEW in db.view_names():
+        create_posts_text_view(db)
+
+    # Needed to read and index compressed post bodies.
+    register_functions(db.conn)
+
+    BUILT_DATABASES.add(db)
+
+
+def get_setting(db: Database, key: str) -> Optional[str]:
+    """
+    Returns the value of a setting saved with the database.
+    """
+    build_database(db)
+
+    row = db.execute(
+        "SELECT value FROM settings WHERE key = ?", [key]
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_setting(db: Database, key: str, value: str):
+    """
+    Save a setting with the database. This doesn't commit.
+    """
+    build_database(db)
+    upsert_rows(db, "settings", ("key", "value"), [(key, value)], pk=("key",))
+
+
+@lru_cache(maxsize=None)
+def get_upsert_sql(
+    table_name: str, columns: Tuple[str, ...], pk: Tuple[str, ...]
+) -> str:
+    """
+    Returns the INSERT ... ON CONFLICT DO UPDATE statement for upsert_rows,
+    built once per table and set of columns.
+    """
+    column_list = ", ".join(f"[{column}]" for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    conflict_list = ", ".join(f"[{column}]" for column in pk)
+    updates = ", ".join(
+        f"[{column}] = excluded.[{column}]"
+        for column in columns
+        if column not in pk
+    )
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+    return (
+        f"INSERT INTO [{table_name}] ({column_list}) "
+        f"VALUES ({placeholders}) "
+        f"ON CONFLICT ({conflict_list}) {action}"
+    )
+
+
+def upsert_rows(
+    db: Database,
+    table_name: str,
+    columns: Tuple[str, ...],
+    rows: Iterable[Tuple[Any, ...]],
+    pk: Tuple[str, ...],
+):
+    """
+    Insert or update rows of values in the order of columns. This doesn't
+    commit, so callers can group several writes into one transaction.
+
+    Unlike sqlite_utils' upsert_all, the columns are fixed by the schema, so
+    the rows aren't inspected and the statement is only built once.
+    """
+    db.conn.executemany(get_upsert_sql(table_name, columns, pk), rows)
+
+
+@lru_cache(maxsize=None)
+def get_insert_sql(table_name: str, columns: Tuple[str, ...]) -> str:
+    """
+    Returns the INSERT statement for insert_rows, built once per table and
+    set of columns.
+    """
+    column_list = ", ".join(f"[{column}]" for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+
+    return f"INSERT INTO [{table_name}] ({column_list}) VALUES ({placeholders})"
+
+
+def insert_rows(
+    db: Database,
+    table_name: str,
+    columns: Tuple[str, ...],
+    rows: Iterable[Tuple[Any, ...]],
+):
+    """
+    Insert rows of values in the order of columns. This doesn't commit, so
+    callers can group several writes into one transaction.
+    """
+    db.conn.executemany(get_insert_sql(table_name, columns), rows)
+
+
+def rebuild_fts(db: Database, table_name: str):
+    """
+    Rebuild a table's full-text search index from scratch. Compressed post
+    bodies are indexed decompressed.
+    """
+    if table_name == "posts" and get_setting(db, BODY_CODEC_SETTING):
+        db.execute(
+            "INSERT INTO [posts_fts] ([posts_fts]) VALUES ('delete-all')"
+        )
+        db.execute(
+            "INSERT INTO [posts_fts] (rowid, [title], [body]) "
+            f"SELECT rowid, [title], {post_body_sql()} FROM [posts]"
+        )
+    else:
+        get_table(table_name, db=db).rebuild_fts()
+
+
+# The tables with a full-text search index kept up to date by triggers.
+FTS_TABLES: Tuple[str, ...] = ("users", "collections", "posts")
+
+# A write is treated as a bulk load, and the table's full-text search
+# triggers are suspended, once it has changed at least this many rows or
+# this fraction of the rows already in the table, whichever is larger.
+# Below that, updating the index row by row is cheaper than rebuilding it.
+BULK_LOAD_MIN_ROWS = 1000
+BULK_LOAD_RATIO = 0.2
+
+# The bulk loads in progress, by database.
+FTS_BULK_LOADS: "weakref.WeakKeyDictionary[Database, FTSBulkLoad]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class FTSBulkLoad:
+    """
+    Defers full-text search indexing while a large number of rows are
+    written to a database.
+
+    Each table starts out indexing rows with its triggers. Once the rows
+    written to a table cross the bulk load threshold, its triggers are
+    dropped. When the load finishes the table's index is rebuilt and
+    optimized once, and the triggers are put back. Small incremental runs
+    never cross the threshold, so they keep the trigger-based updates.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        min_rows: int = BULK_LOAD_MIN_ROWS,
+        ratio: float = BULK_LOAD_RATIO,
+        metrics: Optional[SyncMetrics] = None,
+    ):
+        self.db = db
+        self.min_rows = min_rows
+        self.ratio = ratio
+        self.metrics = metrics
+
+        self.written: Dict[str, int] = {}
+        self.thresholds: Dict[str, int] = {}
+        # The SQL of the suspended triggers, by table.
+        self.suspended: Dict[str, List[str]] = {}
+
+    def start(self):
+        FTS_BULK_LOADS[self.db] = self
+
+    def threshold(self, table_name: str) -> int:
+        """
+        Returns the number of rows that make a write to the table a bulk
+        load, based on the number of rows in the table when it's first
+        written to.
+        """
+        if table_name not in self.thresholds:
+            # max(rowid) is an index lookup, unlike count(*).
+            (row_count,) = self.db.execute(
+                f"SELECT max(rowid) FROM [{table_name}]"
+            ).fetchone()
+            self.thresholds[table_name] = max(
+                self.min_rows, math.ceil((row_count or 0) * self.ratio)
+            )
+        return self.thresholds[table_name]
+
+    def will_write(self, table_name: str, row_count: int):
+        """
+        Called before row_count rows are written to a table, suspends the
+        table's triggers if the load has crossed the threshold.
+        """
+        if table_name not in FTS_TABLES or table_name in self.suspended:
+            return
+
+        self.written[table_name] = self.written.get(table_name, 0) + row_count
+        if self.written[table_name] >= self.threshold(table_name):
+            self.suspend(table_name)
+
+    def suspend(self, table_name: str):
+        """
+        Drop the table's full-text search triggers, remembering their SQL.
+        """
+        if self.db.conn.in_transaction is False:
+            # Drop the triggers in a transaction, so they come back if the
+            # load is rolled back.
+            self.db.conn.execute("BEGIN")
+
+        fts_table_name = f"{table_name}_fts"
+        triggers = [
+            (name, sql)
+            for name, sql in self.db.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'trigger' AND tbl_name = ?",
+                [table_name],
+            ).fetchall()
+            if fts_table_name in sql
+        ]
+
+        for name, _ in triggers:
+            self.db.execute(f"DROP TRIGGER [{name}]")
+
+        self.suspended[table_name] = [sql for _, sql in triggers]
+
+    def finish(self, rebuild: bool = True):
+        """
+        Rebuild and optimize the index of each suspended table and put its
+        triggers back. This doesn't commit.
+        """
+        start = time.perf_counter()
+        try:
+            for table_name, trigger_sqls in self.suspended.items():
+                if rebuild:
+                    rebuild_fts(self.db, table_name)
+                    get_table(table_name, db=self.db).optimize()
+                for sql in trigger_sqls:
+                    self.db.execute(sql)
+        finally:
+            if self.metrics is not None and self.suspended:
+                self.metrics.add(
+                    "fts_rebuild",
+                    seconds=time.perf_counter() - start,
+                    calls=1,
+                )
+            self.suspended = {}
+            if FTS_BULK_LOADS.get(self.db) is self:
+                del FTS_BULK_LOADS[self.db]
+
+
+@contextmanager
+def fts_bulk_load(db: Database, **kwargs) -> Iterator[FTSBulkLoad]:
+    """
+    Defer full-text search indexing of the rows written in the block if
+    there are enough of them, see FTSBulkLoad. Use it inside the block's
+    transaction, so the index is rebuilt before it's committed.
+    """
+    load = FTS_BULK_LOADS.get(db)
+    if load is not None:
+        # Already in a bulk load, which will rebuild the index.
+        yield load
+        return
+
+    load = FTSBulkLoad(db, **kwargs)
+    load.start()
+    try:
+        yield load
+    except BaseException:
+        load.finish(rebuild=False)
+        raise
+    load.finish()
+
+
+def will_write(db: Database, table_name: str, row_count: int):
+    """
+    Let the database's bulk load, if there is one, know that rows are about
+    to be written to a table.
+    """
+    load = FTS_BULK_LOADS.get(db)
+    if load is not None:
+        load.will_write(table_name, row_count)
+
+
+@lru_cache(maxsize=None)
+def get_update_sql(
+    table_name: str, columns: Tuple[str, ...], pk: Tuple[str, ...]
+) -> str:
+    """
+    Returns the UPDATE statement for update_rows, built once per table and
+    set of columns.
+    """
+    assignments = ", ".join(f"[{column}] = ?" for column in columns)
+    conditions = " AND ".join(f"[{column}] = ?" for column in pk)
+
+    return f"UPDATE [{table_name}] SET {assignments} WHERE {conditions}"
+
+
+def update_rows(
+    db: Database,
+    table_name: str,
+    columns: Tuple[str, ...],
+    rows: Iterable[Tuple[Any, ...]],
+    pk: Tuple[str, ...],
+):
+    """
+    Update only the given columns of existing rows. Each row is the values
+    in the order of columns, followed by the primary key values. This
+    doesn't commit.
+    """
+    db.conn.executemany(get_update_sql(table_name, columns, pk), rows)
+
+
+def get_client(
+    auth_file_path: str,
+    cache_dir: Optional[Path] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    **kwargs,
+) -> WriteFreelyClient:
     """
-    Returns a fully authenticated WriteFreelyClient.
+    Returns a fully authenticated WriteFreelyClient, with a response cache
+    if a cache directory is given.
     """
+    if cache_dir is not None:
+        kwargs["cache"] = ResponseCache(cache_dir, max_bytes=cache_max_bytes)
+
     with Path(auth_file_path).absolute().open() as file_obj:
         raw_auth = file_obj.read()
 
@@ -160,6 +943,7 @@ def get_client(auth_file_path: str) -> WriteFreelyClient:
     return WriteFreelyClient(
         domain=auth["writefreely_domain"],
         access_token=auth["writefreely_access_token"],
+        **kwargs,
     )
 
 
@@ -182,14 +966,31 @@ def transform_user(user: Dict[str, Any]):
         del user[key]
 
 
-def save_user(db: Database, user: Dict[str, Any]):
+USER_COLUMNS: Tuple[str, ...] = ("username", "email", "created")
+
+
+def project_user(user: Dict[str, Any]) -> Tuple[Any, ...]:
     """
-    Save WriteFreely user to the SQLite database.
+    Project a WriteFreely user into a users row.
+    """
+    return tuple(map(user.get, USER_COLUMNS))
+
+
+def write_user(db: Database, row: Tuple[Any, ...]):
+    """
+    Write a projected users row to the SQLite database. This doesn't commit.
     """
     build_database(db)
+    will_write(db, "users", 1)
+    upsert_rows(db, "users", USER_COLUMNS, [row], pk=("username",))
 
-    users_table = get_table("users", db=db)
-    users_table.upsert(user, pk="username")
+
+def save_user(db: Database, user: Dict[str, Any]):
+    """
+    Save WriteFreely user to the SQLite database.
+    """
+    with db.conn:
+        write_user(db, project_user(user))
 
 
 def get_posts(client: WriteFreelyClient) -> List[Dict[str, Any]]:
@@ -201,6 +1002,85 @@ def get_posts(client: WriteFreelyClient) -> List[Dict[str, Any]]:
     return response.json()["data"]
 
 
+def iter_posts(
+    client: WriteFreelyClient, skip_unchanged: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the posts for the authenticated user without loading the
+    whole response into memory.
+
+    If skip_unchanged is set, nothing is yielded when the client's response
+    cache says the posts haven't changed since the last request.
+    """
+    _, response = client.get_me_posts(stream=True)
+
+    if skip_unchanged and is_not_modified(response):
+        response.close()
+        return
+
+    yield from iter_response_data(response)
+
+
+def get_collection_posts_page(
+    client: WriteFreelyClient, alias: str, page: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get a single page of a collection's posts, returns the posts and the
+    total number of posts in the collection.
+    """
+    _, response = client.get_collection_posts(alias, page=page)
+    response.raise_for_status()
+    data = response.json()["data"]
+
+    posts = data.get("posts") or []
+    for post in posts:
+        # Posts fetched through a collection don't include the collection
+        # they belong to.
+        post.setdefault("collection", {"alias": alias})
+
+    return posts, data.get("total_posts", len(posts))
+
+
+def iter_collection_posts(
+    client: WriteFreelyClient, alias: str, workers: int = 4
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over all the posts in a collection, downloading the pages
+    concurrently with a bounded pool of workers. The posts are yielded in
+    page order.
+    """
+    posts, total_posts = get_collection_posts_page(client, alias, page=1)
+    yield from posts
+
+    if not posts:
+        return
+
+    page_count = math.ceil(total_posts / len(posts))
+    pages = iter(range(2, page_count + 1))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Future] = deque()
+
+        def submit_next() -> None:
+            page = next(pages, None)
+            if page is not None:
+                pending.append(
+                    executor.submit(
+                        get_collection_posts_page, client, alias, page
+                    )
+                )
+
+        # Keep a bounded window of pages in flight, so a slow consumer
+        # doesn't end up with the whole collection held in memory.
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            page_posts, _ = pending.popleft().result()
+            submit_next()
+            yield from page_posts
+
+
 def transform_post(post: Dict[str, Any], user_username: str):
     """
     Transformer a WriteFreely post, so it can be safely saved to the SQLite
@@ -232,51 +1112,850 @@ def transform_post(post: Dict[str, Any], user_username: str):
     post["user_username"] = user_username
 
 
-def save_posts(db: Database, posts: List[Dict[str, Any]], user_username):
+# The columns of the posts table, in the order project_post emits them.
+POST_FIELDS: Tuple[str, ...] = (
+    "id",
+    "slug",
+    "appearance",
+    "language",
+    "rtl",
+    "created",
+    "updated",
+    "title",
+    "body",
+)
+POST_COLUMNS: Tuple[str, ...] = POST_FIELDS + (
+    "tags",
+    "collection_alias",
+    "user_username",
+    "body_hash",
+)
+# The columns compared against the saved post to tell what has changed,
+# everything but the body, which is compared by its hash.
+POST_SUMMARY_COLUMNS: Tuple[str, ...] = tuple(
+    column for column in POST_COLUMNS if column != "body"
+)
+# The columns a narrow update writes when only a post's metadata has
+# changed. They aren't in the full-text search index.
+POST_METADATA_COLUMNS: Tuple[str, ...] = tuple(
+    column
+    for column in POST_SUMMARY_COLUMNS
+    if column not in ("id", "title", "body_hash")
+)
+POST_VIEW_COLUMNS: Tuple[str, ...] = ("post_id", "views")
+
+POST_ID_INDEX = POST_COLUMNS.index("id")
+POST_BODY_INDEX = POST_COLUMNS.index("body")
+POST_UPDATED_INDEX = POST_COLUMNS.index("updated")
+POST_COLLECTION_ALIAS_INDEX = POST_COLUMNS.index("collection_alias")
+POST_SUMMARY_INDEXES = tuple(map(POST_COLUMNS.index, POST_SUMMARY_COLUMNS))
+POST_METADATA_INDEXES = tuple(map(POST_COLUMNS.index, POST_METADATA_COLUMNS))
+POST_CONTENT_INDEXES = tuple(
+    map(POST_SUMMARY_COLUMNS.index, ("title", "body_hash"))
+)
+POST_SUMMARY_TAGS_INDEX = POST_SUMMARY_COLUMNS.index("tags")
+POST_SUMMARY_BODY_HASH_INDEX = POST_SUMMARY_COLUMNS.index("body_hash")
+POST_SUMMARY_UPDATED_INDEX = POST_SUMMARY_COLUMNS.index("updated")
+POST_BODY_HASH_INDEX = POST_COLUMNS.index("body_hash")
+# The columns written to saved posts from partial rows, see write_posts.
+POST_PARTIAL_CONTENT_COLUMNS: Tuple[str, ...] = (
+    "title",
+    "body",
+    "body_hash",
+    "body_compressed",
+)
+
+
+def project_post(
+    post: Dict[str, Any], user_username: str
+) -> Tuple[Tuple[Any, ...], Tuple[Any, ...]]:
     """
-    Save WriteFreely posts to the SQLite database.
+    Project a WriteFreely post into a posts row and a post_views row, in a
+    single pass and without modifying the post.
     """
-    build_database(db)
+    collection = post.get("collection") or {}
+    row = tuple(map(post.get, POST_FIELDS)) + (
+        json.dumps(post.get("tags") or []),
+        collection.get("alias"),
+        user_username,
+        hash_post_body(post.get("body")),
+    )
+    return row, (row[POST_ID_INDEX], post.get("views"))
 
-    posts_table = get_table("posts", db=db)
 
+def project_posts(
+    posts: Iterable[Dict[str, Any]], user_username: str
+) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+    """
+    Project WriteFreely posts into posts rows and post_views rows.
+    """
+    rows = []
+    view_rows = []
     for post in posts:
-        transform_post(post, user_username)
+        row, view_row = project_post(post, user_username)
+        rows.append(row)
+        view_rows.append(view_row)
+    return rows, view_rows
 
-    posts_table.upsert_all(records=posts, pk="id")
 
+def fingerprint_post(row: Tuple[Any, ...]) -> str:
+    """
+    Returns a fingerprint of a projected post's content, used to tell if a
+    post has changed since it was last saved.
+    """
+    content = json.dumps(row, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-def transform_post_view(post: Dict[str, Any]):
+
+def get_post_fingerprints(db: Database, post_ids: List[str]) -> Dict[str, str]:
     """
-    Transformer a WriteFreely post view, so it can be safely saved to the
-    SQLite database.
+    Returns the stored fingerprints for the given post IDs.
     """
-    post["post_id"] = post.pop("id")
+    fingerprints: Dict[str, str] = {}
+
+    # Stay well below SQLite's limit on the number of bound parameters.
+    for batch in chunks(post_ids, 500):
+        placeholders = ", ".join("?" for _ in batch)
+        rows = db.execute(
+            "SELECT post_id, fingerprint FROM post_fingerprints "
+            f"WHERE post_id IN ({placeholders})",
+            batch,
+        ).fetchall()
+        fingerprints.update(rows)
+
+    return fingerprints
+
+
+def get_post_summaries(
+    db: Database, post_ids: List[str]
+) -> Dict[str, Tuple[Any, ...]]:
+    """
+    Returns the saved values of the POST_SUMMARY_COLUMNS for the given post
+    IDs, without reading the bodies.
+    """
+    column_list = ", ".join(f"[{column}]" for column in POST_SUMMARY_COLUMNS)
+    summaries: Dict[str, Tuple[Any, ...]] = {}
+
+    for batch in chunks(post_ids, 500):
+        placeholders = ", ".join("?" for _ in batch)
+        for summary in db.execute(
+            f"SELECT {column_list} FROM posts WHERE id IN ({placeholders})",
+            batch,
+        ):
+            summaries[summary[0]] = summary
+
+    return summaries
+
+
+def delete_post_fingerprints(db: Database, post_ids: List[str]):
+    """
+    Remove the saved fingerprints of the given post IDs, for posts that
+    have been written without them. This doesn't commit.
+    """
+    if post_ids:
+        db.execute(
+            "DELETE FROM post_fingerprints "
+            "WHERE post_id IN (SELECT value FROM json_each(?))",
+            [json.dumps(post_ids)],
+        )
+
+
+def write_post_tags(db: Database, post_ids_sql: str, params: List[Any]):
+    """
+    Bring the tags and post_tags tables up to date with the tags column of
+    the posts selected by post_ids_sql, a SELECT of post IDs. New tags and
+    links are inserted, and links to tags the posts no longer have are
+    deleted, each in a single statement. Tags left without any posts are
+    deleted too. This doesn't commit.
+    """
+    post_tags_sql = (
+        "FROM posts AS p, json_each(p.tags) AS j "
+        "JOIN tags AS t ON t.name = j.value "
+        f"WHERE p.id IN ({post_ids_sql})"
+    )
+
+    db.execute(
+        "INSERT OR IGNORE INTO tags (name) "
+        "SELECT DISTINCT j.value FROM posts AS p, json_each(p.tags) AS j "
+        f"WHERE p.id IN ({post_ids_sql}) AND j.type = 'text'",
+        params,
+    )
+    db.execute(
+        f"DELETE FROM post_tags WHERE post_id IN ({post_ids_sql}) "
+        "AND (post_id, tag_id) NOT IN "
+        f"(SELECT p.id, t.id {post_tags_sql})",
+        params + params,
+    )
+    db.execute(
+        "INSERT OR IGNORE INTO post_tags (post_id, tag_id) "
+        f"SELECT p.id, t.id {post_tags_sql}",
+        params,
+    )
+    db.execute(
+        "DELETE FROM tags WHERE NOT EXISTS "
+        "(SELECT 1 FROM post_tags WHERE tag_id = tags.id)"
+    )
+
+
+POST_REVISION_COLUMNS: Tuple[str, ...] = (
+    "post_id",
+    "revision",
+    "body_hash",
+    "updated",
+    "created_at",
+    "snapshot",
+    "data",
+)
+
+
+def get_post_bodies(db: Database, post_ids: List[str]) -> Dict[str, str]:
+    """
+    Returns the saved bodies of the given post IDs, whether or not they're
+    stored compressed.
+    """
+    body_sql = (
+        post_body_sql() if get_setting(db, BODY_CODEC_SETTING) else "body"
+    )
+    bodies: Dict[str, str] = {}
+
+    for batch in chunks(post_ids, 500):
+        placeholders = ", ".join("?" for _ in batch)
+        bodies.update(
+            db.execute(
+                f"SELECT id, {body_sql} FROM posts "
+                f"WHERE id IN ({placeholders})",
+                batch,
+            ).fetchall()
+        )
+
+    return bodies
+
+
+def write_post_revisions(
+    db: Database,
+    changes: List[Tuple[str, Optional[str], str, str, Optional[str]]],
+):
+    """
+    Save the bodies posts are about to be changed from, as (post_id, old
+    body, old body hash, old updated, new body) tuples, in the
+    post_revisions table. This doesn't commit.
+
+    The old body becomes the post's next revision. It's stored as a delta
+    that turns the new body back into it, so the revisions only take up as
+    much space as the edits. Every SNAPSHOT_INTERVAL revisions the body is
+    stored in full instead, see get_post_revision.
+    """
+    latest: Dict[str, int] = {}
+    for batch in chunks([change[0] for change in changes], 500):
+        placeholders = ", ".join("?" for _ in batch)
+        latest.update(
+            db.execute(
+                "SELECT post_id, max(revision) FROM post_revisions "
+                f"WHERE post_id IN ({placeholders}) GROUP BY post_id",
+                batch,
+            ).fetchall()
+        )
+
+    created_at = utc_timestamp()
+    rows = []
+    for post_id, old_body, body_hash, updated, new_body in changes:
+        revision = latest.get(post_id, 0) + 1
+        latest[post_id] = revision
+        snapshot = is_snapshot(revision)
+        rows.append(
+            (
+                post_id,
+                revision,
+                body_hash,
+                updated,
+                created_at,
+                int(snapshot),
+                (
+                    make_snapshot(old_body)
+                    if snapshot
+                    else make_delta(new_body, old_body)
+                ),
+            )
+        )
+
+    insert_rows(db, "post_revisions", POST_REVISION_COLUMNS, rows)
+
+
+def get_post_revision(
+    db: Database, post_id: str, revision: int
+) -> Optional[str]:
+    """
+    Returns a post's body as it was at a revision, or None if the post or
+    revision doesn't exist. Revisions are numbered from 1, and the number
+    after the latest one is the post's current body.
+
+    The body is rebuilt from the first snapshot at or after the revision,
+    or from the current body if there isn't one, by applying the deltas back
+    to the revision. That's never more than SNAPSHOT_INTERVAL deltas.
+    """
+    build_database(db)
+
+    if revision < 1:
+        return None
+
+    bodies = get_post_bodies(db, [post_id])
+    if post_id not in bodies:
+        return None
+
+    # A snapshot is always among the next SNAPSHOT_INTERVAL revisions,
+    # unless the latest revision comes first.
+    rows = db.execute(
+        "SELECT revision, snapshot, data FROM post_revisions "
+        "WHERE post_id = ? AND revision >= ? ORDER BY revision LIMIT ?",
+        [post_id, revision, SNAPSHOT_INTERVAL],
+    ).fetchall()
+
+    if not rows or rows[0][0] != revision:
+        (latest,) = db.execute(
+            "SELECT coalesce(max(revision), 0) FROM post_revisions "
+            "WHERE post_id = ?",
+            [post_id],
+        ).fetchone()
+        return bodies[post_id] if revision == latest + 1 else None
+
+    body = bodies[post_id]
+    for index, (_, snapshot, data) in enumerate(rows):
+        if snapshot:
+            body = read_snapshot(data)
+            rows = rows[:index]
+            break
+
+    for _, _, data in reversed(rows):
+        body = apply_delta(body, data)
+    return body
+
+
+def write_posts(
+    db: Database,
+    rows: List[Tuple[Any, ...]],
+    user_username: str,
+    incremental: bool = False,
+    partial: bool = False,
+) -> int:
+    """
+    Write projected posts rows to the SQLite database, returns the number of
+    posts written. This doesn't commit.
+
+    In incremental mode posts whose fingerprint matches the one saved by a
+    previous incremental run are skipped. Other runs don't fingerprint the
+    posts, they remove the fingerprints of the posts they change instead,
+    so the next incremental run compares those posts again.
+
+    Only new posts and posts whose title or body hash have changed are
+    written in full. When only a post's metadata (like updated, tags or
+    appearance) has changed just those columns are updated, leaving the
+    body and its full-text search index untouched, and unchanged posts
+    aren't written at all. The post_tags links are only rewritten for posts
+    whose tags have changed.
+
+    If a post is in rows more than once (its collection's pages can shift
+    while they're being fetched) only the last one is written.
+
+    Partial rows only have a post's slug, created, title, body and
+    collection, like the posts in CSV and ZIP exports. New posts are
+    written as they are, but for saved posts only a changed title or body
+    is written, never the metadata the rows don't have.
+    """
+    build_database(db)
+
+    rows = list({row[POST_ID_INDEX]: row for row in rows}.values())
+
+    fingerprints: Dict[str, str] = {}
+    if incremental:
+        fingerprints = {
+            row[POST_ID_INDEX]: fingerprint_post(row) for row in rows
+        }
+        saved_fingerprints = get_post_fingerprints(db, list(fingerprints))
+        rows = [
+            row
+            for row in rows
+            if saved_fingerprints.get(row[POST_ID_INDEX])
+            != fingerprints[row[POST_ID_INDEX]]
+        ]
+
+    if not rows:
+        return 0
+
+    summaries = get_post_summaries(db, [row[POST_ID_INDEX] for row in rows])
+    changed_rows = []
+    metadata_rows = []
+    tagged_post_ids = []
+    for row in rows:
+        saved = summaries.get(row[POST_ID_INDEX])
+        summary = tuple(row[index] for index in POST_SUMMARY_INDEXES)
+
+        if saved is None or (
+            not partial
+            and saved[POST_SUMMARY_TAGS_INDEX]
+            != summary[POST_SUMMARY_TAGS_INDEX]
+        ):
+            tagged_post_ids.append(row[POST_ID_INDEX])
+
+        if saved is None or any(
+            saved[index] != summary[index] for index in POST_CONTENT_INDEXES
+        ):
+            changed_rows.append(row)
+        elif saved != summary and not partial:
+            metadata_rows.append(
+                tuple(row[index] for index in POST_METADATA_INDEXES)
+                + (row[POST_ID_INDEX],)
+            )
+
+    revised_rows = [
+        row
+        for row in changed_rows
+        if row[POST_ID_INDEX] in summaries
+        and summaries[row[POST_ID_INDEX]][POST_SUMMARY_BODY_HASH_INDEX]
+        != row[POST_BODY_HASH_INDEX]
+    ]
+    if revised_rows:
+        old_bodies = get_post_bodies(
+            db, [row[POST_ID_INDEX] for row in revised_rows]
+        )
+        write_post_revisions(
+            db,
+            [
+                (
+                    row[POST_ID_INDEX],
+                    old_bodies[row[POST_ID_INDEX]],
+                    summaries[row[POST_ID_INDEX]][POST_SUMMARY_BODY_HASH_INDEX],
+                    summaries[row[POST_ID_INDEX]][POST_SUMMARY_UPDATED_INDEX],
+                    row[POST_BODY_INDEX],
+                )
+                for row in revised_rows
+            ],
+        )
+
+    will_write(db, "posts", len(changed_rows))
+
+    columns = POST_COLUMNS
+    full_rows = changed_rows
+    codec = get_setting(db, BODY_CODEC_SETTING)
+    if codec:
+        columns = POST_COLUMNS + ("body_compressed",)
+        full_rows = [compress_post_row(row, codec) for row in changed_rows]
+
+    content_rows: List[Tuple[Any, ...]] = []
+    if partial:
+        content_rows = [
+            row for row in full_rows if row[POST_ID_INDEX] in summaries
+        ]
+        full_rows = [
+            row for row in full_rows if row[POST_ID_INDEX] not in summaries
+        ]
+
+    upsert_rows(db, "posts", columns, full_rows, pk=("id",))
+    update_rows(db, "posts", POST_METADATA_COLUMNS, metadata_rows, pk=("id",))
+
+    content_columns = tuple(
+        column for column in columns if column in POST_PARTIAL_CONTENT_COLUMNS
+    )
+    content_indexes = tuple(map(columns.index, content_columns))
+    update_rows(
+        db,
+        "posts",
+        content_columns,
+        (
+            tuple(row[index] for index in content_indexes)
+            + (row[POST_ID_INDEX],)
+            for row in content_rows
+        ),
+        pk=("id",),
+    )
+
+    if incremental:
+        # The rows left are the ones whose fingerprints are new or changed.
+        upsert_rows(
+            db,
+            "post_fingerprints",
+            ("post_id", "fingerprint"),
+            (
+                (row[POST_ID_INDEX], fingerprints[row[POST_ID_INDEX]])
+                for row in rows
+            ),
+            pk=("post_id",),
+        )
+    else:
+        delete_post_fingerprints(
+            db,
+            [row[POST_ID_INDEX] for row in changed_rows]
+            + [row[-1] for row in metadata_rows],
+        )
+    if tagged_post_ids:
+        write_post_tags(
+            db, "SELECT value FROM json_each(?)", [json.dumps(tagged_post_ids)]
+        )
+
+    return len(changed_rows) + len(metadata_rows)
+
+
+# The setting with the codec post bodies are compressed with, if they're
+# stored compressed.
+BODY_CODEC_SETTING = "body_codec"
+
+# The view of the posts table with the bodies decompressed.
+POSTS_TEXT_VIEW = "posts_text"
+
+
+def post_body_sql(table_alias: str = "") -> str:
+    """
+    Returns an SQL expression for a post's plain text body, whether or not
+    it's stored compressed.
+    """
+    prefix = f"{table_alias}." if table_alias else ""
+    return (
+        f"coalesce({prefix}[body], decompress_body({prefix}[body_compressed]))"
+    )
+
+
+def compress_post_row(row: Tuple[Any, ...], codec: str) -> Tuple[Any, ...]:
+    """
+    Returns a projected posts row with the body moved, compressed, to the end
+    of the row for the body_compressed column.
+    """
+    body = row[POST_BODY_INDEX]
+    return (
+        row[:POST_BODY_INDEX]
+        + (None,)
+        + row[POST_BODY_INDEX + 1 :]
+        + (compress_body(body, codec),)
+    )
+
+
+def create_compressed_posts_fts_triggers(db: Database):
+    """
+    Replace the posts full-text search triggers with ones that index the
+    decompressed bodies.
+    """
+    for name in ("posts_ai", "posts_ad", "posts_au"):
+        db.execute(f"DROP TRIGGER IF EXISTS [{name}]")
+
+    insert = (
+        "INSERT INTO [posts_fts] (rowid, [title], [body]) "
+        f"VALUES (new.rowid, new.[title], {post_body_sql('new')});"
+    )
+    delete = (
+        "INSERT INTO [posts_fts] ([posts_fts], rowid, [title], [body]) "
+        f"VALUES ('delete', old.rowid, old.[title], {post_body_sql('old')});"
+    )
+
+    db.execute(
+        f"CREATE TRIGGER [posts_ai] AFTER INSERT ON [posts] BEGIN\n"
+        f"  {insert}\nEND"
+    )
+    db.execute(
+        f"CREATE TRIGGER [posts_ad] AFTER DELETE ON [posts] BEGIN\n"
+        f"  {delete}\nEND"
+    )
+    db.execute(
+        "CREATE TRIGGER [posts_au] "
+        "AFTER UPDATE OF [title], [body], [body_compressed] ON [posts] BEGIN\n"
+        f"  {delete}\n  {insert}\nEND"
+    )
+
+
+def create_posts_text_view(db: Database):
+    """
+    Create (or recreate) the posts_text view, with all of the posts table's
+    columns but with the plain text body in place of the compressed one.
+    SQLite fixes a view's columns when it's created, so build_database
+    recreates it after migrations that could change the posts table.
+    """
+    column_list = ", ".join(
+        post_body_sql() + " AS [body]" if column == "body" else f"[{column}]"
+        for column in get_table("posts", db=db).columns_dict
+        if column != "body_compressed"
+    )
+    db.execute(f"DROP VIEW IF EXISTS [{POSTS_TEXT_VIEW}]")
+    db.execute(
+        f"CREATE VIEW [{POSTS_TEXT_VIEW}] AS SELECT {column_list} FROM [posts]"
+    )
+
+
+def enable_body_compression(db: Database, codec: str = "zlib") -> int:
+    """
+    Store the posts' bodies compressed, in the body_compressed column, with
+    the zlib or zstd codec. Existing bodies are compressed and posts written
+    later are compressed as they're saved. The posts_text view, and the
+    decompress_body SQL function, give the plain text bodies, and the
+    full-text search index still indexes the plain text.
+
+    Running it again with a different codec recompresses the bodies. Returns
+    the number of bodies compressed.
+    """
+    if codec not in get_codecs():
+        raise ValueError(f"The {codec} codec isn't available.")
+
+    build_database(db)
+    previous_codec = get_setting(db, BODY_CODEC_SETTING)
+
+    with db.conn:
+        if db.conn.in_transaction is False:
+            # So the triggers come back if anything goes wrong.
+            db.conn.execute("BEGIN")
+
+        posts_table = get_table("posts", db=db)
+        if "body_compressed" not in posts_table.columns_dict:
+            posts_table.add_column("body_compressed", bytes)
+
+        # The text the index sees doesn't change, so there's no need for
+        # the update trigger to re-index every post.
+        db.execute("DROP TRIGGER IF EXISTS [posts_au]")
+
+        if previous_codec in (None, codec):
+            condition = "[body] IS NOT NULL"
+        else:
+            condition = "[body] IS NOT NULL OR [body_compressed] IS NOT NULL"
+
+        cursor = db.execute(
+            "UPDATE [posts] SET "
+            f"[body_compressed] = compress_body({post_body_sql()}, ?), "
+            f"[body] = NULL WHERE {condition}",
+            [codec],
+        )
+
+        create_compressed_posts_fts_triggers(db)
+        create_posts_text_view(db)
+
+        set_setting(db, BODY_CODEC_SETTING, codec)
+
+    return cursor.rowcount
+
+
+def save_posts(
+    db: Database,
+    posts: Iterable[Dict[str, Any]],
+    user_username,
+    incremental: bool = False,
+) -> int:
+    """
+    Save WriteFreely posts to the SQLite database, returns the number of
+    posts written.
+    """
+    rows, _ = project_posts(posts, user_username)
+    with db.conn, fts_bulk_load(db):
+        return write_posts(db, rows, user_username, incremental=incremental)
+
+
+# The number of posts sent to a worker process at a time.
+DERIVE_BATCH_SIZE = 100
+# Fewer posts than this are derived in this process, starting the worker
+# processes would take longer.
+DERIVE_PARALLEL_MIN_POSTS = 500
+
+
+def get_underived_post_ids(db: Database) -> List[str]:
+    """
+    Returns the IDs of the posts whose derived columns are missing, or were
+    computed from a different body or by a different version.
+    """
+    return [
+        row[0]
+        for row in db.execute(
+            "SELECT p.id FROM posts AS p "
+            "LEFT JOIN post_derived AS d ON d.post_id = p.id "
+            "AND d.body_hash IS p.body_hash AND d.version = ? "
+            "WHERE d.post_id IS NULL",
+            [get_version()],
+        )
+    ]
+
+
+def iter_underived_batches(
+    db: Database, post_ids: List[str]
+) -> Iterator[List[Tuple[str, Optional[str], Optional[str]]]]:
+    """
+    Yields batches of (post_id, body_hash, body) for the given post IDs.
+    """
+    body_sql = (
+        post_body_sql() if get_setting(db, BODY_CODEC_SETTING) else "[body]"
+    )
+    for batch in chunks(post_ids, DERIVE_BATCH_SIZE):
+        placeholders = ", ".join("?" for _ in batch)
+        yield db.execute(
+            f"SELECT [id], [body_hash], {body_sql} FROM posts "
+            f"WHERE [id] IN ({placeholders})",
+            batch,
+        ).fetchall()
+
+
+def iter_derived_rows(
+    batches: Iterable[List[Tuple[str, Optional[str], Optional[str]]]],
+    workers: int,
+) -> Iterator[List[Tuple[Any, ...]]]:
+    """
+    Yields the post_derived rows for each batch of posts, computed by a
+    pool of worker processes. Only a few batches are in flight at once, so
+    the bodies aren't all held in memory.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Future] = deque()
+        for batch in batches:
+            pending.append(executor.submit(derive_posts, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def update_post_derived(
+    db: Database,
+    workers: Optional[int] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> int:
+    """
+    Compute the word count, reading time, HTML, excerpt and links of the
+    posts whose bodies have changed since they were last computed, and save
+    them in the post_derived table. Returns the number of posts computed.
+
+    The Markdown rendering and text analysis are done by a pool of worker
+    processes, workers defaults to the number of CPUs. Small runs are done
+    in this process.
+    """
+    metrics = metrics or SyncMetrics()
+    build_database(db)
+    workers = workers or os.cpu_count() or 1
+
+    with metrics.stage("derive_posts"):
+        post_ids = get_underived_post_ids(db)
+        batches = iter_underived_batches(db, post_ids)
+
+        derived_batches: Iterable[List[Tuple[Any, ...]]]
+        if workers == 1 or len(post_ids) < DERIVE_PARALLEL_MIN_POSTS:
+            derived_batches = map(derive_posts, batches)
+        else:
+            derived_batches = iter_derived_rows(batches, workers)
+
+        with db.conn:
+            for rows in derived_batches:
+                upsert_rows(
+                    db, "post_derived", DERIVED_COLUMNS, rows, pk=("post_id",)
+                )
+
+    metrics.add("derive_posts", rows_written=len(post_ids))
+    return len(post_ids)
+
+
+def transform_post_view(post: Dict[str, Any]):
+    """
+    Transformer a WriteFreely post view, so it can be safely saved to the
+    SQLite database.
+    """
+    post["post_id"] = post.pop("id")
     to_remove = [k for k in post.keys() if k not in ("post_id", "views")]
     for key in to_remove:
         del post[key]
 
 
-def save_post_views(db: Database, post_views: List[Dict[str, Any]]):
+def utc_timestamp() -> str:
     """
-    Save WriteFreely post views to the SQLite database.
+    Returns the current UTC time, in the format the views tables use.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.replace(tzinfo=None).isoformat(sep=" ")
+
+
+def get_latest_views(
+    db: Database, table_name: str, key_column: str, keys: List[str]
+) -> Dict[str, Tuple[Optional[int], str]]:
+    """
+    Returns the latest views saved in a views table for the given keys, and
+    when they were fetched.
+    """
+    latest: Dict[str, Tuple[Optional[int], str]] = {}
+
+    for batch in chunks(keys, 500):
+        placeholders = ", ".join("?" for _ in batch)
+        for key, views, created_at in db.execute(
+            f"SELECT [{key_column}], [views], [created_at] "
+            f"FROM [{table_name}_latest] "
+            f"WHERE [{key_column}] IN ({placeholders})",
+            batch,
+        ):
+            latest[key] = (views, created_at)
+
+    return latest
+
+
+def write_views(
+    db: Database,
+    table_name: str,
+    key_column: str,
+    rows: List[Tuple[Any, ...]],
+    fetched_at: Optional[str] = None,
+) -> int:
+    """
+    Write projected views rows to a views table, stamped with the time they
+    were fetched (defaulting to now). Only the views that have changed since
+    the latest snapshot are written, and views older than the latest
+    snapshot (like an old export's) are skipped. Returns the number of rows
+    written. This doesn't commit.
     """
     build_database(db)
 
-    post_views_table = get_table("post_views", db=db)
+    fetched_at = fetched_at or utc_timestamp()
 
-    for view in post_views:
-        transform_post_view(view)
+    views: Dict[str, Optional[int]] = {key: count for key, count in rows}
+    latest = get_latest_views(db, table_name, key_column, list(views.keys()))
+    changes = [
+        (key, count, latest[key][0] if key in latest else None)
+        for key, count in views.items()
+        if key not in latest
+        or (latest[key][0] != count and latest[key][1] <= fetched_at)
+    ]
+    changed_rows = [(key, count, fetched_at) for key, count, _ in changes]
 
-    post_views_table.insert_all(records=post_views)
+    columns = (key_column, "views", "created_at")
+    insert_rows(db, table_name, columns, changed_rows)
+    upsert_rows(
+        db, f"{table_name}_latest", columns, changed_rows, pk=(key_column,)
+    )
+    update_rollups(db, table_name, key_column, changes, fetched_at)
+
+    return len(changed_rows)
+
+
+def write_post_views(
+    db: Database, rows: List[Tuple[Any, ...]], fetched_at: Optional[str] = None
+) -> int:
+    """
+    Write projected post_views rows to the SQLite database, if the views
+    have changed, see write_views. This doesn't commit.
+    """
+    return write_views(db, "post_views", "post_id", rows, fetched_at=fetched_at)
+
+
+def save_post_views(db: Database, post_views: Iterable[Dict[str, Any]]):
+    """
+    Save WriteFreely post views to the SQLite database.
+    """
+    with db.conn:
+        write_post_views(
+            db, [(post["id"], post.get("views")) for post in post_views]
+        )
 
 
-def get_collections(client: WriteFreelyClient) -> List[Dict[str, Any]]:
+def get_collections(
+    client: WriteFreelyClient, skip_unchanged: bool = False
+) -> List[Dict[str, Any]]:
     """
     Get the collections for the authenticated user.
+
+    If skip_unchanged is set, an empty list is returned when the client's
+    response cache says the collections haven't changed since the last
+    request.
     """
     _, response = client.get_me_collections()
     response.raise_for_status()
+
+    if skip_unchanged and is_not_modified(response):
+        return []
+
     return response.json()["data"]
 
 
@@ -306,20 +1985,68 @@ def transform_collection(collection: Dict[str, Any], user_username: str):
     collection["user_username"] = user_username
 
 
-def save_collections(
-    db: Database, collections: List[Dict[str, Any]], user_username
-):
+# The columns of the collections table, in the order project_collection
+# emits them.
+COLLECTION_FIELDS: Tuple[str, ...] = (
+    "alias",
+    "title",
+    "description",
+    "style_sheet",
+    "public",
+    "email",
+    "url",
+)
+COLLECTION_COLUMNS: Tuple[str, ...] = COLLECTION_FIELDS + ("user_username",)
+COLLECTION_VIEW_COLUMNS: Tuple[str, ...] = ("collection_alias", "views")
+
+
+def project_collection(
+    collection: Dict[str, Any], user_username: str
+) -> Tuple[Tuple[Any, ...], Tuple[Any, ...]]:
     """
-    Save WriteFreely collections to the SQLite database.
+    Project a WriteFreely collection into a collections row and a
+    collection_views row, in a single pass and without modifying the
+    collection.
     """
-    build_database(db)
+    row = tuple(map(collection.get, COLLECTION_FIELDS)) + (user_username,)
+    return row, (row[0], collection.get("views"))
 
-    collections_table = get_table("collections", db=db)
 
+def project_collections(
+    collections: Iterable[Dict[str, Any]], user_username: str
+) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+    """
+    Project WriteFreely collections into collections rows and
+    collection_views rows.
+    """
+    rows = []
+    view_rows = []
     for collection in collections:
-        transform_collection(collection, user_username)
+        row, view_row = project_collection(collection, user_username)
+        rows.append(row)
+        view_rows.append(view_row)
+    return rows, view_rows
+
 
-    collections_table.upsert_all(records=collections, pk="alias")
+def write_collections(db: Database, rows: List[Tuple[Any, ...]]):
+    """
+    Write projected collections rows to the SQLite database. This doesn't
+    commit.
+    """
+    build_database(db)
+    will_write(db, "collections", len(rows))
+    upsert_rows(db, "collections", COLLECTION_COLUMNS, rows, pk=("alias",))
+
+
+def save_collections(
+    db: Database, collections: Iterable[Dict[str, Any]], user_username
+):
+    """
+    Save WriteFreely collections to the SQLite database.
+    """
+    rows, _ = project_collections(collections, user_username)
+    with db.conn, fts_bulk_load(db):
+        write_collections(db, rows)
 
 
 def transform_collection_view(collection: Dict[str, Any]):
@@ -335,15 +2062,1176 @@ def transform_collection_view(collection: Dict[str, Any]):
         del collection[key]
 
 
-def save_collection_views(db: Database, collection_views: List[Dict[str, Any]]):
+def write_collection_views(
+    db: Database, rows: List[Tuple[Any, ...]], fetched_at: Optional[str] = None
+) -> int:
+    """
+    Write projected collection_views rows to the SQLite database, if the
+    views have changed, see write_views. This doesn't commit.
+    """
+    return write_views(
+        db, "collection_views", "collection_alias", rows, fetched_at=fetched_at
+    )
+
+
+def save_collection_views(
+    db: Database, collection_views: Iterable[Dict[str, Any]]
+):
     """
     Save WriteFreely collection views to the SQLite database.
     """
+    with db.conn:
+        write_collection_views(
+            db,
+            [(view["alias"], view.get("views")) for view in collection_views],
+        )
+
+
+def update_rollups(
+    db: Database,
+    table_name: str,
+    key_column: str,
+    changes: List[Tuple[str, Optional[int], Optional[int]]],
+    fetched_at: str,
+):
+    """
+    Update the rollup tables with changed views, each change is the key, the
+    new views and the previous views (None if there weren't any). This
+    doesn't commit.
+
+    The first views saved for a post or collection aren't counted as gained
+    on any day or week, as there's no telling when they were gained, but
+    they are counted in the lifetime totals.
+    """
+    period_rows = [
+        (key, fetched_at, (count or 0) - previous)
+        for key, count, previous in changes
+        if previous is not None
+    ]
+
+    for period, date_sql in ROLLUP_PERIODS.items():
+        db.conn.executemany(
+            f"INSERT INTO [{table_name}_{period}] "
+            f"([{key_column}], [date], [views]) "
+            f"VALUES (?, {date_sql.format('?')}, ?) "
+            f"ON CONFLICT ([{key_column}], [date]) DO UPDATE SET "
+            "[views] = [views] + excluded.[views]",
+            period_rows,
+        )
+
+    if table_name == "collection_views":
+        db.conn.executemany(
+            "INSERT INTO collection_totals (collection_alias, views) "
+            "VALUES (?, ?) "
+            "ON CONFLICT (collection_alias) DO UPDATE SET "
+            "views = excluded.views",
+            [(key, count) for key, count, _ in changes],
+        )
+    else:
+        update_collection_post_rollups(db, changes)
+
+
+def get_post_collection_aliases(
+    db: Database, post_ids: List[str]
+) -> Dict[str, Optional[str]]:
+    """
+    Returns the alias of the collection each of the given posts is in,
+    leaving out the posts that have been deleted on the server.
+    """
+    aliases: Dict[str, Optional[str]] = {}
+
+    for batch in chunks(post_ids, 500):
+        placeholders = ", ".join("?" for _ in batch)
+        rows = db.execute(
+            "SELECT id, collection_alias FROM posts "
+            f"WHERE id IN ({placeholders}) AND deleted = 0",
+            batch,
+        ).fetchall()
+        aliases.update(rows)
+
+    return aliases
+
+
+def update_collection_post_rollups(
+    db: Database, changes: List[Tuple[str, Optional[int], Optional[int]]]
+):
+    """
+    Update the collections' post views totals and top posts with changed
+    post views, see update_rollups. This doesn't commit.
+    """
+    aliases = get_post_collection_aliases(db, [key for key, _, _ in changes])
+
+    changes_by_alias: Dict[str, List[Tuple[str, int, int]]] = {}
+    for post_id, count, previous in changes:
+        alias = aliases.get(post_id)
+        if alias is not None:
+            changes_by_alias.setdefault(alias, []).append(
+                (post_id, count or 0, (count or 0) - (previous or 0))
+            )
+
+    for alias, alias_changes in changes_by_alias.items():
+        db.execute(
+            "INSERT INTO collection_totals (collection_alias, post_views) "
+            "VALUES (?, ?) "
+            "ON CONFLICT (collection_alias) DO UPDATE SET "
+            "post_views = coalesce(post_views, 0) + excluded.post_views",
+            [alias, sum(delta for _, _, delta in alias_changes)],
+        )
+
+        # Merge the changed posts into the current top posts, rather than
+        # ranking every post in the collection again.
+        top_posts = dict(
+            db.execute(
+                "SELECT top.post_id, top.views FROM collection_top_posts "
+                "AS top JOIN posts ON posts.id = top.post_id "
+                "WHERE top.collection_alias = ? AND posts.deleted = 0",
+                [alias],
+            ).fetchall()
+        )
+        top_posts.update(
+            (post_id, count) for post_id, count, _ in alias_changes
+        )
+        ranked = sorted(top_posts.items(), key=lambda item: (-item[1], item[0]))
+
+        db.execute(
+            "DELETE FROM collection_top_posts WHERE collection_alias = ?",
+            [alias],
+        )
+        insert_rows(
+            db,
+            "collection_top_posts",
+            ("collection_alias", "rank", "post_id", "views"),
+            (
+                (alias, rank, post_id, count)
+                for rank, (post_id, count) in enumerate(
+                    ranked[:TOP_POSTS_COUNT], start=1
+                )
+            ),
+        )
+
+
+def rebuild_collection_rollups(db: Database):
+    """
+    Rebuild the collections' lifetime totals and top posts from the latest
+    views, leaving out the posts that have been deleted on the server. This
+    doesn't commit.
+    """
+    db.execute("DELETE FROM collection_totals")
+    db.execute(
+        "INSERT INTO collection_totals "
+        "(collection_alias, views, post_views) "
+        "SELECT aliases.alias, "
+        "(SELECT views FROM collection_views_latest "
+        "WHERE collection_alias = aliases.alias), "
+        "(SELECT sum(post_views_latest.views) FROM posts "
+        "JOIN post_views_latest ON post_views_latest.post_id = posts.id "
+        "WHERE posts.collection_alias = aliases.alias "
+        "AND posts.deleted = 0) "
+        "FROM (SELECT collection_alias AS alias FROM collection_views_latest "
+        "UNION SELECT collection_alias FROM posts "
+        "WHERE collection_alias IS NOT NULL) AS aliases"
+    )
+
+    db.execute("DELETE FROM collection_top_posts")
+    db.execute(
+        "INSERT INTO collection_top_posts "
+        "(collection_alias, rank, post_id, views) "
+        "SELECT collection_alias, rank, post_id, views FROM ("
+        "SELECT posts.collection_alias, post_views_latest.post_id, "
+        "post_views_latest.views, row_number() OVER ("
+        "PARTITION BY posts.collection_alias "
+        "ORDER BY post_views_latest.views DESC, post_views_latest.post_id"
+        ") AS rank "
+        "FROM post_views_latest "
+        "JOIN posts ON posts.id = post_views_latest.post_id "
+        "WHERE posts.collection_alias IS NOT NULL AND posts.deleted = 0"
+        ") WHERE rank <= ?",
+        [TOP_POSTS_COUNT],
+    )
+
+
+def rebuild_rollups(db: Database):
+    """
+    Rebuild all the rollup tables from the views history, for backfills.
+    This doesn't commit.
+    """
+    for table_name, key_column, _, _ in VIEWS_TABLES:
+        for period, date_sql in ROLLUP_PERIODS.items():
+            rollup_table_name = f"{table_name}_{period}"
+            db.execute(f"DELETE FROM [{rollup_table_name}]")
+            db.execute(
+                f"INSERT INTO [{rollup_table_name}] "
+                f"([{key_column}], [date], [views]) "
+                f"SELECT [{key_column}], {date_sql.format('[created_at]')}, "
+                "sum([gained]) FROM ("
+                f"SELECT [{key_column}], [created_at], "
+                "coalesce([views], 0) - lag(coalesce([views], 0)) OVER ("
+                f"PARTITION BY [{key_column}] ORDER BY [created_at], [id]"
+                ") AS [gained] "
+                f"FROM [{table_name}]"
+                ") WHERE [gained] IS NOT NULL "
+                f"GROUP BY [{key_column}], {date_sql.format('[created_at]')}"
+            )
+
+    rebuild_collection_rollups(db)
+
+
+def sync(
+    db: Database,
+    client: WriteFreelyClient,
+    incremental: bool = False,
+    batch_size: int = 100,
+    metrics: Optional[SyncMetrics] = None,
+) -> Dict[str, int]:
+    """
+    Save the authenticated user, their collections and their posts in one
+    go. The user, collections and posts are requested concurrently over the
+    client's session and everything is written in a single transaction.
+    Returns the number of rows written to each table.
+
+    The user's posts and collections that are no longer on the server are
+    marked as deleted, and unmarked if they come back.
+
+    The time spent in each stage is added to metrics, if it's given.
+    """
+    metrics = metrics or SyncMetrics()
+
+    with metrics.stage("build_database"):
+        build_database(db)
+
+    counts = {"users": 0, "collections": 0, "posts": 0}
+    fetched_at = utc_timestamp()
+
+    with metrics.stage("fetch"), ThreadPoolExecutor(max_workers=3) as executor:
+        user_future = executor.submit(get_user, client)
+        collections_future = executor.submit(client.get_me_collections)
+        posts_future = executor.submit(client.get_me_posts, stream=True)
+
+        user = user_future.result()
+        _, collections_response = collections_future.result()
+        _, posts_response = posts_future.result()
+
+    user_username = user["username"]
+
+    # Deletions can only be told apart when the whole list was downloaded,
+    # not when the response cache says it hasn't changed.
+    collections_response.raise_for_status()
+    collections_fetched = not is_not_modified(collections_response)
+    collections = (
+        collections_response.json()["data"] if collections_fetched else []
+    )
+    posts_fetched = not is_not_modified(posts_response)
+
+    with db.conn, fts_bulk_load(db, metrics=metrics):
+        with metrics.stage("write_users"):
+            write_user(db, project_user(user))
+        metrics.add("write_users", rows_written=1)
+        counts["users"] = 1
+
+        with metrics.stage("project"):
+            rows, view_rows = project_collections(collections, user_username)
+        with metrics.stage("write_collections"):
+            write_collections(db, rows)
+        metrics.add("write_collections", rows_written=len(rows))
+        write_views_stage(
+            metrics, write_collection_views, db, view_rows, fetched_at
+        )
+        counts["collections"] = len(rows)
+        create_fetched_keys(db, "collections", user_username)
+        add_fetched_keys(
+            db, "collections", user_username, (row[0] for row in rows)
+        )
+
+        if posts_fetched:
+            posts_iter: Iterator[Dict[str, Any]] = iter_response_data(
+                posts_response
+            )
+        else:
+            posts_response.close()
+            posts_iter = iter([])
+        create_fetched_keys(db, "posts", user_username)
+
+        # The posts are still downloading while the rows are written, so
+        # reading them includes waiting on the download as well as decoding
+        # the JSON.
+        posts_iter = metrics.timed_iter("read_posts", posts_iter)
+
+        for batch in chunks(posts_iter, batch_size):
+            with metrics.stage("project"):
+                rows, view_rows = project_posts(batch, user_username)
+            with metrics.stage("write_posts"):
+                written = write_posts(
+                    db, rows, user_username, incremental=incremental
+                )
+            metrics.add(
+                "write_posts",
+                rows_written=written,
+                rows_skipped=len(rows) - written,
+            )
+            counts["posts"] += written
+            write_views_stage(
+                metrics, write_post_views, db, view_rows, fetched_at
+            )
+            add_fetched_keys(
+                db,
+                "posts",
+                user_username,
+                (row[POST_ID_INDEX] for row in rows),
+            )
+
+        with metrics.stage("mark_deleted"):
+            deleted = 0
+            if collections_fetched:
+                deleted += mark_deleted(
+                    db, "collections", user_username, fetched_at
+                )
+            if posts_fetched:
+                deleted += mark_deleted(db, "posts", user_username, fetched_at)
+        metrics.add("mark_deleted", rows_written=deleted)
+
+    return counts
+
+
+def create_fetched_keys(db: Database, table_name: str, user_username: str):
+    """
+    Create the temporary table for the keys of the table's rows fetched by
+    a sync, see mark_deleted, with none for the user. Several accounts'
+    syncs can share the table.
+    """
+    db.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS [fetched_{table_name}] "
+        "([user_username] TEXT, [key] TEXT, "
+        "PRIMARY KEY ([user_username], [key])) WITHOUT ROWID"
+    )
+    db.execute(
+        f"DELETE FROM temp.[fetched_{table_name}] WHERE [user_username] = ?",
+        [user_username],
+    )
+
+
+def add_fetched_keys(
+    db: Database, table_name: str, user_username: str, keys: Iterable[str]
+):
+    db.conn.executemany(
+        f"INSERT OR IGNORE INTO temp.[fetched_{table_name}] "
+        "([user_username], [key]) VALUES (?, ?)",
+        ((user_username, key) for key in keys),
+    )
+
+
+def mark_deleted(
+    db: Database, table_name: str, user_username: str, deleted_at: str
+) -> int:
+    """
+    Mark the user's rows that weren't fetched as deleted, and clear the mark
+    on the rows that were, comparing them with the keys in the temporary
+    table from create_fetched_keys with an anti-join. The keys are never
+    read into Python. The collections' rollups are rebuilt if any posts are
+    marked or unmarked, so they only count the posts still on the server.
+    Returns the number of rows marked as deleted. This doesn't commit.
+    """
+    key_column = DELETABLE_TABLES[table_name]
+    fetched_table = f"temp.[fetched_{table_name}]"
+
+    restored = db.execute(
+        f"UPDATE [{table_name}] SET [deleted] = 0, [deleted_at] = NULL "
+        "WHERE [user_username] = ? AND [deleted] = 1 "
+        f"AND [{key_column}] IN (SELECT [key] FROM {fetched_table} "
+        "WHERE [user_username] = ?)",
+        [user_username, user_username],
+    ).rowcount
+    deleted = db.execute(
+        f"UPDATE [{table_name}] SET [deleted] = 1, [deleted_at] = ? "
+        "WHERE [user_username] = ? AND [deleted] = 0 AND NOT EXISTS ("
+        f"SELECT 1 FROM {fetched_table} AS f "
+        "WHERE f.[user_username] = ? "
+        f"AND f.[key] = [{table_name}].[{key_column}])",
+        [deleted_at, user_username, user_username],
+    ).rowcount
+    db.execute(
+        f"DELETE FROM {fetched_table} WHERE [user_username] = ?",
+        [user_username],
+    )
+
+    if table_name == "posts" and (restored or deleted):
+        rebuild_collection_rollups(db)
+
+    return deleted
+
+
+def write_views_stage(
+    metrics: SyncMetrics,
+    write_func: Callable[..., int],
+    db: Database,
+    rows: List[Tuple[Any, ...]],
+    fetched_at: str,
+):
+    """
+    Write views rows with write_post_views or write_collection_views as the
+    write_views stage, counting the unchanged views as skipped.
+    """
+    with metrics.stage("write_views"):
+        written = write_func(db, rows, fetched_at=fetched_at)
+    metrics.add(
+        "write_views", rows_written=written, rows_skipped=len(rows) - written
+    )
+
+
+def import_export(
+    db: Database,
+    path: Path,
+    user_username: Optional[str] = None,
+    export_format: Optional[str] = None,
+    batch_size: int = 100,
+    metrics: Optional[SyncMetrics] = None,
+) -> Dict[str, int]:
+    """
+    Save the user, collections and posts in a WriteFreely export file (JSON,
+    CSV or ZIP) without touching the network. The file is streamed, and the
+    posts are projected and written in batches like a sync, in a single
+    transaction.
+
+    Only JSON exports have the user, so user_username has to be given for
+    CSV and ZIP exports, and it overrides the JSON export's user if it is.
+    CSV and ZIP exports don't have the posts' metadata, so they're written
+    as partial rows, see write_posts. The view counts in the export are
+    stamped with the file's modification time, and aren't saved if newer
+    counts have been. Returns the number of rows written to each table.
+    """
+    import_metrics = metrics or SyncMetrics()
+
+    with import_metrics.stage("build_database"):
+        build_database(db)
+
+    counts = {"users": 0, "collections": 0, "posts": 0}
+    modified = datetime.datetime.fromtimestamp(
+        Path(path).stat().st_mtime, datetime.timezone.utc
+    )
+    fetched_at = modified.replace(tzinfo=None).isoformat(sep=" ")
+
+    def check_username() -> str:
+        if user_username is None:
+            raise ValueError(
+                "The export doesn't say whose posts they are, give the "
+                "username."
+            )
+        return user_username
+
+    def write_batch(batch: List[Dict[str, Any]], partial: bool):
+        username = check_username()
+
+        with import_metrics.stage("project"):
+            rows, view_rows = project_posts(batch, username)
+        with import_metrics.stage("write_posts"):
+            written = write_posts(db, rows, username, partial=partial)
+        import_metrics.add(
+            "write_posts",
+            rows_written=written,
+            rows_skipped=len(rows) - written,
+        )
+        counts["posts"] += written
+
+        # CSV and ZIP exports don't have view counts.
+        view_rows = [row for row in view_rows if row[1] is not None]
+        write_views_stage(
+            import_metrics, write_post_views, db, view_rows, fetched_at
+        )
+
+    items = import_metrics.timed_iter(
+        "read_export", iter_export(path, export_format=export_format)
+    )
+
+    with db.conn, fts_bulk_load(db, metrics=import_metrics):
+        batch: List[Dict[str, Any]] = []
+        batch_kind = "post"
+
+        for kind, item in items:
+            # The user and collections come before their posts, and the
+            # posts of a JSON export inside a ZIP export aren't partial, so
+            # write the posts read so far first.
+            if batch and kind != batch_kind:
+                write_batch(batch, batch_kind == "partial_post")
+                batch = []
+
+            if kind in ("post", "partial_post"):
+                batch_kind = kind
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    write_batch(batch, batch_kind == "partial_post")
+                    batch = []
+                continue
+
+            if kind == "user":
+                user_username = user_username or item.get("username")
+                username = check_username()
+                with import_metrics.stage("write_users"):
+                    write_user(db, project_user({**item, "username": username}))
+                import_metrics.add("write_users", rows_written=1)
+                counts["users"] += 1
+            elif kind == "collection":
+                row, view_row = project_collection(item, check_username())
+                with import_metrics.stage("write_collections"):
+                    write_collections(db, [row])
+                import_metrics.add("write_collections", rows_written=1)
+                counts["collections"] += 1
+                if view_row[1] is not None:
+                    write_views_stage(
+                        import_metrics,
+                        write_collection_views,
+                        db,
+                        [view_row],
+                        fetched_at,
+                    )
+
+        if batch:
+            write_batch(batch, batch_kind == "partial_post")
+
+    return counts
+
+
+# Hashtags in a post's body, which WriteFreely uses as the post's tags. A
+# hashtag can't follow a word character, &, # or /, which rules out HTML
+# entities, headings and URL fragments. That's checked separately, as a
+# lookbehind would stop the regex from skipping ahead to each #.
+HASHTAG_RE = re.compile(r"#(\w+)")
+HASHTAG_NOT_AFTER = re.compile(r"[\w&#/]")
+
+# The format WriteFreely's API returns timestamps in.
+API_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def extract_hashtags(body: Optional[str]) -> str:
+    """
+    Returns the hashtags in a post's body as a JSON list, in the order they
+    first appear, like the tags WriteFreely's API returns.
+    """
+    body = body or ""
+    tags = (
+        match.group(1)
+        for match in HASHTAG_RE.finditer(body)
+        if match.start() == 0
+        or HASHTAG_NOT_AFTER.match(body, match.start() - 1) is None
+    )
+    return json.dumps(list(dict.fromkeys(tags)))
+
+
+def changed_sql(columns: Iterable[str], old: str, new: str) -> str:
+    """
+    Returns an SQL condition that's true if any of the columns differ
+    between the old and new table aliases.
+    """
+    return " OR ".join(
+        f"{old}.[{column}] IS NOT {new}.[{column}]" for column in columns
+    )
+
+
+def write_views_select(
+    db: Database,
+    table_name: str,
+    key_column: str,
+    select_sql: str,
+    params: List[Any],
+    fetched_at: str,
+) -> int:
+    """
+    Write the views selected by select_sql, which selects a key and a views
+    column, to a views table with set-based statements, if they've changed,
+    see write_views. Returns the number of rows written. This doesn't
+    commit.
+    """
+    db.execute("DROP TABLE IF EXISTS temp.view_changes")
+    db.execute(
+        "CREATE TEMP TABLE view_changes AS "
+        "SELECT source.key, source.views, latest.views AS previous, "
+        "latest.[{key}] IS NOT NULL AS seen "
+        "FROM ({select}) AS source "
+        "LEFT JOIN [{table}_latest] AS latest "
+        "ON latest.[{key}] = source.key "
+        "WHERE source.views IS NOT NULL AND (latest.[{key}] IS NULL "
+        "OR (latest.views IS NOT source.views "
+        "AND latest.created_at <= ?))".format(
+            key=key_column, select=select_sql, table=table_name
+        ),
+        list(params) + [fetched_at],
+    )
+
+    cursor = db.execute(
+        f"INSERT INTO [{table_name}] ([{key_column}], [views], [created_at]) "
+        "SELECT key, views, ? FROM temp.view_changes",
+        [fetched_at],
+    )
+    db.execute(
+        f"INSERT INTO [{table_name}_latest] "
+        f"([{key_column}], [views], [created_at]) "
+        "SELECT key, views, ? FROM temp.view_changes WHERE true "
+        f"ON CONFLICT ([{key_column}]) DO UPDATE SET "
+        "[views] = excluded.[views], [created_at] = excluded.[created_at]",
+        [fetched_at],
+    )
+
+    for period, date_sql in ROLLUP_PERIODS.items():
+        db.execute(
+            f"INSERT INTO [{table_name}_{period}] "
+            f"([{key_column}], [date], [views]) "
+            f"SELECT key, {date_sql.format('?')}, "
+            "coalesce(views, 0) - coalesce(previous, 0) "
+            "FROM temp.view_changes WHERE seen "
+            f"ON CONFLICT ([{key_column}], [date]) DO UPDATE SET "
+            "[views] = [views] + excluded.[views]",
+            [fetched_at],
+        )
+
+    db.execute("DROP TABLE temp.view_changes")
+    return cursor.rowcount
+
+
+def import_users(
+    db: Database, user_filter: str, user_params: List[Any]
+) -> Tuple[int, int]:
+    """
+    Save the users in the attached WriteFreely database, see
+    import_database. Returns the number of users written and the number
+    read. This doesn't commit.
+    """
+    (count,) = db.execute(
+        f"SELECT count(*) FROM writefreely.users AS u WHERE {user_filter}",
+        user_params,
+    ).fetchone()
+    will_write(db, "users", count)
+
+    cursor = db.execute(
+        "INSERT INTO users (username, created) "
+        "SELECT u.username, strftime(?, u.created) "
+        f"FROM writefreely.users AS u WHERE {user_filter} "
+        "ON CONFLICT (username) DO UPDATE SET created = excluded.created "
+        "WHERE users.created IS NOT excluded.created",
+        [API_TIMESTAMP_FORMAT] + user_params,
+    )
+    return cursor.rowcount, count
+
+
+def import_collections(
+    db: Database,
+    user_filter: str,
+    user_params: List[Any],
+    base_url: Optional[str],
+) -> Tuple[int, int]:
+    """
+    Save the collections in the attached WriteFreely database, staged in the
+    source_collections temporary table, see import_database. Returns the
+    number of collections written and the number read. This doesn't commit.
+    """
+    db.execute(
+        "CREATE TEMP TABLE source_collections AS "
+        "SELECT c.alias, c.title, c.description, c.style_sheet, "
+        "c.privacy = 1 AS public, "
+        "rtrim(?, '/') || '/' || c.alias || '/' AS url, "
+        "u.username AS user_username, c.view_count AS views "
+        "FROM writefreely.collections AS c "
+        "JOIN writefreely.users AS u ON u.id = c.owner_id "
+        f"WHERE c.alias IS NOT NULL AND {user_filter}",
+        [base_url] + user_params,
+    )
+    (count,) = db.execute(
+        "SELECT count(*) FROM temp.source_collections"
+    ).fetchone()
+    will_write(db, "collections", count)
+
+    columns: Tuple[str, ...] = (
+        "title",
+        "description",
+        "style_sheet",
+        "public",
+        "user_username",
+    )
+    if base_url:
+        # Otherwise the saved URLs are kept.
+        columns += ("url",)
+
+    column_list = ", ".join(f"[{column}]" for column in columns)
+    cursor = db.execute(
+        f"INSERT INTO collections ([alias], {column_list}) "
+        f"SELECT [alias], {column_list} "
+        "FROM temp.source_collections WHERE true "
+        "ON CONFLICT ([alias]) DO UPDATE SET "
+        + ", ".join(f"[{column}] = excluded.[{column}]" for column in columns)
+        + f" WHERE {changed_sql(columns, 'collections', 'excluded')}"
+    )
+    return cursor.rowcount, count
+
+
+def import_posts(
+    db: Database, user_filter: str, user_params: List[Any]
+) -> Tuple[int, int]:
+    """
+    Save the posts in the attached WriteFreely database, staged in the
+    source_posts temporary table, see import_database. Like write_posts,
+    only new posts and posts whose title or body have changed are written
+    in full, posts whose metadata has changed just have those columns
+    updated, and unchanged posts aren't written. Returns the number of
+    posts written and the number read. This doesn't commit.
+    """
+    db.execute(
+        "CREATE TEMP TABLE source_posts AS SELECT "
+        "p.id, p.slug, p.text_appearance AS appearance, p.language, p.rtl, "
+        "strftime(?, p.created) AS created, "
+        "strftime(?, p.updated) AS updated, "
+        "p.title, p.content AS body, "
+        "extract_hashtags(p.content) AS tags, "
+        "c.alias AS collection_alias, "
+        "u.username AS user_username, "
+        "hash_post_body(p.content) AS body_hash, "
+        "p.view_count AS views "
+        "FROM writefreely.posts AS p "
+        "JOIN writefreely.users AS u ON u.id = p.owner_id "
+        "LEFT JOIN writefreely.collections AS c ON c.id = p.collection_id "
+        f"WHERE {user_filter}",
+        [API_TIMESTAMP_FORMAT, API_TIMESTAMP_FORMAT] + user_params,
+    )
+    db.execute("CREATE INDEX temp.source_posts_id ON source_posts (id)")
+
+    (count,) = db.execute("SELECT count(*) FROM temp.source_posts").fetchone()
+
+    changed_posts = (
+        "FROM temp.source_posts AS s LEFT JOIN posts AS p ON p.id = s.id "
+        f"WHERE p.id IS NULL OR {changed_sql(('title', 'body_hash'), 'p', 's')}"
+    )
+    (changed_count,) = db.execute(f"SELECT count(*) {changed_posts}").fetchone()
+    body_sql = (
+        post_body_sql("p") if get_setting(db, BODY_CODEC_SETTING) else "p.body"
+    )
+    changes = db.execute(
+        f"SELECT s.id, {body_sql}, p.body_hash, p.updated, s.body "
+        "FROM temp.source_posts AS s JOIN posts AS p ON p.id = s.id "
+        "WHERE p.body_hash IS NOT s.body_hash"
+    ).fetchall()
+    if changes:
+        write_post_revisions(db, changes)
+
+    db.execute(
+        "CREATE TEMP TABLE tagged_posts AS SELECT s.id "
+        "FROM temp.source_posts AS s LEFT JOIN posts AS p ON p.id = s.id "
+        "WHERE p.id IS NULL OR p.tags IS NOT s.tags"
+    )
+    will_write(db, "posts", changed_count)
+
+    # The posts are saved without fingerprints, see write_posts.
+    db.execute(
+        "DELETE FROM post_fingerprints WHERE post_id IN ("
+        "SELECT s.id FROM temp.source_posts AS s JOIN posts AS p "
+        f"ON p.id = s.id WHERE {changed_sql(POST_SUMMARY_COLUMNS, 'p', 's')})"
+    )
+
+    columns = POST_COLUMNS
+    values = [f"s.[{column}]" for column in POST_COLUMNS]
+    params = []
+    codec = get_setting(db, BODY_CODEC_SETTING)
+    if codec:
+        columns = POST_COLUMNS + ("body_compressed",)
+        values[POST_BODY_INDEX] = "NULL"
+        values.append("compress_body(s.[body], ?)")
+        params.append(codec)
+
+    cursor = db.execute(
+        f"INSERT INTO posts ({', '.join(f'[{c}]' for c in columns)}) "
+        f"SELECT {', '.join(values)} {changed_posts} "
+        "ON CONFLICT ([id]) DO UPDATE SET "
+        + ", ".join(f"[{c}] = excluded.[{c}]" for c in columns if c != "id"),
+        params,
+    )
+    written = cursor.rowcount
+
+    cursor = db.execute(
+        "UPDATE posts SET "
+        + ", ".join(f"[{c}] = s.[{c}]" for c in POST_METADATA_COLUMNS)
+        + " FROM temp.source_posts AS s WHERE s.id = posts.id AND ("
+        + changed_sql(POST_METADATA_COLUMNS, "posts", "s")
+        + ")"
+    )
+    written += cursor.rowcount
+
+    write_post_tags(db, "SELECT id FROM temp.tagged_posts", [])
+    db.execute("DROP TABLE temp.tagged_posts")
+
+    return written, count
+
+
+def import_database(
+    db: Database,
+    source_path: Path,
+    usernames: Optional[List[str]] = None,
+    base_url: Optional[str] = None,
+    metrics: Optional[SyncMetrics] = None,
+) -> Dict[str, int]:
+    """
+    Save the users, collections, posts and view counts in a WriteFreely
+    instance's SQLite database. The database is attached and read with
+    set-based INSERT ... SELECT statements, in a single transaction.
+
+    Only the given users are saved, or everyone if usernames isn't given.
+    The collections' URLs are made from the instance's base_url, if it's
+    given. WriteFreely keeps the users' email addresses encrypted, so they
+    aren't saved. Returns the number of rows written to each table.
+    """
+    metrics = metrics or SyncMetrics()
+
+    with metrics.stage("build_database"):
+        build_database(db)
+
+    counts = {"users": 0, "collections": 0, "posts": 0}
+    fetched_at = utc_timestamp()
+
+    user_filter = "true"
+    user_params: List[Any] = []
+    if usernames:
+        user_filter = f"u.username IN ({', '.join('?' for _ in usernames)})"
+        user_params = list(usernames)
+
+    db.register_function(hash_post_body, deterministic=True, replace=True)
+    db.register_function(extract_hashtags, deterministic=True, replace=True)
+
+    # Attaching can't be done in a transaction.
+    db.execute("ATTACH DATABASE ? AS writefreely", [str(source_path)])
+    try:
+        with db.conn, fts_bulk_load(db, metrics=metrics):
+            with metrics.stage("write_users"):
+                users = import_users(db, user_filter, user_params)
+            with metrics.stage("write_collections"):
+                collections = import_collections(
+                    db, user_filter, user_params, base_url
+                )
+            with metrics.stage("write_posts"):
+                posts = import_posts(db, user_filter, user_params)
+
+            for table_name, (written, count) in (
+                ("users", users),
+                ("collections", collections),
+                ("posts", posts),
+            ):
+                metrics.add(
+                    f"write_{table_name}",
+                    rows_written=written,
+                    rows_skipped=count - written,
+                )
+                counts[table_name] = written
+
+            with metrics.stage("write_views"):
+                views_written = write_views_select(
+                    db,
+                    "collection_views",
+                    "collection_alias",
+                    "SELECT alias AS key, views FROM temp.source_collections",
+                    [],
+                    fetched_at,
+                )
+                views_written += write_views_select(
+                    db,
+                    "post_views",
+                    "post_id",
+                    "SELECT id AS key, views FROM temp.source_posts",
+                    [],
+                    fetched_at,
+                )
+                rebuild_collection_rollups(db)
+            metrics.add("write_views", rows_written=views_written)
+
+            db.execute("DROP TABLE temp.source_collections")
+            db.execute("DROP TABLE temp.source_posts")
+    finally:
+        db.execute("DETACH DATABASE writefreely")
+
+    return counts
+
+
+def save_sync_run(
+    db: Database,
+    command: str,
+    metrics: SyncMetrics,
+    started_at: str,
+    error: Optional[str] = None,
+) -> int:
+    """
+    Append a record of a run and the time spent in each of its stages to
+    the sync_runs table. Returns the record's id.
+    """
     build_database(db)
 
-    collection_views_table = get_table("collection_views", db=db)
+    seconds = metrics.finish()
+    with db.conn:
+        cursor = db.execute(
+            "INSERT INTO sync_runs (command, started_at, finished_at, "
+            "seconds, bytes_downloaded, rows_written, rows_skipped, stages, "
+            "error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                command,
+                started_at,
+                utc_timestamp(),
+                seconds,
+                metrics.bytes_downloaded,
+                metrics.rows_written,
+                metrics.rows_skipped,
+                json.dumps(metrics.stages),
+                error,
+            ],
+        )
+    return cursor.lastrowid
+
+
+def find_auth_files(path: Path) -> List[Path]:
+    """
+    Returns the auth files to sync from a directory of auth.json files, or
+    from a JSON manifest listing the paths of the auth files (relative to
+    the manifest).
+    """
+    path = Path(path)
+
+    if path.is_dir():
+        return sorted(path.glob("*.json"))
+
+    with path.open() as file_obj:
+        manifest = json.load(file_obj)
+
+    if isinstance(manifest, dict):
+        manifest = manifest["accounts"]
+
+    return [path.parent / auth_path for auth_path in manifest]
 
-    for view in collection_views:
-        transform_collection_view(view)
 
-    collection_views_table.insert_all(records=collection_views)
+def get_auth_domain(auth_file_path: Path) -> str:
+    """
+    Returns the WriteFreely domain from an auth file.
+    """
+    with Path(auth_file_path).open() as file_obj:
+        return json.load(file_obj)["writefreely_domain"]
+
+
+def fetch_account(
+    client: WriteFreelyClient,
+    write: Callable[..., None],
+    incremental: bool = False,
+    batch_size: int = 100,
+    user: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Fetch an account's user, collections and posts, passing the writes to
+    the write function as they're ready. The user is only fetched if it
+    isn't given. Returns the account's username and the number of
+    collections and posts fetched.
+
+    Like sync, the account's posts and collections that are no longer on
+    the server are marked as deleted, unless the response cache says the
+    list hasn't changed.
+    """
+    fetched_at = utc_timestamp()
+    user = user or get_user(client)
+    user_username = user["username"]
+    write(write_user, project_user(user))
+
+    _, collections_response = client.get_me_collections()
+    collections_response.raise_for_status()
+    collections_fetched = not is_not_modified(collections_response)
+    collections = (
+        collections_response.json()["data"] if collections_fetched else []
+    )
+
+    rows, view_rows = project_collections(collections, user_username)
+    write(write_collections, rows)
+    write(write_collection_views, view_rows, fetched_at)
+    collection_count = len(rows)
+    if collections_fetched:
+        write(create_fetched_keys, "collections", user_username)
+        write(
+            add_fetched_keys,
+            "collections",
+            user_username,
+            [row[0] for row in rows],
+        )
+        write(mark_deleted, "collections", user_username, fetched_at)
+
+    _, posts_response = client.get_me_posts(stream=True)
+    posts_fetched = not is_not_modified(posts_response)
+    if posts_fetched:
+        posts_iter: Iterator[Dict[str, Any]] = iter_response_data(
+            posts_response
+        )
+        write(create_fetched_keys, "posts", user_username)
+    else:
+        posts_response.close()
+        posts_iter = iter([])
+
+    post_count = 0
+    for batch in chunks(posts_iter, batch_size):
+        rows, view_rows = project_posts(batch, user_username)
+        write(write_posts, rows, user_username, incremental)
+        write(write_post_views, view_rows, fetched_at)
+        if posts_fetched:
+            write(
+                add_fetched_keys,
+                "posts",
+                user_username,
+                [row[POST_ID_INDEX] for row in rows],
+            )
+        post_count += len(rows)
+
+    # Only once all the posts have been read, so an account whose download
+    # fails doesn't have its posts marked as deleted.
+    if posts_fetched:
+        write(mark_deleted, "posts", user_username, fetched_at)
+
+    return {
+        "username": user_username,
+        "collections": collection_count,
+        "posts": post_count,
+    }
+
+
+def sync_accounts(
+    db: Database,
+    auth_file_paths: List[Path],
+    workers: int = 8,
+    per_host: int = 2,
+    incremental: bool = False,
+    batch_size: int = 100,
+    metrics: Optional[SyncMetrics] = None,
+    **client_kwargs,
+) -> List[Dict[str, Any]]:
+    """
+    Sync several accounts, possibly on different WriteFreely instances, into
+    one database.
+
+    The accounts are fetched in parallel, with at most per_host accounts
+    being fetched from the same instance at once. All the writes are
+    funnelled through a queue to this thread, so only one connection ever
+    writes to the database. Returns a report for each account with how long
+    it took and how many collections and posts it had, or the error that
+    stopped it.
+
+    The rows are only told apart by username, so an account with the same
+    username as an earlier one in the list, even on another instance, is
+    refused rather than having each one mark the other's posts as deleted.
+    Every account's user is fetched before any of them is synced, so the
+    same account is refused on every run.
+
+    The time spent fetching the accounts and in each of the writes, and
+    the bytes downloaded, are added to metrics, if it's given.
+    """
+    sync_metrics = metrics or SyncMetrics()
+
+    with sync_metrics.stage("build_database"):
+        build_database(db)
+
+    domains = {path: get_auth_domain(path) for path in auth_file_paths}
+    host_semaphores = {
+        domain: threading.BoundedSemaphore(per_host)
+        for domain in set(domains.values())
+    }
+    reports: Dict[Path, Dict[str, Any]] = {
+        path: {
+            "auth": str(path),
+            "domain": domains[path],
+            "username": None,
+            "collections": 0,
+            "posts": 0,
+            "seconds": 0.0,
+            "error": None,
+        }
+        for path in auth_file_paths
+    }
+    accounts: Dict[Path, Tuple[WriteFreelyClient, Dict[str, Any]]] = {}
+
+    # Bounded, so fetchers wait for the writer rather than piling up rows
+    # in memory. None marks that an account has finished.
+    writes: "queue.Queue[Optional[Tuple[Callable, Tuple]]]" = queue.Queue(
+        maxsize=workers * 4
+    )
+    writer_failed = threading.Event()
+
+    def write(func: Callable, *args):
+        if writer_failed.is_set():
+            raise RuntimeError("The database writer has stopped.")
+        writes.put((func, args))
+
+    def run(auth_file_path: Path, stage: str, step: Callable[[], None]):
+        report = reports[auth_file_path]
+        with host_semaphores[report["domain"]]:
+            start = time.perf_counter()
+            try:
+                with sync_metrics.stage(stage):
+                    step()
+            except Exception as error:
+                report["error"] = f"{type(error).__name__}: {error}"
+            report["seconds"] += time.perf_counter() - start
+
+    def identify(auth_file_path: Path):
+        def step():
+            client = get_client(str(auth_file_path), **client_kwargs)
+            sync_metrics.watch(client)
+            accounts[auth_file_path] = (client, get_user(client))
+
+        run(auth_file_path, "fetch_user", step)
+
+    def fetch(auth_file_path: Path):
+        client, user = accounts[auth_file_path]
+
+        def step():
+            reports[auth_file_path].update(
+                fetch_account(
+                    client,
+                    write,
+                    incremental=incremental,
+                    batch_size=batch_size,
+                    user=user,
+                )
+            )
+
+        try:
+            run(auth_file_path, "fetch_account", step)
+        finally:
+            writes.put(None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(identify, auth_file_paths))
+
+        first_paths: Dict[str, Path] = {}
+        for path in auth_file_paths:
+            if path not in accounts:
+                continue
+            username = accounts[path][1]["username"]
+            if username in first_paths:
+                reports[path]["username"] = username
+                reports[path]["error"] = (
+                    f"ValueError: {username} is already synced from "
+                    f"{first_paths[username]}, accounts with the same "
+                    "username can't share a database."
+                )
+                del accounts[path]
+            else:
+                first_paths[username] = path
+
+        futures = [executor.submit(fetch, path) for path in accounts]
+
+        finished = 0
+        try:
+            with db.conn, fts_bulk_load(db):
+                while finished < len(futures):
+                    job = writes.get()
+                    if job is None:
+                        finished += 1
+                        continue
+                    func, args = job
+                    with sync_metrics.stage(func.__name__):
+                        written = func(db, *args)
+                    if isinstance(written, int):
+                        sync_metrics.add(func.__name__, rows_written=written)
+        except BaseException:
+            # Keep draining the queue, so the fetchers can stop.
+            writer_failed.set()
+            while finished < len(futures):
+                if writes.get() is None:
+                    finished += 1
+            raise
+
+        for future in futures:
+            future.result()
+
+    return [reports[path] for path in auth_file_paths]
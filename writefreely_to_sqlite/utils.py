@@ -0,0 +1,288 @@
+import codecs
+import json
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+def chunks(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Split an iterable into lists of at most size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class NeedMoreData(Exception):
+    pass
+
+
+class JSONArrayParser:
+    """
+    An incremental parser for the array stored under key in a JSON object.
+
+    Bytes are fed to the parser as they arrive and the complete items of the
+    array are returned as soon as they can be decoded. Only the part of the
+    document that is currently being decoded is kept in memory, so
+    arbitrarily large arrays can be walked item by item. Other members of
+    the object are skipped.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.state = "object"
+        self.member: Any = None
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        Add a chunk of bytes, returns the array items it completed.
+        """
+        self.add(chunk)
+        return self.parse()
+
+    def close(self) -> List[Any]:
+        """
+        Signal the end of the stream, returns any remaining array items.
+        """
+        self.finish()
+        return self.parse()
+
+    def add(self, chunk: bytes):
+        """
+        Add a chunk of bytes to the buffer without parsing it.
+        """
+        self.extend(self.text_decoder.decode(chunk))
+
+    def finish(self):
+        """
+        Signal the end of the stream without parsing the rest of it.
+        """
+        self.eof = True
+        self.extend(self.text_decoder.decode(b"", final=True))
+
+    def extend(self, text: str):
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+
+    def parse(self) -> List[Any]:
+        items: List[Any] = []
+        try:
+            while self.done is False:
+                self.step(items)
+        except NeedMoreData:
+            if self.eof:
+                raise ValueError("Unexpected end of JSON stream.")
+        return items
+
+    def peek(self) -> str:
+        """
+        Returns the next non-whitespace character without consuming it.
+        """
+        while self.pos < len(self.buffer):
+            if self.buffer[self.pos] not in JSON_WHITESPACE:
+                return self.buffer[self.pos]
+            self.pos += 1
+        raise NeedMoreData()
+
+    def expect(self, char: str):
+        """
+        Consume the next non-whitespace character, which must be char.
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                f"Expected {char!r} in JSON stream, got {found!r}."
+            )
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """
+        Decode the next complete JSON value.
+        """
+        self.peek()
+
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if self.eof:
+                raise
+            raise NeedMoreData()
+
+        # A number (or literal) at the very end of the buffer might be cut
+        # off by the chunk boundary, so make sure it is complete.
+        if end == len(self.buffer) and self.eof is False:
+            raise NeedMoreData()
+
+        self.pos = end
+        return value
+
+    def step(self, items: List[Any]):
+        """
+        Advance the parser by one token. The state only changes once the
+        token has been consumed, so a step can be retried with more data.
+        """
+        if self.state == "object":
+            self.expect("{")
+            self.state = "member"
+        elif self.state == "member":
+            if self.peek() == "}":
+                self.pos += 1
+                self.state = "done"
+                return
+            self.member = self.decode()
+            self.state = "colon"
+        elif self.state == "colon":
+            self.expect(":")
+            self.state = "array" if self.member == self.key else "value"
+        elif self.state == "value":
+            self.decode()
+            self.state = "after_value"
+        elif self.state == "after_value":
+            if self.peek() == ",":
+                self.pos += 1
+            self.state = "member"
+        elif self.state == "array":
+            self.expect("[")
+            self.state = "first_item"
+        elif self.state == "first_item":
+            if self.peek() == "]":
+                self.pos += 1
+                self.state = "done"
+                return
+            self.state = "item"
+        elif self.state == "item":
+            items.append(self.decode())
+            self.state = "after_item"
+        elif self.state == "after_item":
+            if self.peek() == ",":
+                self.pos += 1
+                self.state = "item"
+                return
+            self.expect("]")
+            self.state = "done"
+
+
+def iter_json_array(byte_chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    Incrementally parse the array stored under key in a JSON object, yielding
+    one item at a time.
+    """
+    parser = JSONArrayParser(key)
+
+    for chunk in byte_chunks:
+        yield from parser.feed(chunk)
+        if parser.done:
+            return
+
+    yield from parser.close()
+
+
+class JSONReader:
+    """
+    A pull parser for walking nested JSON documents read from a stream of
+    bytes.
+
+    The reader pulls chunks from the stream as it needs them, so only the
+    value being decoded is kept in memory. Objects and arrays can be walked
+    member by member and item by item with iter_object and iter_array, or
+    decoded whole with decode. The tokens are read with a JSONArrayParser,
+    whose state machine isn't used, so its key doesn't matter.
+    """
+
+    def __init__(self, byte_chunks: Iterable[bytes]):
+        self.byte_chunks = iter(byte_chunks)
+        self.parser = JSONArrayParser("")
+
+    def pull(self, read: Callable[[], T]) -> T:
+        """
+        Call one of the parser's read methods, feeding it chunks from the
+        stream until it has enough data.
+        """
+        while True:
+            try:
+                return read()
+            except NeedMoreData:
+                if self.parser.eof:
+                    raise ValueError("Unexpected end of JSON stream.")
+
+            chunk = next(self.byte_chunks, None)
+            if chunk is None:
+                self.parser.finish()
+            else:
+                self.parser.add(chunk)
+
+    def peek(self) -> str:
+        """
+        Returns the next non-whitespace character without consuming it.
+        """
+        return self.pull(self.parser.peek)
+
+    def expect(self, char: str):
+        """
+        Consume the next non-whitespace character, which must be char.
+        """
+        self.pull(lambda: self.parser.expect(char))
+
+    def decode(self) -> Any:
+        """
+        Decode the next complete JSON value.
+        """
+        return self.pull(self.parser.decode)
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Walk the next JSON object, yielding the key of each member. The
+        member's value has to be consumed before the next key is read.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.expect("}")
+            return
+
+        while True:
+            key = self.decode()
+            self.expect(":")
+            yield key
+
+            if self.peek() == ",":
+                self.expect(",")
+                continue
+            self.expect("}")
+            return
+
+    def iter_array(self) -> Iterator[int]:
+        """
+        Walk the next JSON array, yielding the index of each item. The item
+        has to be consumed before the next index is read.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.expect("]")
+            return
+
+        index = 0
+        while True:
+            yield index
+            index += 1
+
+            if self.peek() == ",":
+                self.expect(",")
+                continue
+            self.expect("]")
+            return